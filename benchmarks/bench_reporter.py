@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Benchmark Reporter.update_report for a GPU-sized report.
+
+Builds a GpuHealthCheck-like report for 8 GPUs carrying 50 XIDs and measures
+the per-update cost of:
+  - unchanged: the same content again (the common case, every 60s tick),
+  - changed: content that differs from the stored report,
+  - evolve: KmsgReader-style read of the stored report with get_report, then
+    an update of a report derived from it with evolve,
+  - both again with the StateStore recording, which also encodes every change
+    for the journal (the journal itself is not written while timing),
+and, for reference, the previous change detection (dataclasses.asdict on
+both reports, then deepcopy of the changed report) and the previous read
+(get_report returned a deepcopy).
+
+Usage:
+    python3 benchmarks/bench_reporter.py [--gpus 8] [--xids 50] [--iterations 2000]
+"""
+import argparse
+import asyncio
+import copy
+import logging
+import tempfile
+import time
+from dataclasses import asdict
+from healthagent.config import StateConfig
+from healthagent.reporter import Reporter, HealthReport, HealthStatus
+from healthagent.statestore import StateStore
+from healthagent.ghr import GHRCategory
+
+
+def build_report(gpus: int, xids: int, variant: int = 0) -> HealthReport:
+    custom_fields = {"error_count": xids, "warning_count": 0, "category": {"XID"}}
+    for gpu in range(gpus):
+        custom_fields[f"GPU_{gpu}"] = {"errors": [], "warnings": [], "xid": []}
+    for i in range(xids):
+        gpu_id = f"GPU_{i % gpus}"
+        timestamp = f"2026-01-01T00:{i // 60:02d}:{i % 60:02d} UTC"
+        entry = {"xid": 43 + i + variant, "timestamp": timestamp}
+        custom_fields[gpu_id]["xid"].append(entry)
+        custom_fields[gpu_id]["errors"].append(f"[{gpu_id}] XID {entry['xid']} at {timestamp}")
+    details = "\n".join(err for gpu in range(gpus) for err in custom_fields[f"GPU_{gpu}"]["errors"])
+    return HealthReport(status=HealthStatus.ERROR,
+                        description=f"GpuHealthCheck report {xids} errors, 0 warnings of type XID",
+                        details=details,
+                        custom_fields=custom_fields,
+                        ghr_category=GHRCategory.GPU_XID_ERROR)
+
+
+def legacy_update(store: dict, name: str, report: HealthReport):
+    """The previous change detection, kept here as the baseline."""
+    last = store.get(name)
+    changed = True
+    if last is not None:
+        d1, d2 = asdict(last), asdict(report)
+        d1.pop("last_update", None)
+        d2.pop("last_update", None)
+        changed = d1 != d2
+    if changed:
+        store[name] = copy.deepcopy(report)
+
+
+def per_update(seconds: float, iterations: int) -> str:
+    return f"{seconds / iterations * 1e6:10.1f} us/update"
+
+
+async def main(gpus: int, xids: int, iterations: int):
+    reporter = Reporter()
+    reporter.publish_cc = False
+    name = "GpuHealthCheck"
+    variants = [build_report(gpus, xids, variant) for variant in (0, 1)]
+    print(f"Report: {gpus} GPUs, {xids} XIDs, {len(variants[0].details)} bytes of details")
+
+    # Modules build a new report every tick, copies are prepared outside of the timed loop.
+    unchanged = [copy.deepcopy(variants[0]) for _ in range(iterations)]
+    changed = [copy.deepcopy(variants[i % 2]) for i in range(iterations)]
+
+    await reporter.update_report(name, copy.deepcopy(variants[0]))
+    start = time.perf_counter()
+    for report in unchanged:
+        await reporter.update_report(name, report)
+    print(f"update_report unchanged: {per_update(time.perf_counter() - start, iterations)}")
+
+    start = time.perf_counter()
+    for report in changed:
+        await reporter.update_report(name, report)
+    print(f"update_report changed:   {per_update(time.perf_counter() - start, iterations)}")
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        report = reporter.get_report(name).evolve(details=f"kernel message {i}")
+        await reporter.update_report(name, report)
+    print(f"get_report + evolve:     {per_update(time.perf_counter() - start, iterations)}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        StateStore.configure(StateConfig(flush_interval=3600), directory=directory)
+        await StateStore.load()
+        reporter.module = "gpu"
+        changed = [copy.deepcopy(variants[i % 2]) for i in range(iterations)]
+        start = time.perf_counter()
+        for report in changed:
+            await reporter.update_report(name, report)
+        print(f"changed, journaled:      {per_update(time.perf_counter() - start, iterations)}")
+        start = time.perf_counter()
+        for i in range(iterations):
+            report = reporter.get_report(name).evolve(details=f"kernel message {i}")
+            await reporter.update_report(name, report)
+        print(f"evolve, journaled:       {per_update(time.perf_counter() - start, iterations)}")
+        StateStore.configure(StateConfig(), directory=None)
+
+    store = {name: copy.deepcopy(variants[0])}
+    unchanged = [copy.deepcopy(variants[0]) for _ in range(iterations)]
+    changed = [copy.deepcopy(variants[i % 2]) for i in range(iterations)]
+    start = time.perf_counter()
+    for report in unchanged:
+        legacy_update(store, name, report)
+    print(f"baseline unchanged:      {per_update(time.perf_counter() - start, iterations)}")
+    start = time.perf_counter()
+    for report in changed:
+        legacy_update(store, name, report)
+    print(f"baseline changed:        {per_update(time.perf_counter() - start, iterations)}")
+    start = time.perf_counter()
+    for i in range(iterations):
+        report = copy.deepcopy(store[name])
+        report.details = f"kernel message {i}"
+        legacy_update(store, name, report)
+    print(f"baseline deepcopy read:  {per_update(time.perf_counter() - start, iterations)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gpus", type=int, default=8)
+    parser.add_argument("--xids", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+    # update_report logs every change at INFO.
+    logging.getLogger("healthagent").setLevel(logging.WARNING)
+    asyncio.run(main(args.gpus, args.xids, args.iterations))
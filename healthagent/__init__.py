@@ -1,4 +1,4 @@
-def healthcheck(name, args=None, description=None):
+def healthcheck(name, args=None, description=None, exclusive=None, shared=None):
     """Declare a function as a named healthcheck.
     The name is the report key visible in `health -s` output and
     can be targeted by using `-c/--check <name>` with `health -e` / `health -p`.
@@ -7,11 +7,18 @@ def healthcheck(name, args=None, description=None):
         name: Report key name.
         args: Optional list of user-facing argument names (e.g. ["gpu_id"]).
         description: Optional short description. Falls back to the function's docstring.
+        exclusive: Optional list of resources the check needs to itself, e.g. ["gpu:gpu_id"]
+                   claims the GPUs passed in the gpu_id argument (all GPUs without it).
+        shared: Optional list of resources the check only reads, e.g. ["proc"].
+                Checks of a module run concurrently during prolog/epilog when their resources
+                do not conflict. A check declaring neither conflicts with every other check.
     """
     def decorator(func):
         func.report_name = name
         func.healthcheck_args = args or []
         func.healthcheck_description = description
+        func.healthcheck_exclusive = exclusive
+        func.healthcheck_shared = shared
         return func
     return decorator
 
@@ -0,0 +1,71 @@
+import os
+import logging
+from healthagent import healthcheck
+from healthagent.scheduler import Scheduler
+from healthagent.healthmodule import HealthModule
+from healthagent.config import AgentConfig
+from healthagent.reporter import Reporter, HealthStatus, HealthReport
+
+log = logging.getLogger(__name__)
+
+
+class AgentHealthChecks(HealthModule):
+    """
+    Health of healthagent itself.
+
+    Event loop stalls (see Scheduler.start_loop_monitor) are compared to the systemd
+    watchdog timeout: a stall longer than the timeout delays the watchdog ping and gets
+    the agent restarted, so repeated long stalls are reported before that happens.
+      - WARNING: lag_strikes stalls within lag_window exceed lag_warning_pct% of the timeout.
+      - ERROR: a stall within lag_window exceeds lag_error_pct% of the timeout.
+    """
+
+    def __init__(self, reporter: Reporter, config: 'AgentConfig | None' = None):
+        super().__init__(reporter, config or AgentConfig())
+
+    @staticmethod
+    def watchdog_timeout() -> float | None:
+        """systemd watchdog timeout in seconds, None when not running under a watchdog."""
+        try:
+            usec = int(os.environ.get("WATCHDOG_USEC", ""))
+        except ValueError:
+            return None
+        return usec / 1e6 if usec > 0 else None
+
+    async def create(self):
+        Scheduler.add_task(self.check_event_loop)
+
+    def evaluate_stalls(self, stalls: list, budget: float | None) -> HealthReport:
+        report = HealthReport()
+        if not stalls or budget is None:
+            return report
+        warn = [s for s in stalls if s["lag"] >= budget * self.config.lag_warning_pct / 100]
+        worst = max(stalls, key=lambda s: s["lag"])
+        if worst["lag"] >= budget * self.config.lag_error_pct / 100:
+            report.escalate(HealthStatus.ERROR)
+            report.description = "healthagent event loop stalled close to the watchdog timeout"
+        elif len(warn) >= self.config.lag_strikes:
+            report.escalate(HealthStatus.WARNING)
+            report.description = "healthagent event loop repeatedly stalled"
+        else:
+            return report
+        msgs = [f"{len(stalls)} event loop stalls in the last {self.config.lag_window}s "
+                f"(watchdog timeout: {budget:.0f}s), longest {worst['lag']:.1f}s in {worst['task']}"]
+        for stall in sorted(warn, key=lambda s: s["lag"], reverse=True)[:5]:
+            msgs.append(f"{stall['lag']:.1f}s in {stall['task']}"
+                        + (f" at {stall['location']}" if stall["location"] else ""))
+        report.details = "\n".join(msgs)
+        return report
+
+    @healthcheck("EventLoopLag", description="Detect healthagent event loop stalls that threaten the systemd watchdog")
+    @Scheduler.periodic(60, fixed_rate=True, jitter=15)
+    async def check_event_loop(self):
+        """
+        Compares recent event loop stalls to the systemd watchdog timeout.
+        """
+        name = self.check_event_loop.report_name
+        monitor = Scheduler.loop_monitor
+        stalls = monitor.recent_stalls(self.config.lag_window) if monitor is not None else []
+        report = self.evaluate_stalls(stalls, self.watchdog_timeout())
+        await self.reporter.update_report(name=name, report=report)
+        return {name: report.view()}
@@ -72,6 +72,7 @@ class SystemdMonitor(HealthModule):
                 except Exception as e:
                     log.error(e)
 
+    @Scheduler.thread(pool="journal")
     def get_journal_entries(self, service_name):
         """Prints the last `num_entries` lines of journal logs for a given systemd service."""
         num_entries = 10
@@ -137,7 +138,7 @@ class SystemdMonitor(HealthModule):
             svc_status = HealthStatus.ERROR if state == "failed" else HealthStatus.OK
             custom_fields[svc] = {"status": svc_status.value, "last_update": now}
             if state == "failed":
-                custom_fields[svc]['error'] = self.get_journal_entries(service_name=svc)
+                custom_fields[svc]['error'] = await Scheduler.run_in_thread(self.get_journal_entries, service_name=svc)
 
         if failed_services:
             description = ", ".join(failed_services) + " unhealthy"
@@ -4,37 +4,41 @@ import sys
 import socket
 import json
 import yaml
+from healthagent.protocol import MAGIC, ProtocolError, frame, recv_exactly, recv_frame
 
 SOCKET_PATH = "/opt/healthagent/run/health.sock"
 MESSAGE_SIZE = 4096
+# Seconds to wait for prolog/epilog results, also sent to the daemon as the request deadline.
+ACTIVE_CHECK_TIMEOUT = 1200
+# Seconds without any event or heartbeat after which -w/--watch gives up, a few daemon heartbeats.
+WATCH_TIMEOUT = 120
+
+def request_once(command, timeout, path=SOCKET_PATH):
+    """Send a single request on a connection of its own, the protocol every daemon version speaks."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
+        client_socket.settimeout(timeout)
+        client_socket.connect(path)
+        # Always send JSON
+        client_socket.sendall(json.dumps(command).encode())
+        client_socket.shutdown(socket.SHUT_WR)
+        # Now wait for full response
+        chunks = []
+        while chunk := client_socket.recv(MESSAGE_SIZE):
+            chunks.append(chunk)
+        return b"".join(chunks)
+
 
 def get_response(command, timeout):
     try:
-        # Create a Unix domain socket
-        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
-            client_socket.settimeout(timeout)
-            # Connect to the Unix socket
-            client_socket.connect(SOCKET_PATH)
-
-            # Always send JSON
-            client_socket.sendall(json.dumps(command).encode())
-            client_socket.shutdown(socket.SHUT_WR)
-            # Now wait for full response
-            response = b''
-            while True:
-                chunk = client_socket.recv(MESSAGE_SIZE)
-                if not chunk:
-                    # Server closed connection
-                    break
-                response += chunk
-            try:
-                return json.loads(response.decode())
-            except json.JSONDecodeError as e:
-                logging.error(f"Unable to parse json: {response}")
-                return None
-            except Exception as e:
-                logging.exception(e)
-                return None
+        response = request_once(command, timeout)
+        try:
+            return json.loads(response.decode())
+        except json.JSONDecodeError as e:
+            logging.error(f"Unable to parse json: {response}")
+            return None
+        except Exception as e:
+            logging.exception(e)
+            return None
 
     except (ConnectionRefusedError, FileNotFoundError) as e:
         logging.error("Connection to Healthagent could not be established, is Healthagent running?")
@@ -46,6 +50,131 @@ def get_response(command, timeout):
         logging.error(f"An unexpected error occurred: {e}")
         return None
 
+
+class HealthClient:
+    """
+    Connection to the daemon for many requests, eg. a monitoring sidecar polling status.
+
+    Uses the framed protocol (see healthagent.protocol): the connection is kept open and
+    pipeline() sends several requests before reading their responses. With a daemon that
+    does not answer the protocol handshake within `negotiate_timeout` seconds (an older
+    version), every request falls back to a connection of its own.
+
+        with HealthClient() as client:
+            status, checks, version = client.pipeline([{"command": "status"},
+                                                       {"command": "list_checks", "type": "all"},
+                                                       {"command": "version"}])
+
+    Errors returned by the daemon raise ProtocolError, connection errors raise OSError.
+    """
+
+    def __init__(self, path=SOCKET_PATH, timeout=30, negotiate_timeout=1):
+        self.path = path
+        self.timeout = timeout
+        self.negotiate_timeout = negotiate_timeout
+        self.framed = None
+        self._socket = None
+        self._next_id = 0
+
+    def connect(self):
+        if self._socket is not None or self.framed is False:
+            return
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            sock.sendall(MAGIC)
+            sock.settimeout(self.negotiate_timeout)
+            try:
+                answer = recv_exactly(sock, len(MAGIC))
+            except (socket.timeout, ConnectionError):
+                answer = None
+            if answer != MAGIC:
+                logging.debug("Healthagent does not support the framed protocol, using a connection per request")
+                sock.close()
+                self.framed = False
+                return
+            sock.settimeout(self.timeout)
+        except BaseException:
+            sock.close()
+            raise
+        self._socket = sock
+        self.framed = True
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def request(self, command: dict):
+        return self.pipeline([command])[0]
+
+    def pipeline(self, commands: list) -> list:
+        """Responses to commands, in the same order. All the requests are sent before any response is read."""
+        self.connect()
+        if not self.framed:
+            return [json.loads(request_once(command, self.timeout, path=self.path)) for command in commands]
+        ids = []
+        try:
+            data = []
+            for command in commands:
+                self._next_id += 1
+                ids.append(self._next_id)
+                data.append(frame(json.dumps({**command, "id": self._next_id}).encode()))
+            self._socket.sendall(b"".join(data))
+            responses = {}
+            while len(responses) < len(ids):
+                message = json.loads(recv_frame(self._socket))
+                responses[message.get("id")] = message
+        except BaseException:
+            # Responses left unread would be taken for the next ones.
+            self.close()
+            raise
+        results = []
+        for request_id in ids:
+            message = responses[request_id]
+            if "error" in message:
+                raise ProtocolError(message["error"])
+            results.append(message.get("response"))
+        return results
+
+
+def watch_events(timeout):
+    """Print report events as newline delimited JSON as the daemon streams them, until interrupted."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
+            # The daemon sends a heartbeat when there are no events, a longer silence means it is gone.
+            client_socket.settimeout(timeout)
+            client_socket.connect(SOCKET_PATH)
+            client_socket.sendall(json.dumps({"command": "subscribe"}).encode())
+            client_socket.shutdown(socket.SHUT_WR)
+            for line in client_socket.makefile("r"):
+                event = json.loads(line)
+                if event.get("event") == "heartbeat":
+                    continue
+                if event.get("event") == "error":
+                    logging.error(event.get("error"))
+                    sys.exit(-1)
+                print(json.dumps(event), flush=True)
+            logging.error("Healthagent closed the connection")
+            sys.exit(-1)
+    except KeyboardInterrupt:
+        return
+    except (ConnectionRefusedError, FileNotFoundError):
+        logging.error("Connection to Healthagent could not be established, is Healthagent running?")
+    except socket.timeout:
+        logging.error("Socket Timed out!!")
+    except json.JSONDecodeError as e:
+        logging.error(f"Unable to parse json: {e}")
+    sys.exit(-1)
+
 def parse_check_args(check_groups):
     """Parse -c groups into a checks dict.
 
@@ -79,6 +208,13 @@ def print_bash_friendly(result):
 
     res = {}
     for module_name, checks in result.items():
+        if module_name == "timing":
+            # prolog/epilog timing of each module, not a module
+            continue
+        if isinstance(checks, int):
+            # Counted by the daemon (status in the bash format)
+            res[module_name] = checks
+            continue
         total_errors = sum(
             check.get('error_count', 1)
             for check in checks.values()
@@ -125,6 +261,105 @@ def print_checks_table(response, check_type="all"):
     for row in rows:
         print(fmt.format(*row))
 
+def print_tasks_table(response):
+    """Format scheduler_stats response as a table, most expensive tasks first."""
+    tasks = response.get("tasks", {})
+    if not tasks:
+        print("No tasks found.")
+        return
+
+    def fmt(value, suffix=""):
+        if value is None:
+            return "-"
+        if isinstance(value, float):
+            return f"{value:.3f}{suffix}"
+        return f"{value}{suffix}"
+
+    rows = []
+    ordered = sorted(tasks.items(), key=lambda kv: (kv[1].get("latency", {}).get("p95") or 0), reverse=True)
+    for name, info in ordered:
+        latency = info.get("latency", {})
+        interval = info.get("interval")
+        # peak RSS of subprocesses
+        rss = info.get("peak_rss", {}).get("max")
+        rows.append((
+            name,
+            info.get("kind", ""),
+            info.get("state", ""),
+            fmt(interval, "s") if isinstance(interval, (int, float)) and interval > 0 else "-",
+            fmt(info.get("run_count")),
+            fmt(info.get("exception_count")),
+            fmt(info.get("timeout_count")),
+            fmt(info.get("missed_ticks")),
+            fmt(info.get("last_duration")),
+            fmt(latency.get("p50")),
+            fmt(latency.get("p95")),
+            fmt(latency.get("max")),
+            f"{rss / 2**20:.1f}" if rss else "-",
+            fmt(info.get("next_due")),
+        ))
+
+    headers = ("Task", "Kind", "State", "Interval", "Runs", "Errors", "Timeouts", "Missed", "Last(s)", "p50(s)", "p95(s)", "Max(s)", "RSS(MB)", "Next Due")
+    col_widths = [len(h) for h in headers]
+    for row in rows:
+        for i, val in enumerate(row):
+            col_widths[i] = max(col_widths[i], len(val))
+
+    fmt_row = "  ".join(f"{{:<{w}}}" for w in col_widths)
+    print(fmt_row.format(*headers))
+    print(fmt_row.format(*("-" * w for w in col_widths)))
+    for row in rows:
+        print(fmt_row.format(*row))
+
+    subprocesses = response.get("subprocesses")
+    lanes = response.get("lanes")
+    threads = response.get("threads")
+    publisher = response.get("publisher")
+    subscribers = response.get("subscribers")
+    sinks = response.get("sinks")
+    requests = response.get("requests")
+    loop = response.get("loop")
+    if subprocesses or lanes or threads or publisher or subscribers or sinks or requests or loop:
+        print()
+    if subprocesses:
+        print(f"subprocesses: {subprocesses.get('running')} running, {subprocesses.get('queued')} queued, "
+              f"limit {subprocesses.get('limit')}")
+    if publisher:
+        latency = publisher.get("latency", {})
+        print(f"node conditions: {publisher.get('queued')} queued ({publisher.get('waiting_for_token')} throttled), "
+              f"{publisher.get('in_flight')} publishing, "
+              f"{publisher.get('published')} published, {publisher.get('coalesced')} coalesced, "
+              f"{publisher.get('retries')} retries, {publisher.get('failed')} failed, "
+              f"latency p95 {fmt(latency.get('p95'), 's')}, max {fmt(latency.get('max'), 's')}")
+    if subscribers:
+        print(f"report subscribers: {subscribers.get('subscribers')}, {subscribers.get('queued')} events queued")
+    if requests:
+        print(f"requests: {requests.get('executed')} executed, {requests.get('joined')} joined in flight, "
+              f"{requests.get('reused')} reused, {requests.get('in_flight')} in flight, {requests.get('cached')} cached")
+    for name, info in (sinks or {}).items():
+        print(f"{name} sink: {info.get('pending')} pending, {info.get('written')} written in "
+              f"{info.get('batches')} batches, {info.get('failed')} failed ({info.get('path')})")
+    for pool, info in (threads or {}).items():
+        wait = info.get("wait", {})
+        print(f"{pool} threads: {info.get('running')} running, {info.get('queued')} queued, "
+              f"{info.get('workers')} workers, {info.get('completed')} completed, "
+              f"wait p95 {fmt(wait.get('p95'), 's')}, max {fmt(wait.get('max'), 's')}")
+    if lanes:
+        for lane, info in lanes.items():
+            wait = info.get("wait", {})
+            print(f"{lane} lane wait: count {fmt(wait.get('count'))}, p50 {fmt(wait.get('p50'), 's')}, "
+                  f"p95 {fmt(wait.get('p95'), 's')}, max {fmt(wait.get('max'), 's')}")
+    if loop:
+        lag = loop.get("lag", {})
+        print(f"event loop lag: p50 {fmt(lag.get('p50'), 's')}, p95 {fmt(lag.get('p95'), 's')}, "
+              f"max {fmt(lag.get('max'), 's')}, stalls {loop.get('stall_count')} "
+              f"(threshold {loop.get('stall_threshold')}s)")
+        for task, count in loop.get("stalls_by_task", {}).items():
+            print(f"  stalled in {task}: {count}")
+        for stall in loop.get("recent_stalls", [])[-5:]:
+            print(f"  {stall['time']}  {stall['lag']}s in {stall['task']}"
+                  + (f" at {stall['location']}" if stall.get("location") else ""))
+
 def run_command(command, timeout, bash=False):
     response = get_response(command=command, timeout=timeout)
     if not response:
@@ -160,12 +395,41 @@ def main():
         "-C", "--show-config", action="store_true",
         help="Show the effective (merged) configuration loaded by the running daemon"
     )
+    group.add_argument(
+        "-t", "--tasks", action="store_true",
+        help="Show scheduler tasks with run counts and latency statistics"
+    )
+    group.add_argument(
+        "-w", "--watch", action="store_true",
+        help="Stream report changes as they happen, one JSON event per line, until interrupted"
+    )
 
     parser.add_argument(
         "-c", "--check", action="append", nargs="+", metavar="NAME",
         help="Run a prolog/epilog check by name, with optional key=value args. "
              "Repeatable. Example: -c GpuMemoryCheck gpu_id=0,1 -c GpuDiagnosticCheck"
     )
+    control = parser.add_mutually_exclusive_group(required=False)
+    control.add_argument("--pause", metavar="TASK", help="Pause a periodic task by name (see health -t)")
+    control.add_argument("--resume", metavar="TASK", help="Resume a paused or cancelled periodic task")
+    control.add_argument("--cancel", metavar="TASK", help="Stop a periodic task from running again")
+    control.add_argument(
+        "--reschedule", nargs=2, metavar=("TASK", "SECONDS"),
+        help="Change the interval of a periodic task. Example: health --reschedule NetworkHealthChecks.run_network_checks 300"
+    )
+    parser.add_argument(
+        "--since", type=int, metavar="VERSION",
+        help="With -s, only return the reports that changed after VERSION, the version returned by the previous call. "
+             "Use 0 for all reports."
+    )
+    parser.add_argument(
+        "-m", "--module", action="append", metavar="NAME",
+        help="With -s, only return the reports of this module. Repeatable. Example: -s -m gpu -m network"
+    )
+    parser.add_argument(
+        "--fields", metavar="FIELDS",
+        help="With -s, only return these fields of each report, comma separated. Example: --fields status,error_count"
+    )
     parser.add_argument("-b", "--bash", action="store_true", default=False, help="Export results into bash friendly variables")
 
     args = parser.parse_args()
@@ -175,19 +439,66 @@ def main():
         level=logging.ERROR
         )
 
-    if not (args.epilog or args.prolog or args.version or args.list_checks or args.show_config):
+    task_action = None
+    if args.pause:
+        task_action = {"action": "pause", "task": args.pause}
+    elif args.resume:
+        task_action = {"action": "resume", "task": args.resume}
+    elif args.cancel:
+        task_action = {"action": "cancel", "task": args.cancel}
+    elif args.reschedule:
+        try:
+            interval = float(args.reschedule[1])
+        except ValueError:
+            parser.error(f"--reschedule interval must be a number of seconds, got {args.reschedule[1]}")
+        task_action = {"action": "reschedule", "task": args.reschedule[0], "interval": interval}
+
+    if task_action and (args.epilog or args.prolog or args.status or args.version or args.list_checks or args.show_config or args.watch):
+        parser.error("--pause/--resume/--cancel/--reschedule can only be combined with -t/--tasks")
+
+    if not (args.epilog or args.prolog or args.version or args.list_checks or args.show_config or args.tasks or args.watch or task_action):
         args.status = True
 
+    if args.since is not None:
+        if not args.status:
+            parser.error("--since can only be used with -s/--status")
+        if args.bash:
+            parser.error("--since cannot be combined with -b/--bash")
+
     checks = parse_check_args(args.check)
 
-    if checks and not (args.epilog or args.prolog):
-        parser.error("-c/--check can only be used with -e/--epilog or -p/--prolog")
+    if checks and not (args.epilog or args.prolog or args.status):
+        parser.error("-c/--check can only be used with -e/--epilog, -p/--prolog or -s/--status")
+    if checks and args.status and any(checks.values()):
+        parser.error("-c/--check only takes report names with -s/--status")
+    if (args.module or args.fields) and not args.status:
+        parser.error("-m/--module and --fields can only be used with -s/--status")
+    if (checks or args.module or args.fields) and args.status and args.since is not None:
+        parser.error("-c/--check, -m/--module and --fields cannot be combined with --since")
+
+    if args.watch and args.bash:
+        parser.error("-w/--watch cannot be combined with -b/--bash")
 
     if args.show_config:
         response = get_response(command={"command": "show_config"}, timeout=10)
         if not response:
             sys.exit(-1)
         print(yaml.safe_dump(response, default_flow_style=False, sort_keys=False))
+    elif task_action:
+        response = get_response(command={"command": "task_control", **task_action}, timeout=10)
+        if not response:
+            sys.exit(-1)
+        if "error" in response:
+            logging.error(response["error"])
+            sys.exit(-1)
+        print_tasks_table(response)
+    elif args.watch:
+        watch_events(timeout=WATCH_TIMEOUT)
+    elif args.tasks:
+        response = get_response(command={"command": "scheduler_stats"}, timeout=10)
+        if not response:
+            sys.exit(-1)
+        print_tasks_table(response)
     elif args.list_checks:
         command = {"command": "list_checks", "type": "all"}
         response = get_response(command=command, timeout=10)
@@ -195,17 +506,29 @@ def main():
             sys.exit(-1)
         print_checks_table(response, check_type=args.list_checks)
     elif args.epilog:
-        command = {"command": "epilog"}
+        command = {"command": "epilog", "timeout": ACTIVE_CHECK_TIMEOUT}
         if checks:
             command["checks"] = checks
-        run_command(command=command, timeout=1200)
+        run_command(command=command, timeout=ACTIVE_CHECK_TIMEOUT)
     elif args.prolog:
-        command = {"command": "prolog"}
+        command = {"command": "prolog", "timeout": ACTIVE_CHECK_TIMEOUT}
         if checks:
             command["checks"] = checks
-        run_command(command=command, timeout=1200)
+        run_command(command=command, timeout=ACTIVE_CHECK_TIMEOUT)
+    elif args.status and args.since is not None:
+        run_command(command={"command": "status_since", "since": args.since}, timeout=30)
     elif args.status:
-        run_command(command={"command": "status"}, timeout=30, bash=args.bash)
+        command = {"command": "status"}
+        if args.module:
+            command["modules"] = args.module
+        if checks:
+            command["checks"] = list(checks)
+        if args.fields:
+            command["fields"] = args.fields
+        if args.bash:
+            # The daemon only sends the error count of each module
+            command["format"] = "bash"
+        run_command(command=command, timeout=30, bash=args.bash)
     elif args.version:
         run_command(command={"command": "version"}, timeout=5)
     else:
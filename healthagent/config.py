@@ -34,6 +34,7 @@ class ModuleName(StrEnum):
     NETWORK = "network"
     KMSG = "kmsg"
     PROC = "proc"
+    AGENT = "agent"
 
 
 class ThresholdCheck(BaseModel, extra="forbid"):
@@ -64,6 +65,16 @@ class ThresholdCheck(BaseModel, extra="forbid"):
 class ModuleConfig(BaseModel):
     """Base config shared by all health modules."""
     services: list[str] = []
+    # Seconds the prolog, epilog or status handlers of the module may take together,
+    # None for no limit other than the deadline of the request.
+    timeout: int | float | None = None
+
+    @field_validator('timeout')
+    @classmethod
+    def timeout_must_be_positive(cls, v):
+        if v is not None and v <= 0:
+            raise ValueError('timeout must be > 0')
+        return v
 
 
 class NetworkConfig(ModuleConfig):
@@ -103,13 +114,222 @@ class ProcConfig(ModuleConfig):
     pid_saturation_pct: int | float = 50
 
 
+class SchedulerConfig(BaseModel, extra="forbid"):
+    # Seconds a subprocess (eg. jetpack) may run before it is killed, 0 disables.
+    subprocess_timeout: int | float = 300
+    # Subprocesses allowed to run at once, the rest are queued.
+    subprocess_concurrency: int = 4
+    # Per-task timeouts in seconds, by the task name shown by `health -t`.
+    timeouts: dict[str, int | float] = {}
+    # Event loop lag (seconds) above which the loop is considered stalled and
+    # the stack of the stalled task is captured.
+    stall_threshold: int | float = 1.0
+    # Threads of each named pool running @Scheduler.thread tasks (default 2).
+    thread_pools: dict[str, int] = {}
+
+    @field_validator('stall_threshold')
+    @classmethod
+    def stall_threshold_must_be_positive(cls, v):
+        if v <= 0:
+            raise ValueError('stall_threshold must be > 0')
+        return v
+
+    @field_validator('subprocess_timeout')
+    @classmethod
+    def subprocess_timeout_must_be_non_negative(cls, v):
+        if v < 0:
+            raise ValueError('subprocess_timeout must be >= 0')
+        return v
+
+    @field_validator('subprocess_concurrency')
+    @classmethod
+    def subprocess_concurrency_must_be_positive(cls, v):
+        if v < 1:
+            raise ValueError('subprocess_concurrency must be >= 1')
+        return v
+
+    @field_validator('timeouts')
+    @classmethod
+    def timeouts_must_be_positive(cls, v):
+        for name, timeout in v.items():
+            if timeout <= 0:
+                raise ValueError(f'timeout for {name} must be > 0')
+        return v
+
+    @field_validator('thread_pools')
+    @classmethod
+    def thread_pools_must_be_positive(cls, v):
+        for name, size in v.items():
+            if size < 1:
+                raise ValueError(f'thread pool {name} must have >= 1 threads')
+        return v
+
+
+class ReporterConfig(BaseModel, extra="forbid"):
+    # Changes of a report within this many seconds of the first one are published
+    # together, as a single jetpack node condition with the latest state.
+    debounce: int | float = 1.0
+    # Up to this many more seconds, drawn from a generator seeded with the hostname
+    # so that nodes reporting a shared failure publish spread apart.
+    jitter: int | float = 5.0
+    # Publishes allowed per second, and in a burst. Waiting publishes go in order
+    # of severity: ERROR, WARNING, then OK.
+    rate: int | float = 0.5
+    burst: int = 5
+    # A failed publish is retried after retry_backoff seconds, doubling up to
+    # retry_backoff_max, at most max_retries times.
+    retry_backoff: int | float = 5
+    retry_backoff_max: int | float = 300
+    max_retries: int = 5
+
+    @field_validator('debounce', 'jitter')
+    @classmethod
+    def delay_must_be_non_negative(cls, v):
+        if v < 0:
+            raise ValueError('debounce and jitter must be >= 0')
+        return v
+
+    @field_validator('rate')
+    @classmethod
+    def rate_must_be_positive(cls, v):
+        if v <= 0:
+            raise ValueError('rate must be > 0')
+        return v
+
+    @field_validator('burst')
+    @classmethod
+    def burst_must_be_positive(cls, v):
+        if v < 1:
+            raise ValueError('burst must be >= 1')
+        return v
+
+    @field_validator('retry_backoff', 'retry_backoff_max')
+    @classmethod
+    def retry_backoff_must_be_positive(cls, v):
+        if v <= 0:
+            raise ValueError('retry backoff must be > 0')
+        return v
+
+    @field_validator('max_retries')
+    @classmethod
+    def max_retries_must_be_non_negative(cls, v):
+        if v < 0:
+            raise ValueError('max_retries must be >= 0')
+        return v
+
+
+class StateConfig(BaseModel, extra="forbid"):
+    # Report changes and module state are appended to a journal, written every
+    # flush_interval seconds with a single fsync.
+    flush_interval: int | float = 1.0
+    # Once the journal holds this many records it is compacted into a snapshot.
+    compact_after: int = 1000
+
+    @field_validator('flush_interval')
+    @classmethod
+    def flush_interval_must_be_positive(cls, v):
+        if v <= 0:
+            raise ValueError('flush_interval must be > 0')
+        return v
+
+    @field_validator('compact_after')
+    @classmethod
+    def compact_after_must_be_positive(cls, v):
+        if v < 1:
+            raise ValueError('compact_after must be >= 1')
+        return v
+
+
+class RequestsConfig(BaseModel, extra="forbid"):
+    # Identical prolog/epilog requests running at the same time share one execution.
+    # Its result is also returned to identical requests made up to result_ttl seconds
+    # after it completed, 0 only shares running executions.
+    result_ttl: int | float = 30
+
+    @field_validator('result_ttl')
+    @classmethod
+    def result_ttl_must_be_non_negative(cls, v):
+        if v < 0:
+            raise ValueError('result_ttl must be >= 0')
+        return v
+
+
+class SinkConfig(BaseModel, extra="forbid"):
+    enabled: bool = False
+    # Relative paths are relative to the run directory.
+    path: str
+    # Report changes are written in batches, at most once every interval seconds.
+    interval: int | float = 5
+
+    @field_validator('interval')
+    @classmethod
+    def interval_must_be_positive(cls, v):
+        if v <= 0:
+            raise ValueError('interval must be > 0')
+        return v
+
+
+class NdjsonSinkConfig(SinkConfig):
+    path: str = "reports.ndjson"
+    interval: int | float = 1
+    # The log is rotated to <path>.1 once it reaches max_bytes, 0 never rotates it.
+    max_bytes: int = 10 * 1024 * 1024
+
+    @field_validator('max_bytes')
+    @classmethod
+    def max_bytes_must_be_non_negative(cls, v):
+        if v < 0:
+            raise ValueError('max_bytes must be >= 0')
+        return v
+
+
+class PrometheusSinkConfig(SinkConfig):
+    path: str = "/var/lib/node_exporter/textfile_collector/healthagent.prom"
+
+
+class SinksConfig(BaseModel, extra="forbid"):
+    # Jetpack node conditions are always published (see reporter), these are written besides.
+    prometheus: PrometheusSinkConfig = PrometheusSinkConfig()
+    ndjson: NdjsonSinkConfig = NdjsonSinkConfig()
+
+
+class AgentConfig(ModuleConfig):
+    # Event loop stalls are compared to the systemd watchdog timeout (WatchdogSec):
+    # WARNING once lag_strikes stalls within lag_window seconds exceed lag_warning_pct% of it,
+    # ERROR once a stall within lag_window exceeds lag_error_pct% of it.
+    lag_warning_pct: int | float = 10
+    lag_error_pct: int | float = 50
+    lag_strikes: int = 3
+    lag_window: int = 3600
+
+    @field_validator('lag_warning_pct', 'lag_error_pct')
+    @classmethod
+    def lag_pct_must_be_positive(cls, v):
+        if v <= 0:
+            raise ValueError('lag_warning_pct and lag_error_pct must be > 0')
+        return v
+
+    @field_validator('lag_strikes', 'lag_window')
+    @classmethod
+    def lag_strikes_and_window_must_be_positive(cls, v):
+        if v < 1:
+            raise ValueError('lag_strikes and lag_window must be >= 1')
+        return v
+
+
 class HealthagentConfig(BaseModel, extra="allow"):
     modules: list[ModuleName] = list(ModuleName)
+    scheduler: SchedulerConfig = SchedulerConfig()
+    reporter: ReporterConfig = ReporterConfig()
+    state: StateConfig = StateConfig()
+    requests: RequestsConfig = RequestsConfig()
+    sinks: SinksConfig = SinksConfig()
     network: NetworkConfig = NetworkConfig()
     gpu: GpuConfig = GpuConfig()
     systemd: SystemdConfig = SystemdConfig()
     proc: ProcConfig = ProcConfig()
     kmsg: ModuleConfig = ModuleConfig()
+    agent: AgentConfig = AgentConfig()
 
 
 def deep_merge(base: dict, override: dict) -> dict:
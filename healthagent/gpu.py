@@ -8,7 +8,7 @@ import tempfile
 import time
 from datetime import datetime, timezone
 from healthagent import epilog,status,healthcheck,prolog
-from healthagent.scheduler import Scheduler
+from healthagent.scheduler import Scheduler, TaskTimeout
 from healthagent.healthmodule import HealthModule
 from healthagent.config import GpuConfig
 from healthagent.reporter import Reporter, HealthReport,HealthStatus
@@ -189,7 +189,7 @@ class GpuHealthChecks(HealthModule):
             log.debug("Compute Mode: %s" % (Wrap.convert_value_to_string(self.gpu_config[x].mComputeMode)))
 
     @healthcheck("GpuCountCheck", description="Check OS vs PCI vs NVML GPU count")
-    @Scheduler.periodic(60)
+    @Scheduler.periodic(60, fixed_rate=True, jitter=15)
     async def gpu_count_check(self):
 
         report = HealthReport()
@@ -199,15 +199,9 @@ class GpuHealthChecks(HealthModule):
 
         # Read DCGM_FI_DEV_COUNT from the latest field collection
         dcgm_gpu_count = None
-        devcnt_field_id = Wrap.fields.DEVCNT
-        if devcnt_field_id is not None:
+        if Wrap.fields.DEVCNT is not None:
             try:
-                gpu_entities = self._field_collection.values.get(dcgm_fields.DCGM_FE_GPU, {})
-                for entity_id, field_values in gpu_entities.items():
-                    samples = field_values.get(devcnt_field_id)
-                    if samples and not samples[-1].isBlank:
-                        dcgm_gpu_count = samples[-1].value
-                        break
+                dcgm_gpu_count = await Scheduler.run_in_thread(self.read_gpu_count)
             except Exception as e:
                 log.warning(f"Failed to read DCGM_FI_DEV_COUNT: {e}")
 
@@ -228,6 +222,9 @@ class GpuHealthChecks(HealthModule):
     async def create(self):
         await self.reporter.clear_all_errors()
         log.debug("Adding periodic background healthchecks")
+        # Start the diagnostics worker now so prolog/epilog diags don't pay for
+        # interpreter startup and DCGM binding imports.
+        Scheduler.warm_pool(run_active_healthchecksv2.__module__)
         Scheduler.add_task(self.gpu_count_check)
         Scheduler.add_task(self.run_background_healthchecks)
 
@@ -256,15 +253,15 @@ class GpuHealthChecks(HealthModule):
     def _gpu_entry():
         return {"errors": [], "warnings": [], "xid": []}
 
-    def track_fieldsv2(self):
+    @Scheduler.thread(pool="dcgm")
+    def poll_dcgm(self):
         """
-        Generic field watch evaluation driven by self.field_watches (from config).
-        Iterates all entity groups returned by DCGM. GPU entities get per-GPU
-        entries (GPU_0, GPU_1). Non-GPU entities report under 'overall'.
-        XIDs are handled separately — GPU-only, not part of field watches.
+        Blocking DCGM calls of the background checks, run on the dcgm thread pool.
+        Returns the group health and accumulates new field samples since the last call.
+        The samples are added to the collection in place: other readers of it either run
+        once this returned (track_fieldsv2) or on the dcgm pool as well (read_gpu_count).
         """
-        custom_fields = {'error_count': 0, 'warning_count': 0, 'category': set()}
-        xid_changed = False
+        group_health = self.dcgmGroup.health.Check()
         try:
             # Accumulate new samples since last call
             self._field_collection = self.dcgmGroup.samples.GetAllSinceLastCall_v2(
@@ -276,7 +273,34 @@ class GpuHealthChecks(HealthModule):
                     for field_id, ts in fields.items():
                         if len(ts.values) > MAX_KEEP_SAMPLES:
                             ts.values = ts.values[-MAX_KEEP_SAMPLES:]
+        except Exception as e:
+            log.exception(e)
+        return group_health
+
+    @Scheduler.thread(pool="dcgm")
+    def read_gpu_count(self):
+        """
+        DCGM_FI_DEV_COUNT from the samples collected by poll_dcgm, None if there is none.
+        poll_dcgm fills the collection in place on the dcgm thread pool: running there too,
+        serialized with it, this never iterates a collection being filled.
+        """
+        gpu_entities = self._field_collection.values.get(dcgm_fields.DCGM_FE_GPU, {})
+        for entity_id, field_values in gpu_entities.items():
+            samples = field_values.get(Wrap.fields.DEVCNT)
+            if samples and not samples[-1].isBlank:
+                return samples[-1].value
+        return None
 
+    def track_fieldsv2(self):
+        """
+        Generic field watch evaluation driven by self.field_watches (from config).
+        Iterates all entity groups of the samples collected by poll_dcgm. GPU entities get per-GPU
+        entries (GPU_0, GPU_1). Non-GPU entities report under 'overall'.
+        XIDs are handled separately — GPU-only, not part of field watches.
+        """
+        custom_fields = {'error_count': 0, 'warning_count': 0, 'category': set()}
+        xid_changed = False
+        try:
             for entity_group_id, entities in self._field_collection.values.items():
                 group_name = Wrap.ENTITY_GROUP_NAMES.get(entity_group_id, f"Entity_{entity_group_id}")
                 is_gpu = (entity_group_id == dcgm_fields.DCGM_FE_GPU)
@@ -382,7 +406,8 @@ class GpuHealthChecks(HealthModule):
             return custom_fields
 
 
-    @healthcheck("GpuMemoryCheck", args=["gpu_id"], description="Run GPU memory allocation test. Args: gpu_id=0,1")
+    @healthcheck("GpuMemoryCheck", args=["gpu_id"], description="Run GPU memory allocation test. Args: gpu_id=0,1",
+                 exclusive=["gpu:gpu_id"])
     @epilog
     @prolog
     async def memory_allocation_test(self, gpu_id: list = None):
@@ -393,15 +418,14 @@ class GpuHealthChecks(HealthModule):
         if gpu_id:
             cmd.extend(["--gpus", ",".join(str(g) for g in gpu_id)])
         try:
-            proc = await Scheduler.add_task(Scheduler.subprocess(*cmd))
-            stdout, stderr = await proc.communicate()
+            returncode, stdout, stderr = await Scheduler.add_task(Scheduler.subprocess(*cmd, wait=True))
             output = stdout.decode().strip()
             err_output = stderr.decode().strip()
-            if proc.returncode == 0:
+            if returncode == 0:
                 report.status = HealthStatus.OK
                 report.description = "Memory allocation test passed"
                 report.details = output
-            elif proc.returncode == 2:
+            elif returncode == 2:
                 report.status = HealthStatus.WARNING
                 report.description = "Test not run"
                 report.details = err_output or output
@@ -409,6 +433,8 @@ class GpuHealthChecks(HealthModule):
                 report.status = HealthStatus.ERROR
                 report.description = "Memory allocation test failed"
                 report.details = f"{output}\n{err_output}".strip()
+        except TaskTimeout as e:
+            report = self.timeout_report(health_system, e.timeout)
         except Exception as e:
             log.exception(e)
             report.status = HealthStatus.WARNING
@@ -419,7 +445,8 @@ class GpuHealthChecks(HealthModule):
         response[health_system] = report.view()
         return response
 
-    @healthcheck("GpuDiagnosticCheck", description="Run DCGM diagnostics checks. Eg. Args: gpu_id=0,1 tests=memory", args=['gpu_id','tests', 'params'])
+    @healthcheck("GpuDiagnosticCheck", description="Run DCGM diagnostics checks. Eg. Args: gpu_id=0,1 tests=memory", args=['gpu_id','tests', 'params'],
+                 exclusive=["gpu:gpu_id"])
     @epilog
     @prolog
     async def run_diag(self, gpu_id: list = None, tests: str = '', params: str = '', _phase: str = None):
@@ -428,7 +455,10 @@ class GpuHealthChecks(HealthModule):
         tests = tests or (phase_cfg.tests if phase_cfg else "")
         params = params or (phase_cfg.params if phase_cfg else "")
         health_system = self.run_diag.report_name
-        report = await Scheduler.add_task(run_active_healthchecksv2, gpu_id=gpu_id, tests=tests, params=params)
+        try:
+            report = await Scheduler.add_task(run_active_healthchecksv2, gpu_id=gpu_id, tests=tests, params=params)
+        except TaskTimeout as e:
+            report = self.timeout_report(health_system, e.timeout)
         await self.reporter.update_report(name=health_system, report=report)
         response = {}
         response[health_system] = report.view()
@@ -436,7 +466,7 @@ class GpuHealthChecks(HealthModule):
 
 
     @healthcheck("GpuHealthCheck", description="Periodic GPU health monitoring")
-    @Scheduler.periodic(60)
+    @Scheduler.periodic(60, fixed_rate=True, jitter=15)
     async def run_background_healthchecks(self):
         """
         Invoke Health checks periodically.
@@ -451,7 +481,7 @@ class GpuHealthChecks(HealthModule):
                 report = HealthReport()
                 if not self.dcgmGroup:
                     raise Wrap.DcgmInvalidHandle
-                group_health = self.dcgmGroup.health.Check()
+                group_health = await Scheduler.run_in_thread(self.poll_dcgm)
                 incident_count = group_health.incidentCount
 
                 custom_fields = self.track_fieldsv2()
@@ -590,6 +620,10 @@ class GpuHealthChecks(HealthModule):
     def show_status(self):
         return self.reporter.summarize()
 
+    def status_generation(self):
+        # show_status only renders the reporter, like the inherited status.
+        return self.reporter.store.generation
+
     def __del__(self):
         ## Delete the group
         if hasattr(self, 'dcgmGroup') and self.dcgmGroup:
@@ -602,7 +636,9 @@ class GpuHealthChecks(HealthModule):
 def _diag_entry():
     return {"errors": [], "warnings": [], "suppressed": []}
 
-@Scheduler.pool
+# Upper bound for a hung diagnostic, requests from the health client are bounded by their deadline.
+@Scheduler.timeout(3600)
+@Scheduler.pool(resource="gpu", key="gpu_id")
 def run_active_healthchecksv2(gpu_id: list = None, tests: str = '', params: str = ''):
 
     """
@@ -3,14 +3,17 @@ import asyncio
 import importlib
 import json
 import logging
+import math
 import pickle
 import os
 import signal
 from time import perf_counter
-from healthagent.scheduler import Scheduler
-from healthagent.reporter import Reporter
+from healthagent.scheduler import Scheduler, SingleFlight
+from healthagent.reporter import Reporter, ReportStore, ReportEvents, Publisher, Sinks
+from healthagent.statestore import StateStore
 from healthagent.profiler import Profiler
-from healthagent.config import load_config, ModuleConfig
+from healthagent.protocol import MAGIC, frame, response_frame, read_frame
+from healthagent.config import load_config, ModuleConfig, RequestsConfig
 from importlib.metadata import version, PackageNotFoundError
 
 try:
@@ -33,7 +36,25 @@ class Healthagent:
     socket = f"{rundir}/health.sock"
     server = None
     modules = {}
+    config = None
     debug_mode = 0
+    # Seconds kept back from a client's timeout to write reports and send the response.
+    RESPONSE_MARGIN = 10
+    # Seconds to wait for queued node condition updates on shutdown.
+    PUBLISH_FLUSH_TIMEOUT = 30
+    # Seconds without report events after which subscribers get a heartbeat, to find closed connections.
+    SUBSCRIBE_HEARTBEAT = 30
+    # Seconds before a module timeout its tasks time out, for the checks to report it.
+    MODULE_TIMEOUT_MARGIN = 1
+    # Requests of a framed connection running at once, further requests are read once one completes.
+    PIPELINE_DEPTH = 16
+    # Status query (see _status_query) -> (status generation of each module, serialized response)
+    # of the last request with that query, for the STATUS_CACHE_SIZE most recent queries.
+    _status_cache = {}
+    STATUS_CACHE_SIZE = 32
+    STATUS_FORMATS = ("json", "bash")
+    # Identical prolog/epilog/status requests in flight share one execution, see request_response.
+    single_flight = SingleFlight()
 
     # Module registry: (module_name, import_path, class_name)
     MODULE_REGISTRY = [
@@ -41,7 +62,8 @@ class Healthagent:
         ("systemd", "healthagent.async_systemd", "SystemdMonitor"),
         ("kmsg",    "healthagent.kmsg",          "KmsgReader"),
         ("network", "healthagent.network",       "NetworkHealthChecks"),
-        ("proc",    "healthagent.process",       "ProcessMonitor")
+        ("proc",    "healthagent.process",       "ProcessMonitor"),
+        ("agent",   "healthagent.agent",         "AgentHealthChecks")
     ]
 
     @classmethod
@@ -59,40 +81,263 @@ class Healthagent:
 
     @classmethod
     def get_module_file(cls, module: str):
-
+        """Pickled Reporter of a module, as saved before the StateStore. Only read to migrate."""
         return f"{cls.rundir}/{module}.pkl"
 
     @classmethod
-    def get_reporter(cls, module: str):
+    def get_jetpack_cache_file(cls):
+
+        return f"{cls.rundir}/jetpack.json"
+
+    @classmethod
+    def get_state_dir(cls):
+
+        return f"{cls.rundir}/state"
+
+    @classmethod
+    async def get_reporter(cls, module: str):
+        reporter = None
+        reports = await StateStore.reports(module)
+        if reports is not None:
+            reporter = Reporter.from_state(reports)
         filename = cls.get_module_file(module=module)
-        if os.path.exists(filename):
+        if reporter is None and os.path.exists(filename):
             try:
                 with open(filename, 'rb') as f:
-                    return Reporter.load_reporter_obj(old=pickle.load(f))
+                    reporter = Reporter.load_reporter_obj(old=pickle.load(f))
+                log.info(f"Migrating the reports of module {module} to the state store")
             except Exception as e:
                 log.error(e)
                 log.error(f"Unable to restore previous state for module {module}")
-        return Reporter()
+        if reporter is None:
+            reporter = Reporter()
+        reporter.module = module
+        if os.path.exists(filename):
+            reporter.persist()
+            try:
+                os.remove(filename)
+            except OSError as e:
+                log.warning(f"Unable to remove {filename}: {e}")
+        return reporter
 
     @classmethod
-    def save_reporter(cls):
-        for module, obj  in cls.modules.items():
-            reporter = obj.reporter
-            filename = cls.get_module_file(module=module)
-            try:
-                with open(filename, 'wb') as f:
-                    pickle.dump(reporter, f)
-            except Exception as e:
-                log.exception(e)
+    def save_state(cls):
+        """Record the latest reports and module state, last_update included."""
+        for module, obj in cls.modules.items():
+            obj.reporter.persist()
+            cls.save_module_state(module, obj)
+
+    @staticmethod
+    def save_module_state(name: str, module):
+        try:
+            state = module.save_state()
+            if state is not None:
+                StateStore.record_module_state(name, state)
+        except Exception as e:
+            log.exception(f"Unable to save the state of module {name}: {e}")
+
+    @Scheduler.periodic(60, fixed_rate=True, jitter=5)
+    @classmethod
+    async def checkpoint_module_state(cls):
+        """Periodically journal the state of the modules that changed"""
+        for name, module in cls.modules.items():
+            cls.save_module_state(name, module)
 
+    @classmethod
+    async def _execute_module_functions(cls, attribute_flag: str, checks: dict = None, timing: bool = False,
+                                        modules: list = None):
+        """
+        Run the handlers of all the modules (or the named ones) concurrently, modules share no state. A module that
+        fails or runs out of time (its `timeout` config, capped by the request deadline) does not
+        hold up the others: the results of its handlers that completed are returned, with a
+        WARNING report when it timed out. With timing, a "timing" block gives the seconds each
+        module took, how it ended (ok, timeout or error) and the plan and timing of its checks
+        (see HealthModule.execute).
+        """
+        names = [name for name in cls.modules if modules is None or name in modules]
+        results = await asyncio.gather(*(cls._execute_module(name, attribute_flag, checks) for name in names))
+        response = {name: result for name, (result, _) in zip(names, results)}
+        if timing:
+            response["timing"] = {name: info for name, (_, info) in zip(names, results)}
+        return response
 
     @classmethod
-    async def _execute_module_functions(cls, attribute_flag: str, checks: dict = None):
+    async def _execute_module(cls, name: str, attribute_flag: str, checks: dict = None) -> tuple[dict, dict]:
+        module = cls.modules[name]
         response = {}
+        checks_timing = {}
+        result = "ok"
+        timeout = getattr(cls.config, name, ModuleConfig()).timeout
+        remaining = Scheduler.time_remaining()
+        if remaining is not None and (timeout is None or remaining < timeout):
+            timeout = remaining
+        start = perf_counter()
+        try:
+            # Tasks of the module (pool, thread, subprocess) time out a little earlier, so they
+            # raise TaskTimeout and the checks report it before the module is cancelled.
+            deadline = None if timeout is None else timeout - min(cls.MODULE_TIMEOUT_MARGIN, timeout / 2)
+            with Scheduler.deadline(deadline):
+                async with asyncio.timeout(timeout):
+                    await module.execute(attribute_flag, checks=checks, response=response, timing=checks_timing)
+        except TimeoutError:
+            result = "timeout"
+            log.error(f"[{attribute_flag}] Module {name} did not complete within {timeout:.0f}s")
+            report_name = type(module).__name__
+            response[report_name] = module.timeout_report(f"{report_name} {attribute_flag}", timeout).view()
+        except Exception as e:
+            result = "error"
+            log.exception(f"[{attribute_flag}] Error executing module {name}: {e}")
+        return response, {"seconds": round(perf_counter() - start, 3), "result": result, "checks": checks_timing}
+
+    @classmethod
+    async def status_response(cls, modules: tuple = None, checks: tuple = None, fields: tuple = None,
+                              format: str = None) -> bytes:
+        """
+        Serialized status of the modules, see _status_query for the filters. Reused as long as
+        no module reports a change (see HealthModule.status_generation), so an unchanged status
+        costs only the socket write.
+        """
+        query = (modules, checks, fields, format)
+        names = [name for name in cls.modules if modules is None or name in modules]
+        generations, data = cls._status_cache.get(query, (None, None))
+        if generations is not None and generations == cls._status_generations(names):
+            return data
+        response = await cls._execute_module_functions(attribute_flag="status", modules=names)
+        data = json.dumps(cls._filter_status(response, checks, fields, format)).encode()
+        # Taken after the status handlers ran, they may prune stale reports.
+        generations = cls._status_generations(names)
+        cls._status_cache.pop(query, None)
+        cls._status_cache[query] = (generations if None not in generations.values() else None, data)
+        while len(cls._status_cache) > cls.STATUS_CACHE_SIZE:
+            del cls._status_cache[next(iter(cls._status_cache))]
+        return data
+
+    @classmethod
+    def _status_query(cls, request: dict) -> tuple:
+        """
+        (modules, checks, fields, format) of a status request, None when not given:
+        modules and checks (report names, case insensitive) select the reports, fields only
+        keeps these fields of each report, and the "bash" format returns the error count of
+        each module instead, as `health -b` prints it. Lists may also be comma separated strings.
+        """
+        def names(value, lower=False):
+            if value is None or value == [] or value == "":
+                return None
+            if isinstance(value, str):
+                value = [value]
+            value = {part.strip() for v in value for part in str(v).split(",") if part.strip()}
+            return tuple(sorted({v.lower() for v in value} if lower else value)) or None
+
+        format = request.get("format")
+        if format not in (None, *cls.STATUS_FORMATS):
+            raise ValueError(f"Unknown status format {format}, expected one of {', '.join(cls.STATUS_FORMATS)}")
+        return (names(request.get("modules")), names(request.get("checks"), lower=True),
+                names(request.get("fields")), None if format == "json" else format)
+
+    @staticmethod
+    def _filter_status(response: dict, checks: tuple = None, fields: tuple = None, format: str = None) -> dict:
+        if checks is not None:
+            response = {module: {name: report for name, report in reports.items() if name.lower() in checks}
+                        for module, reports in response.items()}
+        if format == "bash":
+            return {module: sum(report.get("error_count", 1) for report in reports.values()
+                                if report.get("status") == "Error")
+                    for module, reports in response.items()}
+        if fields is not None:
+            response = {module: {name: {field: value for field, value in report.items() if field in fields}
+                                 for name, report in reports.items()}
+                        for module, reports in response.items()}
+        return response
+
+    @staticmethod
+    def _request_key(command: str, checks: dict = None) -> tuple:
+        """
+        Requests with the same key run the same checks: check names are case insensitive,
+        and so is the order of their arguments and of the values of comma separated ones.
+        """
+        if checks is None:
+            return (command, None)
+
+        def normalize(value):
+            if isinstance(value, str):
+                value = value.split(",")
+            if isinstance(value, (list, tuple)):
+                return tuple(sorted(str(v).strip() for v in value))
+            return str(value)
+
+        normalized = []
+        for name, kwargs in checks.items():
+            if isinstance(kwargs, dict):
+                kwargs = tuple(sorted((key, normalize(value)) for key, value in kwargs.items()))
+            else:
+                kwargs = repr(kwargs)
+            normalized.append((str(name).lower(), kwargs))
+        return (command, tuple(sorted(normalized)))
+
+    @classmethod
+    async def request_response(cls, command: str, checks: dict = None) -> bytes:
+        """
+        Serialized prolog/epilog results. Identical requests (see _request_key) made while one
+        runs share its execution, and get its result for `requests.result_ttl` seconds after it
+        completed, eg. several job steps ending at once run the GPU diagnostics once.
+        """
+        async def execute():
+            response = await cls._execute_module_functions(attribute_flag=command, checks=checks, timing=True)
+            return json.dumps(response).encode()
+
+        ttl = getattr(cls.config, "requests", RequestsConfig()).result_ttl
+        return await cls.single_flight.run(cls._request_key(command, checks), execute, ttl=ttl)
+
+    @classmethod
+    async def status_since(cls, since: int) -> dict:
+        """
+        Reports that changed after version `since` by module, with the current version to ask
+        for the next changes. Modules without changes are left out.
+        """
+        # Taken first, a change made while collecting is sent again next time rather than missed.
+        response = {"version": ReportStore.version, "status": {}, "removed": {}}
         for name, module in cls.modules.items():
-            response[name] = await module.execute(attribute_flag, checks=checks)
+            changed, removed = await module.status_since(since)
+            if changed:
+                response["status"][name] = changed
+            if removed:
+                response["removed"][name] = removed
         return response
 
+    @classmethod
+    async def stream_events(cls, writer):
+        """
+        Write report events to a subscribe connection as newline delimited JSON until the
+        client goes away or the daemon stops.
+        """
+        try:
+            subscriber = ReportEvents.subscribe()
+        except RuntimeError as e:
+            writer.write(json.dumps({"event": "error", "error": str(e)}).encode() + b"\n")
+            await writer.drain()
+            return
+        log.debug("Client subscribed to report events")
+        try:
+            writer.write(json.dumps({"event": "subscribed", "version": ReportStore.version}).encode() + b"\n")
+            await writer.drain()
+            while True:
+                event = await subscriber.get(timeout=cls.SUBSCRIBE_HEARTBEAT)
+                if event is None:
+                    if subscriber.closed:
+                        break
+                    event = {"event": "heartbeat", "version": ReportStore.version}
+                writer.write(json.dumps(event).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, BrokenPipeError):
+            log.debug("Subscriber went away")
+        finally:
+            ReportEvents.unsubscribe(subscriber)
+
+    @classmethod
+    def _status_generations(cls, names: list = None) -> dict:
+        names = cls.modules if names is None else names
+        return {name: cls.modules[name].status_generation() for name in names}
+
     @classmethod
     def _list_module_checks(cls, attribute_flag: str = None):
         result = {}
@@ -103,49 +348,142 @@ class Healthagent:
         return result
 
     @classmethod
-    async def handle_client(cls, reader, writer):
+    def _request_deadline(cls, timeout) -> float | None:
+        """
+        Deadline of a request whose client waits `timeout` seconds for prolog/epilog results,
+        checks are cut short to respond in time. None when the client gave no timeout.
+        """
+        if timeout is None:
+            return None
+        if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or not math.isfinite(timeout) or timeout <= 0:
+            raise ValueError(f"Invalid timeout {timeout!r}, expected a positive number of seconds")
+        return max(timeout - cls.RESPONSE_MARGIN, 1)
 
+    @classmethod
+    async def dispatch(cls, request: dict) -> bytes:
+        """Serialized response to a request."""
+        start = perf_counter()
+        command = request.get("command", "")
+        # Name the task so event loop stalls are attributed to the command.
+        asyncio.current_task().set_name(f"client[{command}]")
+        checks = request.get("checks", None)
         try:
-            data = b''
-            while True:
-                chunk = await reader.read(4096)
-                if not chunk:
-                    # Client closed connection
-                    break
-                data += chunk
-            message = data.decode()
-            log.debug("Received: %s", message)
-
-            request = json.loads(message)
-            start = perf_counter()
-            command = request.get("command", "")
-            checks = request.get("checks", None)
-
-            response = {}
-            if command == "epilog":
-                response = await cls._execute_module_functions(attribute_flag="epilog", checks=checks)
-            elif command == "prolog":
-                response = await cls._execute_module_functions(attribute_flag="prolog", checks=checks)
-            elif command == "status":
-                response = await cls._execute_module_functions(attribute_flag="status")
-            elif command == "list_checks":
-                check_type = request.get("type", "all")
-                flag = None if check_type == "all" else check_type
-                response = cls._list_module_checks(attribute_flag=flag)
-            elif command == "version":
-                response = VERSION
-            elif command == "show_config":
-                response = cls.config.model_dump(mode="json")
-            else:
-                raise ValueError("Invalid message received")
+            deadline = cls._request_deadline(request.get("timeout", None))
+        except ValueError as e:
+            return json.dumps({"error": str(e)}).encode()
 
-            writer.write(json.dumps(response).encode())
-            await writer.drain()
-            log.debug(f"{command} Response sent successfully in {perf_counter() - start:.4f} sec")
+        response = {}
+        payload = None
+        if command in ("epilog", "prolog"):
+            # Background checks are deferred while a job waits on prolog/epilog results
+            with Scheduler.interactive(), Scheduler.deadline(deadline):
+                payload = await cls.request_response(command, checks)
+        elif command == "status":
+            query = cls._status_query(request)
+            payload = await cls.single_flight.run((command, query), lambda: cls.status_response(*query))
+        elif command == "status_since":
+            response = await cls.status_since(since=int(request.get("since", 0)))
+        elif command == "list_checks":
+            check_type = request.get("type", "all")
+            flag = None if check_type == "all" else check_type
+            response = cls._list_module_checks(attribute_flag=flag)
+        elif command == "version":
+            response = VERSION
+        elif command == "show_config":
+            response = cls.config.model_dump(mode="json")
+        elif command == "scheduler_stats":
+            response = Scheduler.stats()
+            response["publisher"] = Publisher.stats()
+            response["subscribers"] = ReportEvents.stats()
+            response["sinks"] = Sinks.stats()
+            response["requests"] = cls.single_flight.stats()
+        elif command == "task_control":
+            try:
+                response = Scheduler.control_task(name=request.get("task"),
+                                                  action=request.get("action"),
+                                                  interval=request.get("interval"))
+            except (KeyError, ValueError) as e:
+                response = {"error": str(e).strip("'")}
+        else:
+            raise ValueError("Invalid message received")
+
+        if payload is None:
+            payload = json.dumps(response).encode()
+        log.debug(f"{command} handled in {perf_counter() - start:.4f} sec")
+        return payload
+
+    @classmethod
+    async def handle_client(cls, reader, writer):
+        """
+        Serve a connection. A client starting it with protocol.MAGIC sends framed requests
+        (see serve_framed), any other sends a single JSON request and closes its side of the
+        connection, then gets the response.
+        """
+        try:
+            try:
+                data = await reader.readexactly(len(MAGIC))
+            except asyncio.IncompleteReadError as e:
+                data = e.partial
+            if data == MAGIC:
+                await cls.serve_framed(reader, writer)
+            else:
+                data += await reader.read()
+                message = data.decode()
+                log.debug("Received: %s", message)
+                request = json.loads(message)
+                if request.get("command") == "subscribe":
+                    await cls.stream_events(writer)
+                else:
+                    writer.write(await cls.dispatch(request))
+                    await writer.drain()
         except Exception as e:
             log.exception(e)
         writer.close()
-        await writer.wait_closed()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            # eg. a subscriber that went away
+            pass
+
+    @classmethod
+    async def serve_framed(cls, reader, writer):
+        """
+        Serve framed requests until the client closes the connection. Requests run concurrently,
+        up to PIPELINE_DEPTH of them, and each response is sent as soon as it is ready.
+        """
+        writer.write(MAGIC)
+        await writer.drain()
+        slots = asyncio.Semaphore(cls.PIPELINE_DEPTH)
+        tasks = set()
+
+        async def serve(body: bytes):
+            request_id = b"null"
+            try:
+                request = json.loads(body)
+                request_id = json.dumps(request.get("id")).encode()
+                if request.get("command") == "subscribe":
+                    raise ValueError("subscribe needs a connection of its own")
+                data = response_frame(request_id, await cls.dispatch(request))
+            except Exception as e:
+                log.exception(e)
+                data = frame(b'{"id": ' + request_id + b', "error": ' + json.dumps(str(e)).encode() + b'}')
+            writer.write(data)
+            await writer.drain()
+
+        try:
+            while True:
+                await slots.acquire()
+                body = await read_frame(reader)
+                if body is None:
+                    break
+                task = asyncio.create_task(serve(body))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(lambda _: slots.release())
+        finally:
+            # The client may close its side right after sending its last requests.
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
 
     @classmethod
     async def run_unix_server(cls):
@@ -161,6 +499,8 @@ class Healthagent:
 
         log.debug("Stopping the server")
         start = perf_counter()
+        # Subscribe connections stay open until told to close.
+        ReportEvents.close()
         if cls.server:
             cls.server.close()
             await cls.server.wait_closed()
@@ -172,6 +512,14 @@ class Healthagent:
     @classmethod
     async def initialize_modules(cls):
         cls.config = load_config()
+        Scheduler.configure(cls.config.scheduler)
+        Scheduler.start_loop_monitor(cls.config.scheduler.stall_threshold)
+        Publisher.configure(cls.config.reporter)
+        StateStore.configure(cls.config.state, directory=cls.get_state_dir())
+        Sinks.configure(cls.config.sinks, rundir=cls.rundir)
+        if os.path.exists(Reporter.JETPACK):
+            # Runs while the modules initialize, reporters wait for it before their first publish.
+            Reporter.probe_jetpack(cache_file=cls.get_jetpack_cache_file())
 
         for module_name, import_path, class_name in cls.MODULE_REGISTRY:
             if module_name not in cls.config.modules:
@@ -180,9 +528,15 @@ class Healthagent:
             try:
                 mod = importlib.import_module(import_path)
                 instance = getattr(mod, class_name)
-                reporter = cls.get_reporter(module=module_name)
+                reporter = await cls.get_reporter(module=module_name)
                 module_config = getattr(cls.config, module_name, ModuleConfig())
                 instance_obj = instance(reporter=reporter, config=module_config)
+                state = await StateStore.module_state(module_name)
+                if state is not None:
+                    try:
+                        instance_obj.restore_state(state)
+                    except Exception as e:
+                        log.exception(f"Unable to restore the state of module {module_name}: {e}")
                 await instance_obj.create()
                 log.info(f"Initialized module: {module_name}")
             except ImportError as e:
@@ -196,6 +550,7 @@ class Healthagent:
                     log.exception(f"Failed to initialize module {module_name}")
             else:
                 cls.modules[module_name] = instance_obj
+                Sinks.load(module_name, instance_obj.reporter.store)
 
         systemd_module = cls.modules.get("systemd")
         if systemd_module is not None:
@@ -206,7 +561,9 @@ class Healthagent:
             log.info(f"Configuring systemd monitor for services: {services}")
             await systemd_module.add_monitor(services=services)
 
-    @Scheduler.periodic(60)
+    # Fixed rate so the watchdog is pet on time regardless of loop load, a late pet is
+    # coalesced into a single immediate one. Never deferred behind prolog/epilog requests.
+    @Scheduler.periodic(60, fixed_rate=True, jitter=5, catchup=Scheduler.COALESCE, lane=Scheduler.INTERACTIVE)
     @classmethod
     async def reset_systemd_watchdog(cls):
         '''Periodically notify (aka "pet") the systemd watchdog to indicate healthagent service liveness'''
@@ -240,9 +597,13 @@ class Healthagent:
         Scheduler.add_task(cls.reset_systemd_watchdog)
 
         await cls.initialize_modules()
+        Scheduler.add_task(cls.checkpoint_module_state)
         await cls.run_unix_server()
         log.info("Initialized HealthAgent")
         await Scheduler.stop_event.wait()
         await cls.stop_server()
-        cls.save_reporter()
+        # Publish report changes still waiting out their debounce window, and write the queued ones.
+        await Sinks.close(timeout=cls.PUBLISH_FLUSH_TIMEOUT)
+        cls.save_state()
+        await StateStore.close()
         log.info("Exiting")
\ No newline at end of file
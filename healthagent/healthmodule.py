@@ -1,7 +1,10 @@
 from abc import ABC
-from healthagent.reporter import Reporter
+from healthagent.reporter import Reporter, HealthReport, HealthStatus
 from healthagent.config import ModuleConfig
+from healthagent.scheduler import Scheduler, ResourceLock
 from healthagent import status
+from time import perf_counter
+import asyncio
 import inspect
 import logging
 
@@ -15,6 +18,8 @@ class HealthModule(ABC):
         - Decorate methods with `@healthcheck("Name")` to declare their report name.
         - Decorate methods with `@status` to include their output in the health status response
         - Decorate methods with `@epilog` and/or `@prolog` to include their output in the epilog and/or prolog response (if implemented) respectively.
+        - Decorate blocking synchronous methods with `@Scheduler.thread` to run them on a thread pool instead of the event loop.
+        - Override `save_state` and `restore_state` to keep in-memory state (eg. counters, sample windows) across restarts.
 
     """
 
@@ -28,19 +33,64 @@ class HealthModule(ABC):
         """Async initialization. Override to register background tasks, open connections, etc."""
         pass
 
+    def save_state(self):
+        """
+        State to keep across restarts, None if there is none. Persisted by the StateStore about
+        every minute and on shutdown, so it must be made of types `statestore.encode` supports.
+        """
+        return None
+
+    def restore_state(self, state):
+        """Restore the state returned by save_state before the restart, called before `create`."""
+        pass
+
     @status
     def status(self) -> dict:
         """Return current health status. Override if custom status logic is needed."""
         self._prune_stale_reports()
         return self.reporter.summarize()
 
+    def status_generation(self):
+        """
+        Changes whenever the status response of this module does, None if it cannot tell.
+        Used to reuse the rendered status of the node between requests. By default this is the
+        generation of the reporter store when the only @status handler is `status`: modules adding
+        @status handlers that also only render the reporter should override this.
+        """
+        if all(getattr(handler, '__func__', None) is HealthModule.status for handler in self._get_handlers("status")):
+            return self.reporter.store.generation
+        return None
+
+    async def status_since(self, since: int) -> tuple[dict, list]:
+        """
+        Status of the reports that changed after version `since`, and the names of the reports
+        removed since (see Reporter.changed_since). When status_generation cannot tell what the
+        @status handlers return, their whole status is returned.
+        """
+        if self.status_generation() is None:
+            return await self.execute("status"), []
+        self._prune_stale_reports()
+        return self.reporter.changed_since(since)
+
+    @staticmethod
+    def timeout_report(report_name: str, timeout: float) -> HealthReport:
+        """WARNING report for a check that was cancelled because it timed out."""
+        return HealthReport(status=HealthStatus.WARNING,
+                            description=f"{report_name} timed out",
+                            details=f"{report_name} did not complete within {timeout:.0f}s and was cancelled. "
+                                    "The check result is unknown.")
+
+    async def report_timeout(self, report_name: str, timeout: float):
+        """Called by the Scheduler when a periodic check of this module times out."""
+        await self.reporter.update_report(name=report_name, report=self.timeout_report(report_name, timeout))
+
     def _prune_stale_reports(self):
         """Remove reporter entries whose keys no longer match any registered healthcheck."""
         valid_names = set(self._build_checks_registry().keys())
         stale_keys = [k for k in self.reporter.store if k not in valid_names]
         for key in stale_keys:
             log.warning(f"Removing stale report key '{key}' (no matching healthcheck)")
-            del self.reporter.store[key]
+            self.reporter.remove_report(key)
 
     def _get_handlers(self, attribute_flag: str) -> list:
         """
@@ -144,9 +194,28 @@ class HealthModule(ABC):
             coerced[key] = value
         return coerced
 
-    async def execute(self, attribute_flag: str, checks: dict = None) -> dict:
+    @staticmethod
+    def _resource_claims(handler, kwargs: dict) -> frozenset:
+        """Resource keys a check claims while it runs, see the exclusive and shared arguments of @healthcheck."""
+        exclusive = getattr(handler, 'healthcheck_exclusive', None)
+        shared = getattr(handler, 'healthcheck_shared', None)
+        if exclusive is None and shared is None:
+            return frozenset([ResourceLock.EVERYTHING])
+        claims = frozenset()
+        for specs, is_shared in ((exclusive or [], False), (shared or [], True)):
+            for spec in specs:
+                # "gpu:gpu_id" claims the ids passed in the gpu_id argument, "gpu" all of them.
+                resource, _, arg = spec.partition(":")
+                claims |= ResourceLock.keys(resource, kwargs.get(arg) if arg else None, shared=is_shared)
+        return claims
+
+    async def execute(self, attribute_flag: str, checks: dict = None, response: dict = None,
+                      timing: dict = None) -> dict:
         """Execute handlers for the given flag.
 
+        Handlers whose resources do not conflict (see @healthcheck exclusive/shared) run
+        concurrently. Conflicting ones run one after the other, in declaration order.
+
         Args:
             attribute_flag: The phase flag (epilog, prolog, status).
             checks: Optional dict of {report_name: {kwarg: value, ...}}.
@@ -154,16 +223,24 @@ class HealthModule(ABC):
                     will run, and their kwargs will be passed through.
                     Matching is case-insensitive.
                     If None, all handlers for the flag run with no extra args.
+            response: Optional dict the results are added to as each handler completes,
+                      so the caller keeps them if the execution is cancelled.
+            timing: Optional dict filled with the plan and timing of each handler, by report name:
+                    {"wave": int, "after": [report names], "start": seconds, "seconds": seconds}.
+                    Handlers of wave N wait for conflicting handlers of earlier waves (`after`),
+                    `start` is when the handler got its resources, from the start of the execution.
         """
         # Normalize check names to lowercase for case-insensitive matching
         checks_lower = {k.lower(): v for k, v in checks.items()} if checks is not None else None
-        response = {}
+        response = {} if response is None else response
+        timing = {} if timing is None else timing
+        plan = []
         for handler in self._get_handlers(attribute_flag):
             report_name = getattr(handler, 'report_name', None)
             if checks_lower is not None:
                 if report_name is None or report_name.lower() not in checks_lower:
                     continue
-                kwargs = checks_lower.get(report_name.lower(), {})
+                kwargs = dict(checks_lower.get(report_name.lower(), {}))
             else:
                 kwargs = {}
             try:
@@ -186,14 +263,49 @@ class HealthModule(ABC):
                 sig = inspect.signature(handler)
                 if '_phase' in sig.parameters:
                     kwargs['_phase'] = attribute_flag
-                if inspect.iscoroutinefunction(handler):
-                    ans = await handler(**kwargs)
-                else:
-                    ans = handler(**kwargs)
-                if isinstance(ans, dict):
-                    response.update(ans)
-                else:
-                    log.warning(f"[{attribute_flag}] {handler.__name__} did not return a dict. Ignoring.")
             except Exception as e:
                 log.exception(f"[{attribute_flag}] Error executing {handler.__name__}: {e}")
-        return response
\ No newline at end of file
+                continue
+            claims = self._resource_claims(handler, kwargs)
+            name = report_name or handler.__name__
+            conflicting = [(other, entry) for other, _, _, other_claims, entry in plan
+                           if ResourceLock.conflicts(claims, other_claims)]
+            timing[name] = {
+                "wave": max((entry["wave"] + 1 for _, entry in conflicting), default=0),
+                "after": [other for other, _ in conflicting],
+                "start": None,
+                "seconds": None,
+            }
+            plan.append((name, handler, kwargs, claims, timing[name]))
+
+        locks = ResourceLock()
+        start = perf_counter()
+
+        async def run(handler, kwargs, claims, entry):
+            # Claimed in declaration order, conflicting handlers run in that order.
+            async with locks.hold(claims):
+                began = perf_counter()
+                entry["start"] = round(began - start, 3)
+                try:
+                    if inspect.iscoroutinefunction(handler):
+                        ans = await handler(**kwargs)
+                    elif getattr(handler, 'thread', False):
+                        ans = await Scheduler.run_in_thread(handler, **kwargs)
+                    else:
+                        ans = handler(**kwargs)
+                    if isinstance(ans, dict):
+                        response.update(ans)
+                    else:
+                        log.warning(f"[{attribute_flag}] {handler.__name__} did not return a dict. Ignoring.")
+                except Exception as e:
+                    log.exception(f"[{attribute_flag}] Error executing {handler.__name__}: {e}")
+                finally:
+                    entry["seconds"] = round(perf_counter() - began, 3)
+
+        if len(plan) == 1:
+            await run(*plan[0][1:])
+        elif plan:
+            async with asyncio.TaskGroup() as group:
+                for item in plan:
+                    group.create_task(run(*item[1:]), name=f"{type(self).__name__}.{item[1].__name__}")
+        return response
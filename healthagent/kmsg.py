@@ -7,6 +7,7 @@ from healthagent.reporter import Reporter, HealthStatus, HealthReport
 from healthagent.scheduler import Scheduler
 from healthagent.healthmodule import HealthModule
 from healthagent.config import ModuleConfig
+from healthagent.util import boot_id
 import logging
 
 log = logging.getLogger(__name__)
@@ -16,6 +17,8 @@ class KmsgReader(HealthModule):
     def __init__(self, reporter: Reporter, config: 'ModuleConfig | None' = None):
 
         super().__init__(reporter, config)
+        # Sequence number of the last record read, /dev/kmsg replays its whole buffer on open.
+        self.last_seq = -1
         try:
             self.fd = os.open("/dev/kmsg", os.O_RDONLY | os.O_NONBLOCK)
         except Exception as e:
@@ -29,6 +32,14 @@ class KmsgReader(HealthModule):
         if self.fd >= 0:
             os.close(self.fd)
 
+    def save_state(self) -> dict:
+        return {"boot_id": boot_id(), "seq": self.last_seq}
+
+    def restore_state(self, state: dict):
+        # Sequence numbers restart with the kernel.
+        if state.get("boot_id") == boot_id():
+            self.last_seq = max(self.last_seq, state.get("seq", -1))
+
     def boot_time(self):
         # Seconds since epoch - uptime
         with open('/proc/uptime') as f:
@@ -36,7 +47,7 @@ class KmsgReader(HealthModule):
         now = time.time()
         return datetime.fromtimestamp(now - uptime_seconds)
 
-    @Scheduler.periodic(300)
+    @Scheduler.periodic(300, fixed_rate=True, jitter=30)
     async def clear_errors(self):
 
         # This only clears all errors if in the last hour we have received no other alert
@@ -58,9 +69,9 @@ class KmsgReader(HealthModule):
             walltime = self.boot_time() + timedelta(microseconds=int(usec_since_boot))
             level = int(level)
             msg = flags_msg.split(';', 1)[-1]
-            return walltime, level, msg
+            return walltime, level, msg, int(seq)
         except Exception:
-            return None, None, None
+            return None, None, None, None
 
     def get_level(self, level):
 
@@ -88,7 +99,7 @@ class KmsgReader(HealthModule):
         KERN_ALERT  "1"
         KERN_CRIT   "2"
         """
-        report = self.reporter.get_report(name=self.read_callback.report_name) or HealthReport()
+        previous = self.reporter.get_report(name=self.read_callback.report_name) or HealthReport()
         formatted_msg = []
         try:
             while True:
@@ -96,14 +107,17 @@ class KmsgReader(HealthModule):
                 if not data:
                     break
                 for line in data.strip().splitlines():
-                    walltime, level, msg = self.parse_kmsg_line(line)
+                    walltime, level, msg, seq = self.parse_kmsg_line(line)
+                    if seq is not None:
+                        # Already read before a restart.
+                        if seq <= self.last_seq:
+                            continue
+                        self.last_seq = seq
                     # ignore error messages older than an hour
                     if walltime is not None and walltime < datetime.now() - timedelta(hours=1):
                         continue
                     # read level 0 and 1
                     if level is not None and (level <= 2):
-                        # Keep it at warning level for now, actually these should be Errors.
-                        report.status = HealthStatus.WARNING
                         level_str = self.get_level(level=level)
                         timestamp = walltime.strftime("%Y-%m-%dT%H:%M:%S %Z")
                         formatted_msg.append(f"{timestamp} - {level_str} - {msg}")
@@ -113,10 +127,15 @@ class KmsgReader(HealthModule):
         if not formatted_msg:
             return
 
-        if report.details:
-            report.details += "\n" + "\n".join(formatted_msg)
-        else:
-            report.details = "\n".join(formatted_msg)
-        report.message = "KernelMonitor Detected Alerts"
-        report.description = "Kernel Log Monitor reports Critical/Emergency Alerts"
-        Scheduler.add_task(self.reporter.update_report, self.read_callback.report_name, report)
\ No newline at end of file
+        details = "\n".join(formatted_msg)
+        if previous.details:
+            details = previous.details + "\n" + details
+        # The stored report is a read-only snapshot, derive the new one from it.
+        report = previous.evolve(
+            # Keep it at warning level for now, actually these should be Errors.
+            status=HealthStatus.WARNING,
+            details=details,
+            message="KernelMonitor Detected Alerts",
+            description="Kernel Log Monitor reports Critical/Emergency Alerts",
+        )
+        Scheduler.add_task(self.reporter.update_report, self.read_callback.report_name, report)
@@ -0,0 +1,153 @@
+import asyncio
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from datetime import datetime, timezone
+from healthagent.util import LatencyStats
+
+log = logging.getLogger('healthagent')
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class LoopMonitor:
+    """
+    Measures event loop lag: how much later than scheduled a sleep of `interval` seconds wakes up.
+
+    Lag is kept in a histogram and a LatencyStats window. A watchdog thread checks that
+    the sampler keeps waking up; once it is overdue by more than stall_threshold the loop
+    is stalled, and the thread captures the stack of the loop thread along with the name
+    of the asyncio task running at the time. Tasks started by the Scheduler are named
+    after their registry entry, so stalls are attributed to the same names as `health -t`.
+    """
+
+    # Upper bounds (seconds) of the lag histogram buckets, the last bucket is unbounded.
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+    # Frames of the captured stack kept per stall.
+    STACK_DEPTH = 12
+
+    def __init__(self, interval: float = 0.25, stall_threshold: float = 1.0, max_stalls: int = 32):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.lag = LatencyStats()
+        self.histogram = [0] * (len(self.BUCKETS) + 1)
+        self.stall_count = 0
+        self.stalls_by_task = Counter()
+        # Most recent stalls, oldest first.
+        self.stalls = deque(maxlen=max_stalls)
+        self._loop = None
+        self._loop_thread = None
+        self._task = None
+        self._thread = None
+        self._stopped = threading.Event()
+        # Sequence number and monotonic time of the last sampler wakeup. The watchdog
+        # thread tags its capture with the sequence number so a capture is only used
+        # for the stall it was taken in.
+        self._beat = (0, time.monotonic())
+        self._capture = None
+
+    def start(self):
+        """Start sampling the running loop."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = (0, time.monotonic())
+        self._stopped.clear()
+        self._task = self._loop.create_task(self._sample(), name="LoopMonitor")
+        self._thread = threading.Thread(target=self._watch, name="healthagent-loop-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _sample(self):
+        loop = self._loop
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - expected, 0)
+            seq = self._beat[0]
+            self._beat = (seq + 1, time.monotonic())
+            self.record(lag, seq)
+
+    def record(self, lag: float, seq: int = None):
+        self.lag.record(lag)
+        self.histogram[bisect.bisect_left(self.BUCKETS, lag)] += 1
+        if lag < self.stall_threshold:
+            return
+        capture, self._capture = self._capture, None
+        if capture is None or capture["seq"] != seq:
+            # The watchdog thread did not catch this one (eg. lag just above the threshold).
+            capture = {"task": None, "location": None, "stack": []}
+        task = capture["task"] or "unknown"
+        self.stall_count += 1
+        self.stalls_by_task[task] += 1
+        self.stalls.append({
+            "time": time.time(),
+            "lag": round(lag, 4),
+            "task": task,
+            "location": capture["location"],
+            "stack": capture["stack"],
+        })
+        log.warning(f"Event loop stalled for {lag:.3f}s in {task}"
+                    + (f" at {capture['location']}" if capture["location"] else ""))
+
+    def _watch(self):
+        """Watchdog thread, captures the loop thread's stack while it is stalled."""
+        while not self._stopped.wait(self.interval):
+            seq, beat = self._beat
+            if time.monotonic() - beat < self.interval + self.stall_threshold:
+                continue
+            if self._capture is not None and self._capture["seq"] == seq:
+                # Already captured this stall.
+                continue
+            try:
+                self._capture = self._snapshot(seq)
+            except Exception as e:
+                log.debug(f"Unable to capture stalled loop stack: {e}")
+
+    def _snapshot(self, seq: int) -> dict:
+        frame = sys._current_frames().get(self._loop_thread)
+        task = asyncio.current_task(self._loop)
+        stack = traceback.extract_stack(frame)[-self.STACK_DEPTH:] if frame is not None else []
+        location = None
+        for entry in reversed(stack):
+            if entry.filename.startswith(_PACKAGE_DIR) and entry.filename != __file__:
+                location = f"{os.path.relpath(entry.filename, os.path.dirname(_PACKAGE_DIR))}:{entry.lineno} in {entry.name}"
+                break
+        return {
+            "seq": seq,
+            "task": task.get_name() if task is not None else None,
+            "location": location,
+            "stack": [f"{entry.filename}:{entry.lineno} in {entry.name}" for entry in stack],
+        }
+
+    def recent_stalls(self, window: float) -> list:
+        """Stalls of the last `window` seconds."""
+        since = time.time() - window
+        return [stall for stall in self.stalls if stall["time"] >= since]
+
+    def stats(self) -> dict:
+        histogram = {f"<={bound}s": count for bound, count in zip(self.BUCKETS, self.histogram)}
+        histogram[f">{self.BUCKETS[-1]}s"] = self.histogram[-1]
+        recent = []
+        for stall in self.stalls:
+            stall = dict(stall)
+            stall["time"] = datetime.fromtimestamp(stall["time"], tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S %Z")
+            recent.append(stall)
+        return {
+            "interval": self.interval,
+            "stall_threshold": self.stall_threshold,
+            "lag": self.lag.summary(),
+            "histogram": histogram,
+            "stall_count": self.stall_count,
+            "stalls_by_task": dict(self.stalls_by_task.most_common()),
+            "recent_stalls": recent,
+        }
@@ -4,7 +4,7 @@ from enum import Enum
 from pathlib import Path
 from dataclasses import dataclass, fields
 from healthagent import healthcheck
-from healthagent.util import read_kernel_attrs, evaluate, TimeSeries
+from healthagent.util import read_kernel_attrs, evaluate, TimeSeries, boot_id
 from healthagent.healthmodule import HealthModule
 from healthagent.config import NetworkConfig, ThresholdCheck
 from healthagent.reporter import Reporter, HealthReport, HealthStatus
@@ -67,6 +67,25 @@ class NetworkHealthChecks(HealthModule):
         await self.reporter.clear_all_errors()
         Scheduler.add_task(self.run_network_checks)
 
+    def save_state(self) -> dict:
+        # Counters and monotonic timestamps restart with the node, so is the state.
+        return {
+            "boot_id": boot_id(),
+            "time_series": [[key, series.dump()] for key, series in self._time_series.items()],
+            "in_error": list(self._in_error.items()),
+            "trigger_count": list(self._trigger_count.items()),
+        }
+
+    def restore_state(self, state: dict):
+        if state.get("boot_id") != boot_id():
+            log.info("Network state is from a previous boot, not restoring it")
+            return
+        self._time_series = {tuple(key): TimeSeries.load(series) for key, series in state.get("time_series", [])}
+        self._in_error = {tuple(key): value for key, value in state.get("in_error", [])}
+        self._trigger_count = {tuple(key): count for key, count in state.get("trigger_count", [])}
+        log.info(f"Restored {len(self._time_series)} network time series and {len(self._trigger_count)} strike counts")
+
+    @Scheduler.thread(pool="sysfs")
     def get_network_state(self, include_virtual=False) -> list[NetworkInterface]:
 
         network_interfaces = []
@@ -118,10 +137,10 @@ class NetworkHealthChecks(HealthModule):
         return network_interfaces
 
     @healthcheck("NetworkInterfaceCheck", description="Monitor network interface health")
-    @Scheduler.periodic(60)
+    @Scheduler.periodic(60, fixed_rate=True, jitter=15)
     async def run_network_checks(self):
 
-        interfaces = self.get_network_state()
+        interfaces = await Scheduler.run_in_thread(self.get_network_state)
         report = HealthReport()
         custom_fields = {}
         details = []
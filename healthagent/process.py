@@ -77,10 +77,8 @@ class ProcessMonitor(HealthModule):
     async def create(self):
         Scheduler.add_task(self.monitor)
 
-    @healthcheck("ProcessStateCheck", description="Detect zombie and unkillable processes")
-    @epilog
-    @Scheduler.periodic(60)
-    async def monitor(self):
+    @Scheduler.thread(pool="proc")
+    def scan_processes(self) -> tuple[list, list]:
         """
         Reads and iterate over the /proc/<pid>/status file for all pids from list_pids.
         The status file format is
@@ -91,11 +89,9 @@ class ProcessMonitor(HealthModule):
 
         If the State is 'D' or 'Z', stores the pid.
         Also checks the signal bitmasks to identify pending and queued signals.
+        Returns the zombie and the hung processes.
         """
-
         zombieproc = []
-        name = self.monitor.report_name
-        report = HealthReport()
         hungprocs = []
         for pid in ProcessMonitor.list_pids():
             try:
@@ -132,7 +128,19 @@ class ProcessMonitor(HealthModule):
                 # Process may have exited between listing and reading
                 log.error(e)
                 continue
+        return zombieproc, hungprocs
+
+    @healthcheck("ProcessStateCheck", description="Detect zombie and unkillable processes", shared=["proc"])
+    @epilog
+    @Scheduler.periodic(60, fixed_rate=True, jitter=15)
+    async def monitor(self):
+        """
+        Scans /proc off the event loop, see scan_processes.
+        """
 
+        name = self.monitor.report_name
+        report = HealthReport()
+        zombieproc, hungprocs = await Scheduler.run_in_thread(self.scan_processes)
         zombie_count = len(zombieproc)
         pid_usage_pct = (zombie_count / self.pid_max) * 100
 
@@ -0,0 +1,65 @@
+import asyncio
+import struct
+
+# Framed protocol of the daemon socket.
+# A client that starts its connection with MAGIC speaks the framed protocol, the daemon
+# answers with MAGIC. Every message is then a 4 byte big-endian length followed by that
+# many bytes of JSON. Requests carry an "id", responses are {"id": ..., "response": ...}
+# or {"id": ..., "error": "..."}. Several requests can be sent without waiting for the
+# responses (pipelining), the daemon answers each as it completes, not in order.
+# Any other connection is a single JSON request, ended by closing the write side of
+# the connection, answered with the JSON response before the daemon closes it.
+
+# HealthAgent Frames, version 1.
+MAGIC = b"HAF1"
+HEADER = struct.Struct(">I")
+# Largest message accepted, a status response is a few hundred KB at most.
+MAX_FRAME = 16 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def frame(body: bytes) -> bytes:
+    if len(body) > MAX_FRAME:
+        raise ProtocolError(f"Message of {len(body)} bytes is larger than {MAX_FRAME}")
+    return HEADER.pack(len(body)) + body
+
+
+def response_frame(request_id: bytes, payload: bytes) -> bytes:
+    """Frame of a response, payload is the serialized response (spliced in, not parsed again)."""
+    return frame(b'{"id": ' + request_id + b', "response": ' + payload + b'}')
+
+
+async def read_frame(reader) -> bytes | None:
+    """Next message from an asyncio stream, None if the connection was closed between messages."""
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME:
+        raise ProtocolError(f"Message of {length} bytes is larger than {MAX_FRAME}")
+    return await reader.readexactly(length)
+
+
+def recv_exactly(sock, size: int) -> bytes:
+    """Read size bytes from a blocking socket."""
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed by Healthagent")
+        data += chunk
+    return bytes(data)
+
+
+def recv_frame(sock) -> bytes:
+    """Next message from a blocking socket."""
+    (length,) = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    if length > MAX_FRAME:
+        raise ProtocolError(f"Message of {length} bytes is larger than {MAX_FRAME}")
+    return recv_exactly(sock, length)
@@ -1,13 +1,22 @@
+import asyncio
 import copy
+import hashlib
+import json
 from enum import Enum
-from dataclasses import dataclass, asdict, is_dataclass, field, fields, InitVar
+from dataclasses import dataclass, asdict, is_dataclass, field, fields, InitVar, FrozenInstanceError
 from datetime import datetime, timedelta, timezone
 from time import time
 from typing import Any, Dict
 import logging
 import os
-import subprocess
-from healthagent.scheduler import Scheduler
+import random
+import socket
+import zlib
+from healthagent.scheduler import Scheduler, TaskTimeout
+from healthagent.config import ReporterConfig, SinksConfig
+from healthagent.statestore import StateStore, encode, decode
+from healthagent.sinks import Sink, PrometheusSink, NdjsonSink
+from healthagent.util import LatencyStats, TokenBucket, FrozenDict, FrozenList, derived, freeze, thaw
 from healthagent.ghr import GHRCategory
 
 log = logging.getLogger('healthagent')
@@ -19,7 +28,7 @@ def make_json_safe(obj):
         return obj.value
     elif isinstance(obj, datetime):
         return obj.strftime("%Y-%m-%dT%H:%M:%S %Z")
-    elif isinstance(obj, set):
+    elif isinstance(obj, (set, frozenset)):
         return list(obj)
     elif isinstance(obj, dict):
         return {str(k): make_json_safe(v) for k, v in obj.items()}
@@ -32,6 +41,38 @@ def make_json_safe(obj):
     else:
         raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
 
+def _canonical(obj):
+    """
+    json.dumps default for HealthReport fingerprints. Datetimes keep their full precision,
+    types without a stable form (whose repr may hold an id or an address) are rejected.
+    """
+    if isinstance(obj, Enum):
+        return obj.value
+    elif isinstance(obj, datetime):
+        return obj.isoformat()
+    elif isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=repr)
+    elif is_dataclass(obj) and not isinstance(obj, type):
+        return {f.name: getattr(obj, f.name) for f in fields(obj)}
+    raise TypeError(f"Object of type {type(obj).__name__} cannot be part of a health report")
+
+def _digest(value) -> str:
+    """Hash of the canonical JSON form of value."""
+    try:
+        canonical = json.dumps(value, sort_keys=True, separators=(',', ':'), default=_canonical)
+    except TypeError:
+        # Keys of different types in a dict cannot be sorted.
+        canonical = json.dumps(_str_keys(value), sort_keys=True, separators=(',', ':'), default=_canonical)
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+def _str_keys(obj):
+    """Copy of obj with every dict key turned into a string, so that keys of mixed types can be sorted."""
+    if isinstance(obj, dict):
+        return {str(k): _str_keys(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [_str_keys(v) for v in obj]
+    return obj
+
 class HealthStatus(Enum):
     # (display_value, severity) — severity controls ordering
     NA = ('NA', 0)
@@ -93,12 +134,7 @@ class HealthReport:
     def __eq__(self, other):
         if not isinstance(other, HealthReport):
             return NotImplemented
-        d1 = asdict(self)
-        d2 = asdict(other)
-        # remove timestamps before comparing
-        d1.pop('last_update', None)
-        d2.pop('last_update', None)
-        return d1 == d2
+        return self.fingerprint == other.fingerprint
 
     def __post_init__(self, aux_data: dict | None):
         if self.custom_fields is None:
@@ -106,6 +142,122 @@ class HealthReport:
         self.aux_data = aux_data
         self.last_update = datetime.now(tz=timezone.utc)
 
+    def __setattr__(self, name, value):
+        if self.__dict__.get('_frozen'):
+            raise FrozenInstanceError(f"cannot assign to field '{name}' of a stored report, use evolve()")
+        object.__setattr__(self, name, value)
+        if name in _FINGERPRINT_FIELDS:
+            object.__setattr__(self, '_fingerprint', None)
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Hash of the report content, excluding last_update (and aux_data, which is not a field).
+        Cached until a field is assigned: call refresh_fingerprint after changing
+        custom_fields in place.
+        Container values of custom_fields are hashed on their own and the hash of a
+        read-only one is kept on it (see util.derived), so that the fingerprint of a report
+        derived with evolve only hashes again the values that were replaced.
+        """
+        cached = self.__dict__.get('_fingerprint')
+        if cached is None:
+            content = {name: getattr(self, name) for name in _FINGERPRINT_FIELDS}
+            digests = {}
+            if isinstance(self.custom_fields, dict):
+                custom_fields = {}
+                for key, value in self.custom_fields.items():
+                    if isinstance(value, (dict, list, tuple)):
+                        digests[key] = derived(value, '_digest', _digest)
+                        # Containers are never left as is here, so this cannot be taken for one.
+                        custom_fields[key] = {'#': digests[key]}
+                    else:
+                        custom_fields[key] = value
+                content['custom_fields'] = custom_fields
+            cached = _digest(content)
+            object.__setattr__(self, '_fingerprint', cached)
+            object.__setattr__(self, '_digests', digests)
+        return cached
+
+    def refresh_fingerprint(self) -> str:
+        object.__setattr__(self, '_fingerprint', None)
+        return self.fingerprint
+
+    @property
+    def version(self) -> int:
+        """Version stamped when the report was stored, 0 if it was not (see ReportStore)."""
+        return self.__dict__.get('_version', 0)
+
+    @property
+    def frozen(self) -> bool:
+        return self.__dict__.get('_frozen', False)
+
+    def snapshot(self) -> 'HealthReport':
+        """
+        Read-only copy of the report, as kept by the Reporter: fields cannot be assigned and
+        custom_fields / aux_data are frozen (see util.freeze). Containers that are already
+        frozen are shared with this report instead of being copied.
+        """
+        if self.frozen:
+            return self
+        snap = copy.copy(self)
+        custom_fields = freeze(self.custom_fields)
+        if self.__dict__.get('_fingerprint') is not None and isinstance(custom_fields, FrozenDict):
+            # Values frozen just now have the content hashed for the fingerprint, keep their hash.
+            for key, digest in self.__dict__.get('_digests', {}).items():
+                value = custom_fields.get(key)
+                if isinstance(value, (FrozenDict, FrozenList)):
+                    value.__dict__.setdefault('_digest', digest)
+        object.__setattr__(snap, 'custom_fields', custom_fields)
+        object.__setattr__(snap, 'aux_data', freeze(self.aux_data))
+        object.__setattr__(snap, '_frozen', True)
+        return snap
+
+    def evolve(self, **changes) -> 'HealthReport':
+        """
+        New, modifiable report with the given fields changed and the rest taken from this one,
+        eg. `reporter.get_report(name).evolve(status=HealthStatus.WARNING)`.
+        Values are shared rather than copied: custom_fields and aux_data get a new top level
+        dict, their nested values stay frozen and must be replaced rather than changed in place.
+        """
+        report = copy.copy(self)
+        report.__dict__.pop('_views', None)
+        object.__setattr__(report, '_frozen', False)
+        object.__setattr__(report, 'custom_fields', thaw(self.custom_fields))
+        object.__setattr__(report, 'aux_data', thaw(self.aux_data))
+        report.last_update = datetime.now(tz=timezone.utc)
+        for name, value in changes.items():
+            if name not in _FINGERPRINT_FIELDS and name != 'aux_data':
+                raise TypeError(f"HealthReport has no field '{name}'")
+            setattr(report, name, value)
+        return report
+
+    def to_state(self) -> dict:
+        """JSON compatible form of the report, aux_data included, for the StateStore."""
+        state = {name: encode(getattr(self, name)) for name in _FINGERPRINT_FIELDS}
+        state["last_update"] = encode(self.last_update)
+        state["aux_data"] = encode(self.aux_data)
+        return state
+
+    @classmethod
+    def from_state(cls, state: dict) -> 'HealthReport':
+        """Read-only report from to_state, fields unknown to this version are ignored."""
+        values = {name: decode(state[name]) for name in _FINGERPRINT_FIELDS if name in state}
+        report = cls(aux_data=decode(state.get("aux_data")), **values)
+        if "last_update" in state:
+            report.last_update = decode(state["last_update"])
+        return report.snapshot()
+
+    def _touched(self, last_update: datetime, aux_data: dict | None) -> 'HealthReport':
+        """
+        Shallow copy of a stored report with new values for the fields that are not part of
+        its content. The report itself is left as is, readers may still hold it.
+        """
+        report = copy.copy(self)
+        report.__dict__.pop('_views', None)
+        object.__setattr__(report, 'last_update', last_update)
+        object.__setattr__(report, 'aux_data', freeze(aux_data) if self.frozen else aux_data)
+        return report
+
     def __getattr__(self, item):
         return self.custom_fields.get(item, None)
 
@@ -128,11 +280,22 @@ class HealthReport:
         aux_data is an InitVar and is excluded from asdict() automatically.
         Custom fields are module specific and are merged to top_level.
         cli_exclude: when True, fields marked with metadata={"cli_exclude": True} are omitted.
+        The view of a stored (read-only) report is rendered once and cached: do not modify it.
         """
+        if self.frozen:
+            # Stored snapshots never change, an update with the same content stores a copy (see _touched).
+            views = self.__dict__.setdefault('_views', {})
+            if cli_exclude not in views:
+                views[cli_exclude] = self._render(cli_exclude)
+            return views[cli_exclude]
+        return self._render(cli_exclude)
+
+    def _render(self, cli_exclude: bool) -> Dict[str, Any]:
         # Collect fields to exclude based on metadata
         exclude = {f.name for f in fields(self) if f.metadata.get("cli_exclude")} if cli_exclude else set()
-        # Convert the dataclass to a dictionary
-        base_dict = make_json_safe(asdict(self))
+        # Convert the dataclass to a dictionary, make_json_safe already copies every container
+        # (asdict would deepcopy them first).
+        base_dict = {f.name: make_json_safe(getattr(self, f.name)) for f in fields(self)}
         # Merge custom_fields into the top-level dictionary
         custom_fields = base_dict.pop("custom_fields", {})
         base_dict.update(custom_fields)
@@ -144,16 +307,492 @@ class HealthReport:
         }
         return filtered_dict
 
+
+# Fields hashed by HealthReport.fingerprint.
+_FINGERPRINT_FIELDS = tuple(f.name for f in fields(HealthReport) if f.name != 'last_update')
+
+
+async def _exec(args: list, timeout: float = 30):
+    """Run a command outside of the Scheduler, returns (returncode, stdout, stderr)."""
+    proc = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE,
+                                                stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except TimeoutError:
+        proc.kill()
+        raise
+    return proc.returncode, stdout, stderr
+
+
+def _node_rng(hostname: str = None) -> random.Random:
+    """Random generator seeded with the hostname: the same sequence on every restart of a node, different across nodes."""
+    return random.Random(zlib.crc32((hostname or socket.gethostname()).encode()))
+
+
+@dataclass
+class PendingPublish:
+    "jetpack arguments of the latest state to publish"
+    args: list
+    "loop time of the first change not published yet"
+    queued: float
+    "status of the latest state, publishes of higher severity go first"
+    status: HealthStatus = HealthStatus.OK
+    "waiting for a token only"
+    ready: bool = False
+    attempts: int = 0
+    handle: Any = None
+
+
+class Publisher:
+    """
+    Publishes report changes to CycleCloud as jetpack node conditions, shared by all reporters.
+    Changes are queued by report name and published DEBOUNCE seconds (plus up to JITTER seconds)
+    after the first one, with the latest state: a report flipping several times in a burst costs
+    one jetpack process. A publish that fails (jetpack exits non-zero or times out) is retried
+    with exponential backoff, with the latest state if the report changed meanwhile.
+
+    When a shared dependency fails every node reports at once, so the jitter is drawn from a
+    generator seeded with the hostname, spreading nodes apart instead of all waiting the same.
+    Publishes also take a token from a bucket refilling RATE per second (holding BURST), and
+    while they wait for one, ERROR states go ahead of WARNING states, which go ahead of OK recoveries.
+    """
+
+    DEBOUNCE = 1.0
+    JITTER = 5.0
+    RATE = 0.5
+    BURST = 5
+    RETRY_BACKOFF = 5
+    RETRY_BACKOFF_MAX = 300
+    MAX_RETRIES = 5
+    _rng = _node_rng()
+    _bucket = TokenBucket(RATE, BURST)
+    _dispatch_handle = None
+    # Queued changes by report name, and the ones being published.
+    _pending = {}
+    _in_flight = {}
+    _tasks = set()
+    _counts = {"published": 0, "coalesced": 0, "retries": 0, "failed": 0, "throttled": 0}
+    # Seconds from the first change of a report to it being published.
+    _latency = LatencyStats()
+
+    @classmethod
+    def configure(cls, config: ReporterConfig):
+        cls.DEBOUNCE = config.debounce
+        cls.JITTER = config.jitter
+        cls.RATE = config.rate
+        cls.BURST = config.burst
+        cls.RETRY_BACKOFF = config.retry_backoff
+        cls.RETRY_BACKOFF_MAX = config.retry_backoff_max
+        cls.MAX_RETRIES = config.max_retries
+        cls._bucket = TokenBucket(cls.RATE, cls.BURST)
+
+    @classmethod
+    def publish(cls, name: str, args: list, status: HealthStatus = HealthStatus.OK):
+        """Queue the jetpack command publishing the latest state of report `name`."""
+        entry = cls._pending.get(name)
+        if entry is not None:
+            entry.args = args
+            entry.status = status
+            cls._counts["coalesced"] += 1
+            if entry.ready:
+                # Waiting for a token, its priority may have changed.
+                cls._dispatch()
+            return
+        entry = PendingPublish(args=args, queued=asyncio.get_running_loop().time(), status=status)
+        cls._pending[name] = entry
+        if name not in cls._in_flight:
+            # Otherwise it is scheduled once the publish in flight completes.
+            cls._arm(name, entry, cls.DEBOUNCE + cls._rng.uniform(0, cls.JITTER))
+
+    @classmethod
+    def _arm(cls, name: str, entry: PendingPublish, delay: float):
+        entry.ready = False
+        entry.handle = asyncio.get_running_loop().call_later(delay, cls._ready, name)
+
+    @classmethod
+    def _ready(cls, name: str):
+        entry = cls._pending.get(name)
+        if entry is None:
+            return
+        entry.handle = None
+        entry.ready = True
+        cls._dispatch()
+
+    @classmethod
+    def _dispatch(cls):
+        """Start ready publishes, most severe first, as long as there are tokens."""
+        if cls._dispatch_handle is not None:
+            cls._dispatch_handle.cancel()
+            cls._dispatch_handle = None
+        loop = asyncio.get_running_loop()
+        while True:
+            ready = [(name, entry) for name, entry in cls._pending.items() if entry.ready]
+            if not ready:
+                return
+            wait = cls._bucket.take(loop.time())
+            if wait > 0:
+                cls._counts["throttled"] += 1
+                cls._dispatch_handle = loop.call_later(wait, cls._dispatch)
+                return
+            name, _ = max(ready, key=lambda item: (item[1].status.severity, -item[1].queued))
+            cls._start(name)
+
+    @classmethod
+    def _start(cls, name: str):
+        entry = cls._pending.pop(name, None)
+        if entry is None:
+            return
+        if entry.handle is not None:
+            entry.handle.cancel()
+            entry.handle = None
+        entry.ready = False
+        cls._in_flight[name] = entry
+        task = asyncio.create_task(cls._run(name, entry), name=f"Publisher[{name}]")
+        cls._tasks.add(task)
+        task.add_done_callback(cls._tasks.discard)
+
+    @classmethod
+    async def _run(cls, name: str, entry: PendingPublish):
+        ok = False
+        try:
+            task = Scheduler.add_task(Scheduler.subprocess(*entry.args, wait=True))
+            if task is None:
+                # Scheduler stopped, eg. flushing on shutdown.
+                task = _exec(entry.args)
+            returncode, _, stderr = await task
+            ok = returncode == 0
+            if not ok:
+                log.warning(f"jetpack condition set for {name} exited with {returncode}: {stderr.decode(errors='replace').strip()}")
+        except TaskTimeout as e:
+            log.warning(e)
+        except Exception as e:
+            log.exception(e)
+        finally:
+            cls._in_flight.pop(name, None)
+
+        now = asyncio.get_running_loop().time()
+        if ok:
+            cls._counts["published"] += 1
+            cls._latency.record(now - entry.queued)
+        newer = cls._pending.get(name)
+        if ok:
+            if newer is not None:
+                cls._arm(name, newer, max(newer.queued + cls.DEBOUNCE - now, 0))
+            return
+        attempts = entry.attempts + 1
+        if attempts > cls.MAX_RETRIES:
+            cls._counts["failed"] += 1
+            log.error(f"Giving up publishing {name} after {attempts} attempts")
+            # Including a newer state that arrived meanwhile, the next change starts over.
+            cls._pending.pop(name, None)
+            return
+        cls._counts["retries"] += 1
+        delay = min(cls.RETRY_BACKOFF * 2 ** (attempts - 1), cls.RETRY_BACKOFF_MAX)
+        # Between half and the full backoff, so nodes failing together retry apart.
+        delay *= cls._rng.uniform(0.5, 1)
+        if newer is not None:
+            # A newer state arrived meanwhile, it replaces the retry, once debounced as well.
+            entry = newer
+            delay = max(delay, newer.queued + cls.DEBOUNCE - now)
+        else:
+            cls._pending[name] = entry
+        entry.attempts = attempts
+        log.info(f"Retrying to publish {name} in {delay:.0f}s")
+        cls._arm(name, entry, delay)
+
+    @classmethod
+    async def flush(cls, timeout: float = None):
+        """Publish every queued change now, regardless of the rate limit, and wait for the publishes in flight, eg. on shutdown."""
+        for name in list(cls._pending):
+            cls._start(name)
+        if cls._tasks:
+            await asyncio.wait(list(cls._tasks), timeout=timeout)
+
+    @classmethod
+    def reset(cls):
+        for entry in cls._pending.values():
+            if entry.handle is not None:
+                entry.handle.cancel()
+        if cls._dispatch_handle is not None:
+            cls._dispatch_handle.cancel()
+            cls._dispatch_handle = None
+        cls._bucket = TokenBucket(cls.RATE, cls.BURST)
+        cls._pending = {}
+        cls._in_flight = {}
+        cls._counts = dict.fromkeys(cls._counts, 0)
+        cls._latency = LatencyStats()
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {
+            "queued": len(cls._pending),
+            "waiting_for_token": sum(1 for entry in cls._pending.values() if entry.ready),
+            "in_flight": len(cls._in_flight),
+            **cls._counts,
+            "latency": cls._latency.summary(),
+        }
+
+
+class Subscriber:
+    """Queue of report events of one subscribe connection, see ReportEvents."""
+
+    def __init__(self, maxsize: int):
+        self.queue = asyncio.Queue(maxsize)
+        # Events dropped since the last one handed out, because the queue was full.
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, event: dict):
+        if self.queue.full():
+            # Slow reader: drop its oldest event rather than let the queue grow.
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: float = None) -> dict | None:
+        """
+        Next event, None once closed or if none arrived within timeout. When events were dropped
+        a "dropped" event comes first: the subscriber should resync, eg. with status_since.
+        """
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            return {"event": "dropped", "count": dropped, "version": ReportStore.version}
+        if self.closed and self.queue.empty():
+            return None
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except TimeoutError:
+            return None
+
+    def close(self):
+        self.closed = True
+        # Wake up a get waiting on an empty queue.
+        if self.queue.empty():
+            self.queue.put_nowait(None)
+
+
+class ReportEvents:
+    """
+    Streams report changes to subscribers, shared by all reporters. Each subscriber has a
+    bounded queue: a subscriber that does not keep up loses its oldest events (and is told
+    so) instead of holding up the reporters.
+    """
+
+    QUEUE_SIZE = 256
+    MAX_SUBSCRIBERS = 16
+    _subscribers = set()
+
+    @classmethod
+    def subscribe(cls) -> Subscriber:
+        if len(cls._subscribers) >= cls.MAX_SUBSCRIBERS:
+            raise RuntimeError(f"Too many subscribers (max {cls.MAX_SUBSCRIBERS})")
+        subscriber = Subscriber(cls.QUEUE_SIZE)
+        cls._subscribers.add(subscriber)
+        return subscriber
+
+    @classmethod
+    def unsubscribe(cls, subscriber: Subscriber):
+        cls._subscribers.discard(subscriber)
+        subscriber.close()
+
+    @classmethod
+    def emit(cls, event: dict):
+        for subscriber in cls._subscribers:
+            subscriber.put(event)
+
+    @classmethod
+    def close(cls):
+        """Close every subscription, eg. on shutdown."""
+        for subscriber in list(cls._subscribers):
+            cls.unsubscribe(subscriber)
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {"subscribers": len(cls._subscribers),
+                "queued": sum(subscriber.queue.qsize() for subscriber in cls._subscribers)}
+
+
+class JetpackSink(Sink):
+    """Report changes as CycleCloud node conditions, see Reporter.publish_cc_status and Publisher."""
+
+    name = "jetpack"
+
+    async def publish(self, reporter, name: str, report):
+        await reporter.publish_cc_status(name)
+
+    async def flush(self, timeout: float = None):
+        await Publisher.flush(timeout=timeout)
+
+    async def close(self, timeout: float = None):
+        await self.flush(timeout=timeout)
+
+
+class Sinks:
+    """
+    Destinations of report changes, shared by all reporters: every change a reporter stores is
+    handed to each sink (see sinks.Sink), which batches it and writes it later. Jetpack node
+    conditions are always published, the file sinks are enabled in the sinks section of the config.
+    """
+
+    _sinks = [JetpackSink()]
+
+    @classmethod
+    def configure(cls, config: SinksConfig, rundir: str = None):
+        """Sinks enabled by config, paths are relative to rundir."""
+        def resolve(path):
+            return os.path.join(rundir, path) if rundir else path
+        sinks = [JetpackSink()]
+        if config.prometheus.enabled:
+            sinks.append(PrometheusSink(resolve(config.prometheus.path), config.prometheus.interval))
+        if config.ndjson.enabled:
+            sinks.append(NdjsonSink(resolve(config.ndjson.path), config.ndjson.interval, config.ndjson.max_bytes))
+        cls._sinks = sinks
+
+    @classmethod
+    def add(cls, sink: Sink):
+        cls._sinks.append(sink)
+
+    @classmethod
+    def get(cls, name: str) -> Sink | None:
+        return next((sink for sink in cls._sinks if sink.name == name), None)
+
+    @classmethod
+    async def publish(cls, reporter: 'Reporter', name: str, report: HealthReport):
+        for sink in cls._sinks:
+            try:
+                await sink.publish(reporter, name, report)
+            except Exception as e:
+                log.exception(f"Sink {sink.name} unable to publish {name}: {e}")
+
+    @classmethod
+    def remove(cls, module: str, name: str):
+        for sink in cls._sinks:
+            try:
+                sink.remove(module, name)
+            except Exception as e:
+                log.exception(f"Sink {sink.name} unable to remove {name}: {e}")
+
+    @classmethod
+    def load(cls, module: str, reports: dict):
+        """Reports a module starts with, for sinks holding the state of every report."""
+        for sink in cls._sinks:
+            try:
+                sink.load(module, reports)
+            except Exception as e:
+                log.exception(f"Sink {sink.name} unable to load the reports of {module}: {e}")
+
+    @classmethod
+    async def close(cls, timeout: float = None):
+        """Write everything still queued, eg. on shutdown."""
+        for sink in cls._sinks:
+            try:
+                await sink.close(timeout=timeout)
+            except Exception as e:
+                log.exception(f"Unable to close sink {sink.name}: {e}")
+
+    @classmethod
+    def stats(cls) -> dict:
+        # Jetpack publishes are in Publisher.stats.
+        return {sink.name: sink.stats() for sink in cls._sinks if not isinstance(sink, JetpackSink)}
+
+
+class ReportStore(dict):
+    """
+    Reports by name. Counts its changes in `generation`, so that a response rendered
+    from the store can be reused as long as the generation is the same.
+
+    Every report set in a store is stamped with a new version, and every removed name
+    is kept with the version of its removal, so that callers can ask for what changed
+    after a version they have seen (see changed_since). Versions are shared by all the
+    stores and start from the current time in microseconds, so they keep increasing
+    across restarts of the daemon.
+    """
+
+    # Last version handed out.
+    version = 0
+
+    @classmethod
+    def next_version(cls) -> int:
+        cls.version = max(cls.version + 1, int(time() * 1e6))
+        return cls.version
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.generation = 0
+        # Version at which each removed report was removed.
+        self.removed = {}
+        self.update(*args, **kwargs)
+
+    def touch(self, key, value):
+        """
+        Replace the report of key by one with the same content (eg. a new last_update),
+        it keeps its version.
+        """
+        object.__setattr__(value, '_version', self[key].version)
+        super().__setitem__(key, value)
+        self.generation += 1
+
+    def changed_since(self, since: int) -> tuple[dict, list]:
+        """Reports stamped with a version above `since`, and names removed after it."""
+        changed = {name: report for name, report in self.items() if report.version > since}
+        removed = [name for name, version in self.removed.items() if version > since]
+        return changed, removed
+
+    def __setitem__(self, key, value):
+        object.__setattr__(value, '_version', self.next_version())
+        super().__setitem__(key, value)
+        self.removed.pop(key, None)
+        self.generation += 1
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.removed[key] = self.next_version()
+        self.generation += 1
+
+    def pop(self, key, *default):
+        if key not in self:
+            return super().pop(key, *default)
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self):
+        key = next(reversed(self))
+        return key, self.pop(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+
 class Reporter:
 
+    JETPACK = "/opt/cycle/jetpack/bin/jetpack"
     JETPACK_VERSION_MINIMUM = "8.8.0"
     JETPACK_VERSION_GHR = "8.10.0"
+    # jetpack --version probes by jetpack path, shared by all reporters.
+    _jetpack_probes = {}
+
     def __init__(self, name: str = None):
         """
         name: name of the health report (optional)
         """
-        self.jetpack = "/opt/cycle/jetpack/bin/jetpack"
-        self.store = {}
+        self.jetpack = self.JETPACK
+        self.store = ReportStore()
+        # (store, generation, summary) of the last summarize call.
+        self._summary = (None, None, None)
         self.publish_cc = os.getenv("PUBLISH_CC", 'true').lower() == 'true'
         self.enable_ghr = True
 
@@ -161,23 +800,18 @@ class Reporter:
             log.info(f"{self.jetpack} not found")
             self.publish_cc = False
             self.enable_ghr = False
-        elif self.publish_cc:
-            version = self._get_jetpack_version()
-            if version is None or version < self._parse_version(self.JETPACK_VERSION_MINIMUM):
-                self.publish_cc = False
-                self.enable_ghr = False
-                log.warning(f"Jetpack version too old or unknown, disabling CC publishing and GHR")
-            elif version < self._parse_version(self.JETPACK_VERSION_GHR):
-                self.enable_ghr = False
-                log.info(f"Jetpack version < {self.JETPACK_VERSION_GHR}, disabling GHR")
 
         if not self.publish_cc:
             log.info("Disabling publishing reports to CC.")
             self.enable_ghr = False
         if not self.enable_ghr:
             log.info("Disabling Guest Health Reporting")
+        # The jetpack version is checked on the first publish, see check_jetpack_version.
+        self._jetpack_checked = not self.publish_cc
+        # Name of the module owning the reporter, set by Healthagent, included in report events.
+        self.module = None
         if name:
-            self.store[name] = HealthReport()
+            self.store[name] = HealthReport().snapshot()
 
 
     @staticmethod
@@ -186,18 +820,91 @@ class Reporter:
         base = version_str.strip().split('-')[0]
         return tuple(int(x) for x in base.split('.'))
 
-    def _get_jetpack_version(self) -> tuple | None:
+    @classmethod
+    def probe_jetpack(cls, jetpack: str = JETPACK, cache_file: str = None) -> asyncio.Task:
+        """
+        Start finding out the version of jetpack in the background, once for all reporters,
+        eg. while the modules initialize. The version is cached in cache_file (if given)
+        along with the inode and mtime of the jetpack binary, so that it is only probed
+        again when jetpack is replaced.
+        """
+        probe = cls._jetpack_probes.get(jetpack)
+        if probe is None or (probe.done() and probe.get_loop() is not asyncio.get_running_loop()):
+            probe = asyncio.create_task(cls._get_jetpack_version(jetpack, cache_file), name="Reporter.probe_jetpack")
+            cls._jetpack_probes[jetpack] = probe
+        return probe
+
+    @classmethod
+    async def _get_jetpack_version(cls, jetpack: str, cache_file: str = None) -> tuple | None:
 
         try:
-            result = subprocess.run(
-                [self.jetpack, '--version'],
-                capture_output=True, text=True, timeout=10
-            )
-            if result.returncode == 0:
-                return self._parse_version(result.stdout)
+            stat = os.stat(jetpack)
+        except OSError as e:
+            log.warning(f"Failed to determine jetpack version: {e}")
+            return None
+        key = {"path": jetpack, "inode": stat.st_ino, "mtime_ns": stat.st_mtime_ns}
+        if cache_file:
+            try:
+                with open(cache_file) as f:
+                    cached = json.load(f)
+                if cached.get("key") == key:
+                    log.debug(f"Using cached jetpack version {cached['version']}")
+                    return cls._parse_version(cached["version"])
+            except (OSError, ValueError, KeyError, TypeError, AttributeError):
+                pass
+        try:
+            returncode, stdout, _ = await _exec([jetpack, '--version'], timeout=10)
         except Exception as e:
             log.warning(f"Failed to determine jetpack version: {e}")
-        return None
+            return None
+        if returncode != 0:
+            log.warning(f"jetpack --version exited with {returncode}")
+            return None
+        version = stdout.decode(errors='replace').strip()
+        try:
+            parsed = cls._parse_version(version)
+        except ValueError:
+            log.warning(f"Unable to parse jetpack version: {version}")
+            return None
+        if cache_file:
+            try:
+                tmp = f"{cache_file}.tmp"
+                with open(tmp, 'w') as f:
+                    json.dump({"key": key, "version": version}, f)
+                os.replace(tmp, cache_file)
+            except OSError as e:
+                log.debug(f"Unable to cache jetpack version: {e}")
+        return parsed
+
+    async def check_jetpack_version(self):
+        """Disable CC publishing and GHR according to the jetpack version, waiting for the shared probe."""
+        if self._jetpack_checked:
+            return
+        version = await asyncio.shield(self.probe_jetpack(self.jetpack))
+        self._jetpack_checked = True
+        if version is None or version < self._parse_version(self.JETPACK_VERSION_MINIMUM):
+            self.publish_cc = False
+            self.enable_ghr = False
+            log.warning(f"Jetpack version too old or unknown, disabling CC publishing and GHR")
+        elif version < self._parse_version(self.JETPACK_VERSION_GHR):
+            self.enable_ghr = False
+            log.info(f"Jetpack version < {self.JETPACK_VERSION_GHR}, disabling GHR")
+
+    @classmethod
+    def from_state(cls, reports: dict) -> 'Reporter':
+        """Reporter with the reports persisted by the StateStore."""
+        reporter = cls()
+        for name, state in reports.items():
+            try:
+                reporter.store[name] = HealthReport.from_state(state)
+            except Exception as e:
+                log.error(f"Unable to restore report {name}: {e}")
+        return reporter
+
+    def persist(self):
+        """Record every report in the StateStore, eg. after restoring them from elsewhere."""
+        for name, report in self.store.items():
+            StateStore.record_report(self.module, name, report.to_state())
 
     @classmethod
     def load_reporter_obj(cls, old) -> 'Reporter':
@@ -205,25 +912,56 @@ class Reporter:
         new_reporter = cls()
         # Transfer the health report store if it exists
         if hasattr(old, 'store') and old.store:
-            new_reporter.store = old.store
+            new_reporter.store = ReportStore((name, report.snapshot()) for name, report in old.store.items())
 
         return new_reporter
 
 
     def get_report(self, name) -> HealthReport:
-
-        data = self.store.get(name)
-        if data:
-            return copy.deepcopy(data)
-        return data
+        """
+        Stored report, None if there is none. Reports are stored as read-only snapshots,
+        so this returns the report itself rather than a copy: use evolve() to derive a new one.
+        """
+        return self.store.get(name)
 
     def summarize(self):
-
+        """
+        Views of all the reports. Reused until the store changes, do not modify it.
+        """
+        store, generation, summary = self._summary
+        current = getattr(self.store, 'generation', None)
+        if store is self.store and current is not None and generation == current:
+            return summary
         response = {}
         for name, report in self.store.items():
             response[name] = report.view(cli_exclude=True)
+        self._summary = (self.store, current, response)
         return response
 
+    def changed_since(self, since: int) -> tuple[dict, list]:
+        """
+        Views of the reports whose content changed after version `since`, and the names of
+        the reports removed since. A report whose last_update moved forward without any other
+        change keeps its version.
+        """
+        changed, removed = self.store.changed_since(since)
+        return {name: report.view(cli_exclude=True) for name, report in changed.items()}, removed
+
+    def remove_report(self, name: str):
+        """Drop the report, eg. of a healthcheck that no longer exists."""
+        last_report = self.store.pop(name, None)
+        if last_report is None:
+            return
+        StateStore.record_removal(self.module, name)
+        ReportEvents.emit({
+            "event": "removed",
+            "module": self.module,
+            "report": name,
+            "old_status": last_report.status.value,
+            "version": self.store.removed[name],
+        })
+        Sinks.remove(self.module, name)
+
     async def clear_all_errors(self, delta: timedelta = None):
         """
         Clear all errors or all errors before a given delta.
@@ -244,6 +982,10 @@ class Reporter:
         if not isinstance(report, HealthReport):
             raise TypeError("The 'report' argument must be an instance of HealthReport.")
 
+        if report.frozen:
+            # eg. a report returned by get_report
+            report = report.evolve()
+
         # Prepare default messages for warnings and errors
         default_messages = {
             HealthStatus.WARNING: f"{name} reports warnings",
@@ -257,19 +999,46 @@ class Reporter:
         # Always update the last_update before comparison
         report.last_update = datetime.now(tz=timezone.utc)
         last_report = self.store.get(name)
-        if not last_report or (last_report != report):
-            self.store[name] = copy.deepcopy(report)
-            log.info(f"Updated health report for {name}: {report.view()}")
-            await self.publish_cc_status(name)
+        # The caller may have changed custom_fields in place since the fingerprint was cached.
+        # Stored snapshots are read-only, so their fingerprint stays valid.
+        report.refresh_fingerprint()
+        if not last_report or last_report.fingerprint != report.fingerprint:
+            self.store[name] = report.snapshot()
+            # The view of the stored report is cached, status requests reuse it.
+            log.info(f"Updated health report for {name}: {self.store[name].view()}")
+            self._record_state(name, self.store[name])
+            ReportEvents.emit({
+                "event": "report",
+                "module": self.module,
+                "report": name,
+                "old_status": last_report.status.value if last_report else None,
+                "new_status": report.status.value,
+                "version": self.store[name].version,
+            })
+            await Sinks.publish(self, name, self.store[name])
         else:
             # aux_data is excluded from equality (InitVar), so always copy it
             # to ensure modules that update aux_data between identical reports
             # don't silently lose state.
-            self.store[name].last_update = report.last_update
-            self.store[name].aux_data = copy.deepcopy(report.aux_data)
+            aux_changed = report.aux_data != last_report.aux_data
+            self.store.touch(name, last_report._touched(report.last_update, report.aux_data))
+            if aux_changed:
+                self._record_state(name, self.store[name])
+
+    def _record_state(self, name: str, report: HealthReport):
+        """Journal the report, see StateStore. A report that cannot be saved is still published."""
+        if not StateStore.recording(self.module):
+            return
+        try:
+            StateStore.record_report(self.module, name, report.to_state())
+        except Exception as e:
+            log.exception(f"Unable to save the state of report {name}: {e}")
 
     async def publish_cc_status(self, name):
 
+        if not self.publish_cc:
+            return
+        await self.check_jetpack_version()
         if not self.publish_cc:
             return
         report = self.store.get(name)
@@ -291,6 +1060,4 @@ class Reporter:
                 if report.ghr_category is not None:
                     args.extend(['--action-type', 'GHR', '--ghr-category', report.ghr_category.value])
 
-        # Schedule the subprocess task
-        task = Scheduler.subprocess(*args)
-        await Scheduler.add_task(task)
+        Publisher.publish(name, args, status=report.status)
@@ -1,24 +1,716 @@
 import asyncio
+import contextlib
+import contextvars
 import functools
+import importlib
+import inspect
 import logging
-from concurrent.futures import ProcessPoolExecutor
+import os
+import random
+import time
+from collections import deque
+from datetime import datetime, timezone
+from healthagent.util import LatencyStats, read_peak_rss
+from healthagent.loopmonitor import LoopMonitor
+from healthagent.config import SchedulerConfig
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import multiprocessing
 
 log = logging.getLogger('healthagent')
 
+
+def _pool_initializer(preload: tuple):
+    """
+    Runs once in every pool worker process right after it is spawned.
+    Imports the modules pool tasks live in (and therefore the DCGM bindings)
+    so that the first task submitted to the worker does not pay for it.
+    """
+    for module in preload:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            log.debug(f"Pool worker unable to preload {module}: {e}")
+
+
+def _pool_ping():
+    """No-op submitted to a fresh worker to force it to spawn and initialize."""
+    return True
+
+
+class PoolWorker:
+    """
+    A single long-lived spawn-context worker process.
+    Pool tasks are run on a PoolWorker that is reused across calls, so the
+    interpreter startup and module imports are only paid once per worker.
+    """
+
+    def __init__(self, preload: tuple = ()):
+        self.executor = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_pool_initializer,
+            initargs=(tuple(preload),)
+        )
+        self.tasks_run = 0
+        self.broken = False
+
+    def warm(self):
+        """Spawn the worker process now instead of on the first task."""
+        future = self.executor.submit(_pool_ping)
+        future.add_done_callback(self._warm_done)
+        return future
+
+    def _warm_done(self, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            log.warning(f"Pool worker failed to start: {future.exception()}")
+            self.broken = True
+
+    async def run(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        self.tasks_run += 1
+        try:
+            return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+        except BrokenProcessPool:
+            self.broken = True
+            raise
+
+    def kill(self):
+        """Terminate the worker process (if any) and release the executor."""
+        # ProcessPoolExecutor does not expose its processes publicly.
+        for process in list(getattr(self.executor, "_processes", {}).values()):
+            if process.is_alive():
+                process.kill()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _call_soon_threadsafe(loop, callback, *args):
+    """Schedule callback on the loop from another thread, unless the loop is already closed."""
+    try:
+        loop.call_soon_threadsafe(callback, *args)
+    except RuntimeError:
+        pass
+
+
+class ThreadPool:
+    """
+    A named, bounded pool of threads for @Scheduler.thread tasks.
+    Counters are only updated on the event loop.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"healthagent-{name}")
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        # Time spent waiting for a free thread, and running on it.
+        self.wait = LatencyStats()
+        self.runtime = LatencyStats()
+
+    def submit(self, loop, function, *args, **kwargs):
+        """Run function on a pool thread, returns a concurrent.futures.Future."""
+        submitted = time.perf_counter()
+        context = contextvars.copy_context()
+        self.queued += 1
+
+        def run():
+            started = time.perf_counter()
+            _call_soon_threadsafe(loop, self._started, started - submitted)
+            try:
+                return context.run(function, *args, **kwargs)
+            finally:
+                _call_soon_threadsafe(loop, self._finished, time.perf_counter() - started)
+
+        def done(future):
+            if future.cancelled():
+                _call_soon_threadsafe(loop, self._dropped)
+
+        future = self.executor.submit(run)
+        future.add_done_callback(done)
+        return future
+
+    def _started(self, wait: float):
+        self.queued -= 1
+        self.running += 1
+        self.wait.record(wait)
+
+    def _finished(self, runtime: float):
+        self.running -= 1
+        self.completed += 1
+        self.runtime.record(runtime)
+
+    def _dropped(self):
+        # Cancelled before a thread picked it up.
+        self.queued -= 1
+
+    def shutdown(self):
+        # Threads cannot be interrupted, running tasks complete in the background.
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "running": self.running,
+            "queued": self.queued,
+            "completed": self.completed,
+            "wait": self.wait.summary(),
+            "runtime": self.runtime.summary(),
+        }
+
+
+class TaskTimeout(TimeoutError):
+    """A task did not complete within its timeout (or the deadline of the request that started it)."""
+
+    def __init__(self, name: str, timeout: float):
+        self.name = name
+        self.timeout = timeout
+        super().__init__(f"{name} timed out after {timeout:.3g}s")
+
+
+class ResourceLock:
+    """
+    Lock manager for named resources.
+    Holders claim a set of (resource, id) keys. Claims on disjoint keys are granted
+    concurrently, overlapping claims are serialized in arrival order, except that
+    priority claims are queued ahead of all non-priority ones.
+    An id of None claims every id of that resource (eg. all GPUs) and the key
+    EVERYTHING conflicts with every other claim.
+    Keys can also be claimed shared, as (resource, id, SHARED): shared claims of a
+    key are granted together, they only conflict with exclusive claims of it.
+    """
+
+    EVERYTHING = ("*", None)
+    SHARED = "shared"
+
+    def __init__(self):
+        self._held = []
+        self._waiters = deque()
+
+    @classmethod
+    def keys(cls, resource: str, ids=None, shared: bool = False) -> frozenset:
+        """Keys claiming the ids of resource, every id when ids is None or empty."""
+        if ids is None or ids == [] or ids == "":
+            ids = [None]
+        else:
+            if isinstance(ids, (str, int)):
+                ids = [ids]
+            ids = [str(i).strip() for i in ids]
+        return frozenset((resource, i, cls.SHARED) if shared else (resource, i) for i in ids)
+
+    @classmethod
+    def conflicts(cls, a: frozenset, b: frozenset) -> bool:
+        for key_a in a:
+            for key_b in b:
+                res_a, id_a = key_a[0], key_a[1]
+                res_b, id_b = key_b[0], key_b[1]
+                if res_a == "*" or res_b == "*":
+                    return True
+                if res_a == res_b and (id_a is None or id_b is None or id_a == id_b):
+                    if key_a[2:] == key_b[2:] == (cls.SHARED,):
+                        continue
+                    return True
+        return False
+
+    def _blocked(self, keys: frozenset, ahead) -> bool:
+        return (any(self.conflicts(keys, held) for held in self._held) or
+                any(self.conflicts(keys, other) for other in ahead))
+
+    async def acquire(self, keys, priority: bool = False) -> frozenset:
+        keys = frozenset(keys)
+        ahead = [k for k, _, p in self._waiters if p or not priority]
+        if not self._blocked(keys, ahead):
+            self._held.append(keys)
+            return keys
+        future = asyncio.get_running_loop().create_future()
+        waiter = (keys, future, priority)
+        if priority:
+            # Behind earlier priority claims, ahead of everything else.
+            self._waiters.insert(sum(1 for _, _, p in self._waiters if p), waiter)
+        else:
+            self._waiters.append(waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self._wake()
+            elif future.done() and not future.cancelled():
+                # Granted right before we were cancelled.
+                self.release(keys)
+            raise
+        return keys
+
+    def release(self, keys: frozenset):
+        self._held.remove(keys)
+        self._wake()
+
+    def _wake(self):
+        # Grant waiters in order; a later waiter may only go ahead of an
+        # earlier blocked one if it does not conflict with it.
+        blocked = []
+        for waiter in list(self._waiters):
+            keys, future, _ = waiter
+            if future.done():
+                self._waiters.remove(waiter)
+                continue
+            if self._blocked(keys, blocked):
+                blocked.append(keys)
+                continue
+            self._waiters.remove(waiter)
+            self._held.append(keys)
+            future.set_result(True)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, keys, priority: bool = False):
+        keys = await self.acquire(keys, priority=priority)
+        try:
+            yield keys
+        finally:
+            self.release(keys)
+
+    def held(self) -> list:
+        return list(self._held)
+
+
+class PrioritySemaphore:
+    """
+    Semaphore granting its slots in arrival order, except that priority
+    acquires are queued ahead of all non-priority ones.
+    """
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters = deque()
+
+    async def acquire(self, priority: bool = False):
+        # Free slots are only left while nobody is waiting, see release.
+        if self._value > 0:
+            self._value -= 1
+            return True
+        future = asyncio.get_running_loop().create_future()
+        waiter = (future, priority)
+        if priority:
+            # Behind earlier priority acquires, ahead of everything else.
+            self._waiters.insert(sum(1 for _, p in self._waiters if p), waiter)
+        else:
+            self._waiters.append(waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif future.done() and not future.cancelled():
+                # Granted right before we were cancelled.
+                self.release()
+            raise
+        return True
+
+    def release(self):
+        self._value += 1
+        while self._value > 0 and self._waiters:
+            future, _ = self._waiters.popleft()
+            if future.done():
+                continue
+            self._value -= 1
+            future.set_result(True)
+
+
+class SingleFlight:
+    """
+    Deduplication of identical calls: the first call with a key runs, calls with the
+    same key made while it runs wait for it and get the same result (or exception).
+    A result can also be kept for `ttl` seconds after the call completed and returned
+    to the calls made meanwhile without running again. Exceptions are not kept.
+    The call runs in its own task, with the context of the first caller (eg. its
+    deadline), so a caller that goes away does not cancel it for the others.
+    """
+
+    def __init__(self):
+        # key -> (task, deadline loop time or None) of the call running
+        self._flights = {}
+        # key -> (loop time the result expires, result)
+        self._results = {}
+        self._counts = {"executed": 0, "joined": 0, "reused": 0}
+
+    async def run(self, key, factory, ttl: float = 0):
+        """
+        Result of `await factory()` for key. A call running under a later deadline than the
+        caller's (see Scheduler.deadline) may not complete in time for it and is not joined.
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self._results = {k: v for k, v in self._results.items() if v[0] > now}
+        if key in self._results:
+            self._counts["reused"] += 1
+            return self._results[key][1]
+        due = Scheduler._deadline.get()
+        flight = self._flights.get(key)
+        if flight is not None and (due is None or (flight[1] is not None and flight[1] <= due)):
+            self._counts["joined"] += 1
+            return await asyncio.shield(flight[0])
+        self._counts["executed"] += 1
+        task = asyncio.create_task(factory(), name=f"single-flight{list(key)}")
+        if flight is None:
+            self._flights[key] = (task, due)
+            task.add_done_callback(functools.partial(self._done, key, ttl))
+        return await asyncio.shield(task)
+
+    def _done(self, key, ttl: float, task: asyncio.Task):
+        if self._flights.get(key, (None,))[0] is task:
+            del self._flights[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        if ttl and ttl > 0:
+            self._results[key] = (asyncio.get_running_loop().time() + ttl, task.result())
+
+    def clear(self):
+        """Forget the kept results, calls running are still joined."""
+        self._results.clear()
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._flights), "cached": len(self._results), **self._counts}
+
+
+class TaskInfo:
+    """
+    Registry entry for a task known to the Scheduler.
+    Periodic tasks also carry their scheduling state from one run to the next.
+    """
+
+    def __init__(self, name: str, kind: str, interval=-1, lane: str = "background"):
+        self.name = name
+        # periodic, on-demand, pool or subprocess
+        self.kind = kind
+        self.interval = interval
+        # periodic tasks in the background lane are deferred while interactive requests run
+        self.lane = lane
+        self.deferred_count = 0
+        # loop time a run was deferred at, while it is waiting
+        self.deferred_since = None
+        self.run_count = 0
+        self.exception_count = 0
+        self.timeout_count = 0
+        self.last_start = None
+        self.last_duration = None
+        self.latency = LatencyStats()
+        # subprocesses only: peak RSS in bytes (sampled) and exit status of the last run
+        self.rss = LatencyStats()
+        self.returncode = None
+        # loop time the next run is due, periodic tasks only
+        self.next_due = None
+        # loop time of the first run
+        self.started = None
+        # first run + phase jitter, deadlines are anchor + tick * interval
+        self.anchor = None
+        self.tick = 0
+        self.missed = 0
+        # What a periodic task runs and the handles of its next and current run,
+        # used to pause, resume, reschedule or cancel it by name.
+        self.function = None
+        self.args = ()
+        self.kwargs = {}
+        self.handle = None
+        self.task = None
+        self.paused = False
+        self.cancelled = False
+        # Bumped every time the schedule is restarted, runs of an older chain
+        # finish but do not reschedule themselves.
+        self.chain = 0
+
+    def start_chain(self, now: float):
+        """Restart the periodic schedule, the task is (re)added with add_task or resumed."""
+        self.cancel_pending()
+        self.chain += 1
+        self.paused = False
+        self.cancelled = False
+        self.started = now
+        self.anchor = None
+        self.tick = 0
+
+    def cancel_pending(self):
+        """Drop the next scheduled run, if any."""
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        self.next_due = None
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    @property
+    def state(self) -> str:
+        if self.cancelled:
+            return "cancelled"
+        if self.paused:
+            return "paused"
+        if self.deferred_since is not None:
+            return "deferred"
+        if self.running:
+            return "running"
+        if self.handle is not None:
+            return "scheduled"
+        return "idle"
+
+    def record(self, duration: float):
+        self.run_count += 1
+        self.last_duration = duration
+        self.latency.record(duration)
+
+    @contextlib.contextmanager
+    def timed(self):
+        """Record a run of this task."""
+        self.last_start = time.time()
+        begin = time.perf_counter()
+        try:
+            yield
+        except TaskTimeout:
+            self.timeout_count += 1
+            raise
+        except Exception:
+            self.exception_count += 1
+            raise
+        finally:
+            self.record(time.perf_counter() - begin)
+
+    def to_dict(self, now: float = None) -> dict:
+        next_due = None
+        if self.next_due is not None and now is not None:
+            next_due = datetime.fromtimestamp(time.time() + self.next_due - now, tz=timezone.utc)
+            next_due = next_due.strftime("%Y-%m-%dT%H:%M:%S %Z")
+        last_start = None
+        if self.last_start is not None:
+            last_start = datetime.fromtimestamp(self.last_start, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S %Z")
+        stats = {
+            "kind": self.kind,
+            "state": self.state,
+            "lane": self.lane,
+            "interval": self.interval,
+            "next_due": next_due,
+            "last_start": last_start,
+            "last_duration": round(self.last_duration, 4) if self.last_duration is not None else None,
+            "run_count": self.run_count,
+            "exception_count": self.exception_count,
+            "timeout_count": self.timeout_count,
+            "missed_ticks": self.missed,
+            "deferred": self.deferred_count,
+            "latency": self.latency.summary(),
+        }
+        if self.kind == "subprocess":
+            stats["peak_rss"] = self.rss.summary(precision=0)
+            stats["last_returncode"] = self.returncode
+        return stats
+
+
 class Scheduler:
 
     """
     run events on the event loop
     """
     stop_event = None
-    _pool = None
-    _pool_lock = None
+    _pool_locks = None
+
+    # Number of worker processes kept for @Scheduler.pool tasks.
+    # Only pool tasks on disjoint resources run concurrently.
+    POOL_MAX_WORKERS = 4
+    # Recycle a worker after it has run this many tasks.
+    POOL_MAX_TASKS_PER_WORKER = 25
+    _pool_workers = set()
+    _pool_idle = []
+    _pool_cond = None
+    _pool_preload = ()
+
+    # Catch-up policies for fixed-rate periodic tasks.
+    SKIP = "skip"
+    COALESCE = "coalesce"
+    _registry = {}
+    # TaskInfo of the task running in the current context, see cancel_task.
+    _current_task = contextvars.ContextVar("healthagent_current_task", default=None)
+
+    # Priority lanes. While an interactive request (prolog/epilog) is in flight,
+    # periodic tasks in the background lane are deferred and run once it finishes.
+    INTERACTIVE = "interactive"
+    BACKGROUND = "background"
+    _lane = contextvars.ContextVar("healthagent_lane", default="background")
+    _interactive_count = 0
+    _deferred = {}
+    _lane_wait = {}
+
+    # Timeouts in seconds by task name, set from the scheduler config and taking
+    # precedence over @Scheduler.timeout. Subprocesses default to SUBPROCESS_TIMEOUT.
+    SUBPROCESS_TIMEOUT = 300
+    _timeouts = {}
+
+    # Subprocesses allowed to run at once, the rest wait for a slot in arrival order,
+    # those started by interactive requests ahead of background ones.
+    SUBPROCESS_MAX_CONCURRENCY = 4
+    # Seconds between peak RSS samples of a running subprocess.
+    SUBPROCESS_SAMPLE_INTERVAL = 0.5
+    _subprocess_slots = None
+    _subprocess_queued = 0
+    _subprocess_running = 0
+    _subprocess_reapers = set()
+
+    # Threads per named pool of @Scheduler.thread tasks, unless set in the scheduler config.
+    THREAD_POOL_MAX_WORKERS = 2
+    DEFAULT_THREAD_POOL = "default"
+    _thread_pool_sizes = {}
+    _thread_pools = {}
+    # Serializes thread tasks of objects that are not thread-safe, see Scheduler.thread.
+    _thread_locks = ResourceLock()
+
+    # Event loop lag monitor, see Scheduler.start_loop_monitor.
+    loop_monitor = None
+    # Loop time by which the current request must complete, see Scheduler.deadline.
+    _deadline = contextvars.ContextVar("healthagent_deadline", default=None)
+
+    @staticmethod
+    def pool(func=None, *, resource: str = None, key: str = None):
+        """
+        Run the function in a worker process.
+        resource/key declare what the task needs exclusive access to:
+        `@Scheduler.pool(resource="gpu", key="gpu_id")` locks each id passed in the
+        gpu_id argument, or every gpu if gpu_id is None. Pool tasks that do not
+        declare a resource are serialized against all other pool tasks.
+        """
+        def decorator(func):
+            func.pool = True
+            func.pool_resource = resource
+            func.pool_resource_key = key
+            return func
+        if func is None:
+            return decorator
+        return decorator(func)
+
+    @staticmethod
+    def thread(func=None, *, pool: str = "default", serialize: bool | str = True):
+        """
+        Run the synchronous function on a thread of the named pool, so blocking
+        calls (DCGM, journal reads, /proc and sysfs scans) keep off the event loop.
+        Run it with `await Scheduler.run_in_thread(function, ...)` or `await Scheduler.add_task(function, ...)`.
+
+        serialize: True runs one call at a time per object the method is bound to
+                   (per module for plain functions), for objects that are not thread-safe.
+                   A string serializes all tasks declaring the same string, False never serializes.
+        """
+        def mark(func):
+            func.thread = True
+            func.thread_pool = pool
+            func.thread_serialize = serialize
+            return func
+
+        def decorator(func):
+            if isinstance(func, (classmethod, staticmethod)):
+                mark(func.__func__)
+                return func
+            return mark(func)
+        if func is None:
+            return decorator
+        return decorator(func)
+
+    @staticmethod
+    def timeout(seconds: float):
+        """
+        Cancel a run of the decorated task that takes longer than `seconds`.
+        Pool tasks have their worker process killed. A timeout in the scheduler
+        config for the same task name takes precedence.
+        """
+        def decorator(func):
+            if isinstance(func, (classmethod, staticmethod)):
+                func.__func__.timeout = seconds
+            else:
+                func.timeout = seconds
+            return func
+        return decorator
+
+    @classmethod
+    def configure(self, config: SchedulerConfig):
+        """Apply the scheduler section of the healthagent config."""
+        self.SUBPROCESS_TIMEOUT = config.subprocess_timeout
+        self._timeouts = dict(config.timeouts)
+        # Pools already started keep their size.
+        self._thread_pool_sizes = dict(config.thread_pools)
+        if config.subprocess_concurrency != self.SUBPROCESS_MAX_CONCURRENCY:
+            self.SUBPROCESS_MAX_CONCURRENCY = config.subprocess_concurrency
+            if self._subprocess_slots is not None:
+                # Running subprocesses release the slots they took from the old semaphore.
+                self._subprocess_slots = PrioritySemaphore(self.SUBPROCESS_MAX_CONCURRENCY)
+
+    @classmethod
+    @contextlib.contextmanager
+    def deadline(self, seconds: float = None):
+        """
+        Publish a deadline `seconds` from now to the enclosed request.
+        Tasks it starts run with at most the time remaining, see Scheduler.time_remaining.
+        A nested deadline can only shorten the outer one.
+        """
+        if seconds is None:
+            yield
+            return
+        due = asyncio.get_running_loop().time() + seconds
+        outer = self._deadline.get()
+        token = self._deadline.set(due if outer is None else min(due, outer))
+        try:
+            yield
+        finally:
+            self._deadline.reset(token)
+
+    @classmethod
+    def time_remaining(self) -> float:
+        """Seconds left until the current deadline, or None if there is none."""
+        due = self._deadline.get()
+        if due is None:
+            return None
+        return max(due - asyncio.get_running_loop().time(), 0)
+
+    @classmethod
+    def _time_limit(self, info: TaskInfo, function) -> float:
+        """How long a run of the task may take: its timeout, capped by the current deadline."""
+        timeout = self._timeouts.get(info.name, getattr(function, "timeout", None))
+        if timeout is None and info.kind == "subprocess":
+            timeout = self.SUBPROCESS_TIMEOUT
+        remaining = self.time_remaining()
+        if remaining is not None and (not timeout or remaining < timeout):
+            return remaining
+        return timeout or None
+
+    @classmethod
+    @contextlib.asynccontextmanager
+    async def _enforce(self, info: TaskInfo, limit: float):
+        """Cancel the enclosed run after `limit` seconds, raising TaskTimeout."""
+        if limit is None:
+            yield
+            return
+        token = self._deadline.set(asyncio.get_running_loop().time() + limit)
+        try:
+            async with asyncio.timeout(limit) as scope:
+                yield
+        except TimeoutError:
+            if not scope.expired():
+                raise
+            raise TaskTimeout(info.name, limit) from None
+        finally:
+            self._deadline.reset(token)
 
     @staticmethod
-    def pool(func):
-        func.pool = True
-        return func
+    def _pool_resources(function, args, kwargs) -> frozenset:
+        """Resource keys a pool task call claims, see Scheduler.pool."""
+        resource = getattr(function, "pool_resource", None)
+        if resource is None:
+            return frozenset([ResourceLock.EVERYTHING])
+        ids = None
+        key = getattr(function, "pool_resource_key", None)
+        if key:
+            try:
+                bound = inspect.signature(function).bind_partial(*args, **kwargs)
+                ids = bound.arguments.get(key)
+            except TypeError:
+                ids = None
+        return ResourceLock.keys(resource, ids)
 
     @staticmethod
     def _get_function_name(func):
@@ -37,71 +729,484 @@ class Scheduler:
             return str(func)
 
     @staticmethod
-    def periodic(interval):
+    def periodic(interval, fixed_rate: bool = False, jitter: float = 0, catchup: str = "skip", lane: str = "background"):
+        """
+        Re-run the decorated task every `interval` seconds once it is added with add_task.
+
+        fixed_rate: schedule runs on absolute deadlines (first run + k * interval)
+                    instead of `interval` seconds after the previous run finished,
+                    so the task does not drift by its own runtime.
+        jitter: upper bound in seconds of a random phase offset applied from the
+                second run on, so tasks sharing an interval don't all wake together.
+        catchup: fixed_rate only, what to do when a run overruns one or more deadlines.
+                 "skip" waits for the next deadline, "coalesce" runs once right away.
+                 Either way the missed ticks are counted, see Scheduler.missed_ticks.
+        lane: "background" runs are deferred while an interactive request is in flight,
+              "interactive" runs never are (eg. the systemd watchdog).
+        """
+        if catchup not in (Scheduler.SKIP, Scheduler.COALESCE):
+            raise ValueError(f"Invalid catchup policy: {catchup}")
+        if lane not in (Scheduler.INTERACTIVE, Scheduler.BACKGROUND):
+            raise ValueError(f"Invalid lane: {lane}")
+
+        def mark(func):
+            func.interval = interval
+            func.fixed_rate = fixed_rate
+            func.jitter = jitter
+            func.catchup = catchup
+            func.lane = lane
+            return func
+
         def decorator(func):
             # Handle classmethod
             if isinstance(func, classmethod):
                 original_func = func.__func__  # Extract the original function
+                @functools.wraps(original_func)
                 def wrapper(cls, *args, **kwargs):
                     return original_func(cls, *args, **kwargs)
-                wrapper.interval = interval
-                return classmethod(wrapper)
+                return classmethod(mark(wrapper))
 
             # Handle staticmethod
             elif isinstance(func, staticmethod):
                 original_func = func.__func__  # Extract the original function
+                @functools.wraps(original_func)
                 def wrapper(*args, **kwargs):
                     return original_func(*args, **kwargs)
-                wrapper.interval = interval
-                return staticmethod(wrapper)
+                return staticmethod(mark(wrapper))
             else:
-                func.interval = interval
-                return func
+                return mark(func)
         return decorator
 
     @classmethod
-    async def __task_wrapper(self, interval, function, *args, **kwargs):
+    async def __task_wrapper(self, function, args, kwargs, info: TaskInfo, chain: int = None):
         """
-        Runs a task, logs exceptions and re-adds it after it completes if interval is a positive integer.
+        Runs a task, logs exceptions and, for a periodic task (chain is set),
+        schedules its next run after it completes unless it was paused or cancelled meanwhile.
 
         """
         out = None
+        self._current_task.set(info)
+        if chain is not None:
+            self._lane.set(info.lane)
+            self._deadline.set(None)
         try:
-            func_name = self._get_function_name(func=function)
-            log.debug(f"interval: {interval}, function: {func_name}, {args}, {kwargs}")
+            log.debug(f"interval: {info.interval}, function: {info.name}, {args}, {kwargs}")
             if function and callable(function):
-                out = await function(*args, **kwargs)
+                with info.timed():
+                    async with self._enforce(info, self._time_limit(info, function)):
+                        out = await function(*args, **kwargs)
+        except TaskTimeout as e:
+            log.warning(e)
+            await self._report_timeout(function, e)
         except Exception as e:
             log.exception(e)
 
-        if self.cancel_event.is_set():
-            self.cancel_event.clear()
-        # Don't re-schedule periodic task if cancellation event is set
-        elif interval > 0:
-            loop = asyncio.get_running_loop()
-            loop.call_later(interval, functools.partial(self.add_task, function, *args, **kwargs))
+        # Don't re-schedule periodic task if it was paused, cancelled or re-added
+        if chain is not None and chain == info.chain and not (info.paused or info.cancelled):
+            self._reschedule(info)
 
         return out
 
     @classmethod
-    def cancel_task(self):
-        self.cancel_event.set()
+    async def _report_timeout(self, function, error: TaskTimeout):
+        """Let the health module owning a timed out check record it in the check's report."""
+        report_name = getattr(function, "report_name", None)
+        report_timeout = getattr(getattr(function, "__self__", None), "report_timeout", None)
+        if report_name is None or report_timeout is None:
+            return
+        try:
+            await report_timeout(report_name, error.timeout)
+        except Exception as e:
+            log.exception(e)
 
     @classmethod
-    async def _run_pool_task(self, function, *args, **kwargs):
-        """Run a pool task under _pool_lock to serialize DCGM diagnostics."""
-        async with self._pool_lock:
+    def _reschedule(self, info: TaskInfo):
+        """Work out when a periodic task is due next and schedule it."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        function = info.function
+        interval = info.interval
+        if info.anchor is None:
+            info.anchor = info.started + random.uniform(0, getattr(function, "jitter", 0) or 0)
+        if not getattr(function, "fixed_rate", False):
+            phase = info.anchor - info.started if info.tick == 0 else 0
+            info.tick += 1
+            due = now + interval + phase
+        else:
+            info.tick += 1
+            due = info.anchor + info.tick * interval
+            if due <= now:
+                passed = int((now - due) // interval) + 1
+                if getattr(function, "catchup", self.SKIP) == self.COALESCE:
+                    # Run the latest missed tick now, drop the ones before it.
+                    info.tick += passed - 1
+                    info.missed += passed - 1
+                    due = now
+                else:
+                    info.tick += passed
+                    info.missed += passed
+                    due = info.anchor + info.tick * interval
+                log.warning(f"{info.name} overran its {interval}s interval, "
+                            f"missed ticks: {info.missed}")
+        self._schedule(info, due)
+
+    @classmethod
+    def _schedule(self, info: TaskInfo, due: float):
+        info.cancel_pending()
+        info.next_due = due
+        info.handle = asyncio.get_running_loop().call_at(due, self._start_periodic, info, info.chain)
+
+    @classmethod
+    def _start_periodic(self, info: TaskInfo, chain: int):
+        info.handle = None
+        info.next_due = None
+        if not self.stop_event or self.stop_event.is_set():
+            return None
+        if chain != info.chain or info.paused or info.cancelled:
+            return None
+        if self._interactive_count and info.lane == self.BACKGROUND:
+            # Coalesced: a deferred task is not rescheduled until it has run, so it
+            # runs once when the interactive requests finish however long they take.
+            log.debug(f"Deferring {info.name}, interactive request in flight")
+            info.deferred_count += 1
+            info.deferred_since = asyncio.get_running_loop().time()
+            self._deferred[info.name] = (info, chain)
+            return None
+        info.task = asyncio.create_task(self.__task_wrapper(info.function, info.args, info.kwargs, info, chain), name=info.name)
+        return info.task
+
+    @classmethod
+    @contextlib.contextmanager
+    def interactive(self):
+        """
+        Run the enclosed request in the interactive lane.
+        Background periodic runs that fall due meanwhile are deferred until the last
+        interactive request finishes, and pool tasks it starts queue ahead of background ones.
+        """
+        self._interactive_count += 1
+        token = self._lane.set(self.INTERACTIVE)
+        try:
+            yield
+        finally:
+            self._lane.reset(token)
+            self._interactive_count -= 1
+            if not self._interactive_count:
+                self._run_deferred()
+
+    @classmethod
+    def _run_deferred(self):
+        if not self._deferred:
+            return
+        now = asyncio.get_running_loop().time()
+        deferred, self._deferred = self._deferred, {}
+        for info, chain in deferred.values():
+            self._record_wait(self.BACKGROUND, now - info.deferred_since)
+            info.deferred_since = None
+            self._start_periodic(info, chain)
+
+    @classmethod
+    def _record_wait(self, lane: str, wait: float):
+        self._lane_wait.setdefault(lane, LatencyStats()).record(wait)
+
+    @classmethod
+    def start_loop_monitor(self, stall_threshold: float = 1.0) -> LoopMonitor:
+        """Start measuring event loop lag, stalls longer than stall_threshold seconds are attributed to a task."""
+        if self.loop_monitor is not None:
+            self.loop_monitor.stop()
+        self.loop_monitor = LoopMonitor(stall_threshold=stall_threshold)
+        self.loop_monitor.start()
+        return self.loop_monitor
+
+    @classmethod
+    def missed_ticks(self) -> dict:
+        """Number of deadlines each fixed-rate periodic task missed by overrunning."""
+        return {name: info.missed for name, info in self._registry.items() if info.kind == "periodic"}
+
+    @classmethod
+    def _register(self, function, kind: str) -> TaskInfo:
+        name = self._get_function_name(func=function)
+        info = self._registry.get(name)
+        if info is None:
+            info = TaskInfo(name=name, kind=kind, interval=getattr(function, "interval", -1),
+                            lane=getattr(function, "lane", self.BACKGROUND))
+            self._registry[name] = info
+        return info
+
+    @classmethod
+    def stats(self) -> dict:
+        """Snapshot of the task registry, served by the scheduler_stats command."""
+        now = asyncio.get_running_loop().time()
+        lanes = {}
+        for lane in (self.INTERACTIVE, self.BACKGROUND):
+            lanes[lane] = {"wait": self._lane_wait.get(lane, LatencyStats()).summary()}
+        lanes[self.INTERACTIVE]["in_flight"] = self._interactive_count
+        lanes[self.BACKGROUND]["deferred"] = sorted(self._deferred)
+        return {
+            "tasks": {name: info.to_dict(now) for name, info in sorted(self._registry.items())},
+            "lanes": lanes,
+            "subprocesses": {
+                "running": self._subprocess_running,
+                "queued": self._subprocess_queued,
+                "limit": self.SUBPROCESS_MAX_CONCURRENCY,
+            },
+            "threads": {name: pool.stats() for name, pool in sorted(self._thread_pools.items())},
+            "loop": self.loop_monitor.stats() if self.loop_monitor is not None else None,
+        }
+
+    @classmethod
+    def _periodic_info(self, name: str) -> TaskInfo:
+        info = self._registry.get(name)
+        if info is None or info.kind != "periodic":
+            raise KeyError(f"No periodic task named {name}")
+        return info
+
+    @classmethod
+    def cancel_task(self, name: str = None):
+        """
+        Stop a periodic task from running again.
+        Without a name, cancels the task calling it (a periodic task cancelling itself),
+        otherwise the periodic task registered under that name, see Scheduler.stats.
+        A run of a task cancelled by name that is in progress is cancelled as well.
+        """
+        if name is None:
+            info = self._current_task.get()
+            if info is None:
+                raise RuntimeError("cancel_task() without a name must be called from a scheduler task")
+            if info.kind != "periodic":
+                return
+        else:
+            info = self._periodic_info(name)
+        info.cancelled = True
+        info.paused = False
+        info.cancel_pending()
+        self._undefer(info)
+        if info.running and info.task is not asyncio.current_task():
+            info.task.cancel()
+        log.info(f"Cancelled task {info.name}")
+
+    @classmethod
+    def _undefer(self, info: TaskInfo):
+        if self._deferred.pop(info.name, None) is not None:
+            info.deferred_since = None
+
+    @classmethod
+    def pause_task(self, name: str):
+        """Stop scheduling a periodic task until it is resumed, a run in progress completes."""
+        info = self._periodic_info(name)
+        if info.cancelled or info.paused:
+            return
+        info.paused = True
+        info.cancel_pending()
+        self._undefer(info)
+        log.info(f"Paused task {info.name}")
+
+    @classmethod
+    def resume_task(self, name: str):
+        """Resume a paused or cancelled periodic task, it runs right away unless a run is still in progress."""
+        info = self._periodic_info(name)
+        if not (info.paused or info.cancelled):
+            return
+        if info.running and not info.cancelled:
+            # Paused mid-run, the run reschedules itself when it finishes.
+            info.paused = False
+        else:
             loop = asyncio.get_running_loop()
-            pool = ProcessPoolExecutor(
-                max_workers=1,
-                mp_context=multiprocessing.get_context("spawn")
-            )
+            info.start_chain(loop.time())
+            self._schedule(info, loop.time())
+        log.info(f"Resumed task {info.name}")
+
+    @classmethod
+    def reschedule_task(self, name: str, interval: float):
+        """
+        Change the interval of a periodic task.
+        The schedule is restarted from now, so the next run is due `interval` seconds from now
+        (or after the run in progress completes, for a fixed-delay task).
+        """
+        if not interval or interval <= 0:
+            raise ValueError(f"Invalid interval: {interval}")
+        info = self._periodic_info(name)
+        info.interval = interval
+        log.info(f"Rescheduled task {info.name} to run every {interval}s")
+        if info.paused or info.cancelled:
+            return
+        info.cancel_pending()
+        info.started = asyncio.get_running_loop().time()
+        info.anchor = None
+        info.tick = 0
+        # A run in progress reschedules itself on the new interval when it finishes.
+        if not info.running:
+            self._reschedule(info)
+
+    @classmethod
+    def control_task(self, name: str, action: str, interval: float = None) -> dict:
+        """Entry point of the task_control command, returns the task's stats."""
+        if action == "pause":
+            self.pause_task(name)
+        elif action == "resume":
+            self.resume_task(name)
+        elif action == "cancel":
+            self.cancel_task(name)
+        elif action == "reschedule":
+            self.reschedule_task(name, float(interval) if interval is not None else None)
+        else:
+            raise ValueError(f"Invalid task action: {action}")
+        now = asyncio.get_running_loop().time()
+        return {"tasks": {name: self._registry[name].to_dict(now)}}
+
+    @classmethod
+    def warm_pool(self, *preload):
+        """
+        Start a pool worker ahead of the first pool task.
+        preload: module names imported by every worker when it starts
+        (eg. the module defining the pool tasks, which pulls in the DCGM bindings).
+        """
+        if not self.stop_event or self.stop_event.is_set():
+            return
+        self._pool_preload = tuple(dict.fromkeys(self._pool_preload + preload))
+        if not self._pool_workers:
+            self._pool_idle.append(self._new_pool_worker())
+
+    @classmethod
+    def _new_pool_worker(self) -> PoolWorker:
+        worker = PoolWorker(preload=self._pool_preload)
+        worker.warm()
+        self._pool_workers.add(worker)
+        return worker
+
+    @classmethod
+    def _retire_pool_worker(self, worker: PoolWorker):
+        self._pool_workers.discard(worker)
+        worker.kill()
+
+    @classmethod
+    async def _acquire_pool_worker(self) -> PoolWorker:
+        async with self._pool_cond:
+            while True:
+                while self._pool_idle:
+                    worker = self._pool_idle.pop()
+                    if not worker.broken:
+                        return worker
+                    self._retire_pool_worker(worker)
+                if len(self._pool_workers) < self.POOL_MAX_WORKERS:
+                    return self._new_pool_worker()
+                await self._pool_cond.wait()
+
+    @classmethod
+    async def _release_pool_worker(self, worker: PoolWorker):
+        if worker not in self._pool_workers:
+            # Pool was shut down while the task was running.
+            return
+        if worker.broken or worker.tasks_run >= self.POOL_MAX_TASKS_PER_WORKER:
+            reason = "crashed" if worker.broken else f"ran {worker.tasks_run} tasks"
+            log.debug(f"Recycling pool worker, {reason}")
+            self._retire_pool_worker(worker)
+            if not self.stop_event.is_set():
+                # Replace it right away so the next task finds a warm worker.
+                worker = self._new_pool_worker()
+            else:
+                worker = None
+        async with self._pool_cond:
+            if worker is not None:
+                self._pool_idle.append(worker)
+            self._pool_cond.notify()
+
+    @classmethod
+    async def _run_pool_task(self, function, *args, **kwargs):
+        """
+        Run a pool task on a pre-warmed worker.
+        Tasks hold the resources they declared for their whole run, so DCGM
+        diagnostics on overlapping GPU sets are serialized while disjoint ones overlap.
+        Raises TaskTimeout if the task times out, after killing its worker. The worker is
+        also killed when the run is cancelled from outside (eg. a module timeout), before the
+        resources are released, so the next task on them never runs alongside it.
+        """
+        info = self._register(function, kind="pool")
+        lane = self._lane.get()
+        queued = time.perf_counter()
+        async with self._pool_locks.hold(self._pool_resources(function, args, kwargs),
+                                         priority=lane == self.INTERACTIVE):
+            worker = await self._acquire_pool_worker()
+            self._record_wait(lane, time.perf_counter() - queued)
             try:
-                return await loop.run_in_executor(pool, functools.partial(function, *args, **kwargs))
+                with info.timed():
+                    async with self._enforce(info, self._time_limit(info, function)):
+                        return await worker.run(function, *args, **kwargs)
+            except TaskTimeout as e:
+                # The worker is still running the task, it is killed when released.
+                log.warning(e)
+                worker.broken = True
+                raise
+            except asyncio.CancelledError:
+                log.warning(f"{info.name} cancelled, killing its pool worker")
+                worker.broken = True
+                raise
             finally:
-                # Offload the (potentially blocking) shutdown to a thread and shield
-                # it from cancellation so the pool is always cleaned up.
-                await asyncio.shield(loop.run_in_executor(None, pool.shutdown, True))
+                # Shield so the worker is always returned (or recycled) even if we are cancelled.
+                await asyncio.shield(self._release_pool_worker(worker))
+
+    @classmethod
+    def _thread_pool(self, name: str) -> ThreadPool:
+        pool = self._thread_pools.get(name)
+        if pool is None:
+            pool = ThreadPool(name, self._thread_pool_sizes.get(name, self.THREAD_POOL_MAX_WORKERS))
+            self._thread_pools[name] = pool
+        return pool
+
+    @staticmethod
+    def _thread_keys(function) -> frozenset:
+        """Serialization keys a thread task call claims, see Scheduler.thread."""
+        serialize = getattr(function, "thread_serialize", True)
+        if serialize is False:
+            return frozenset()
+        if isinstance(serialize, str):
+            return frozenset([("thread", serialize)])
+        owner = getattr(function, "__self__", None)
+        if owner is None:
+            owner = getattr(function, "__module__", None)
+        return frozenset([("thread", owner)])
+
+    @classmethod
+    async def run_in_thread(self, function, *args, **kwargs):
+        """
+        Run a blocking function on its thread pool (the default pool if it is not
+        decorated with @Scheduler.thread) and return its result.
+        Raises TaskTimeout if the task times out, waiting for its serialization lock
+        counts towards the timeout. The thread itself cannot be interrupted, it runs
+        to completion and holds its serialization lock until then.
+        """
+        info = self._register(function, kind="thread")
+        pool = self._thread_pool(getattr(function, "thread_pool", self.DEFAULT_THREAD_POOL))
+        loop = asyncio.get_running_loop()
+        lane = self._lane.get()
+        keys = self._thread_keys(function)
+        locks = self._thread_locks
+        queued = time.perf_counter()
+        with info.timed():
+            async with self._enforce(info, self._time_limit(info, function)):
+                if keys:
+                    await locks.acquire(keys, priority=lane == self.INTERACTIVE)
+                self._record_wait(lane, time.perf_counter() - queued)
+                try:
+                    future = pool.submit(loop, function, *args, **kwargs)
+                except BaseException:
+                    if keys:
+                        locks.release(keys)
+                    raise
+                if keys:
+                    future.add_done_callback(lambda _: _call_soon_threadsafe(loop, locks.release, keys))
+                return await asyncio.wrap_future(future)
+
+    @classmethod
+    def _shutdown_threads(self):
+        for pool in self._thread_pools.values():
+            pool.shutdown()
+        self._thread_pools = {}
+
+    @classmethod
+    def _shutdown_pool(self):
+        for worker in list(self._pool_workers):
+            self._retire_pool_worker(worker)
+        self._pool_idle.clear()
 
     @classmethod
     def add_task(self, function, *args, **kwargs):
@@ -109,17 +1214,45 @@ class Scheduler:
         Add an on-demand task to be run at the time defined by when,
         that need not repeat and only runs once.
         Usually run with a higher priority (lower priority number means high priority).
+        Tasks are named after their registry entry, see Scheduler.stats.
         """
         if not self.stop_event or self.stop_event.is_set():
             return None
         interval = getattr(function, "interval", -1)
         pool = getattr(function, "pool", False)
+        if getattr(function, "kind", None) == "subprocess":
+            return asyncio.create_task(self._run_subprocess(function), name=function.__name__)
+        if getattr(function, "thread", False):
+            return asyncio.create_task(self.run_in_thread(function, *args, **kwargs),
+                                       name=self._get_function_name(func=function))
         if not pool:
-            return asyncio.create_task(self.__task_wrapper(interval, function, *args, **kwargs))
+            if interval > 0:
+                # Re-adding a periodic task replaces its previous schedule.
+                info = self._register(function, kind="periodic")
+                self._undefer(info)
+                info.function, info.args, info.kwargs = function, args, kwargs
+                info.interval = interval
+                info.start_chain(asyncio.get_running_loop().time())
+                info.task = asyncio.create_task(self.__task_wrapper(function, args, kwargs, info, info.chain), name=info.name)
+                return info.task
+            info = self._register(function, kind=getattr(function, "kind", "on-demand"))
+            return asyncio.create_task(self.__task_wrapper(function, args, kwargs, info), name=info.name)
         else:
-            return asyncio.create_task(self._run_pool_task(function, *args, **kwargs))
+            return asyncio.create_task(self._run_pool_task(function, *args, **kwargs),
+                                       name=self._get_function_name(func=function))
 
-    def subprocess(*sp_args, **sp_kwargs):
+    def subprocess(*sp_args, timeout: float = None, wait: bool = False, **sp_kwargs):
+        """
+        Wrap a command to be run with add_task.
+        At most SUBPROCESS_MAX_CONCURRENCY commands run at once, add_task waits for a slot
+        (ahead of background tasks when called from an interactive request).
+        By default add_task returns the asyncio Process once it is started, the process is
+        reaped when it exits. With wait=True it returns (returncode, stdout, stderr) once
+        the process exits, or raises TaskTimeout.
+        The process is killed if it is still running after `timeout` seconds
+        (default Scheduler.SUBPROCESS_TIMEOUT, capped by the current deadline),
+        in which case its `timed_out` attribute is set.
+        """
         # Set defaults only if not already specified
         sp_kwargs.setdefault("stdout", asyncio.subprocess.PIPE)
         sp_kwargs.setdefault("stderr", asyncio.subprocess.PIPE)
@@ -129,21 +1262,116 @@ class Scheduler:
                 self.kwargs = kwargs
                 self.interval = -1  # default for on-demand
                 self.pool = False
-
-            def __call__(self, *_, **__):
-                # make it awaitable
-                return asyncio.create_subprocess_exec(*self.args, **self.kwargs)
+                self.kind = "subprocess"
+                self.wait = wait
+                if timeout is not None:
+                    self.timeout = timeout
+                # Registry name, eg. "subprocess[jetpack]"
+                self.__name__ = self.__qualname__ = f"subprocess[{os.path.basename(str(args[0]))}]" if args else "subprocess"
 
         return SubprocessWrapper(sp_args, sp_kwargs)
 
+    @classmethod
+    async def _run_subprocess(self, command):
+        """
+        Start a subprocess once a slot is free and hand it to a reaper task,
+        which holds the slot until the process exits.
+        """
+        info = self._register(command, kind="subprocess")
+        slots = self._subprocess_slots
+        lane = self._lane.get()
+        queued = time.perf_counter()
+        self._subprocess_queued += 1
+        try:
+            await slots.acquire(priority=lane == self.INTERACTIVE)
+        finally:
+            self._subprocess_queued -= 1
+        self._record_wait(lane, time.perf_counter() - queued)
+        # Time spent queued counts against the deadline, not the timeout.
+        limit = self._time_limit(info, command)
+        info.last_start = time.time()
+        started = time.perf_counter()
+        try:
+            proc = await asyncio.create_subprocess_exec(*command.args, **command.kwargs)
+        except BaseException:
+            slots.release()
+            info.exception_count += 1
+            info.record(time.perf_counter() - started)
+            raise
+        self._subprocess_running += 1
+        proc.timed_out = False
+        timer = None
+        if limit is not None:
+            timer = asyncio.get_running_loop().call_later(limit, self._expire_subprocess, proc, info, limit)
+        reaper = asyncio.create_task(self._reap_subprocess(proc, info, slots, started, timer))
+        self._subprocess_reapers.add(reaper)
+        reaper.add_done_callback(self._subprocess_reapers.discard)
+        if not command.wait:
+            return proc
+        stdout, stderr = await proc.communicate()
+        if proc.timed_out:
+            raise TaskTimeout(info.name, proc.timeout)
+        return proc.returncode, stdout, stderr
+
+    @classmethod
+    async def _reap_subprocess(self, proc, info: TaskInfo, slots: PrioritySemaphore, started: float, timer):
+        """Wait for a subprocess to exit, sampling its peak RSS, then release its slot."""
+        peak = None
+        exited = asyncio.create_task(proc.wait())
+        try:
+            while True:
+                peak = read_peak_rss(proc.pid) or peak
+                done, _ = await asyncio.wait([exited], timeout=self.SUBPROCESS_SAMPLE_INTERVAL)
+                if done:
+                    break
+        finally:
+            exited.cancel()
+            if timer is not None:
+                timer.cancel()
+            slots.release()
+            self._subprocess_running -= 1
+            info.record(time.perf_counter() - started)
+            info.returncode = proc.returncode
+            if peak is not None:
+                info.rss.record(peak)
+        if proc.returncode and not proc.timed_out:
+            info.exception_count += 1
+            log.warning(f"{info.name} (pid {proc.pid}) exited with {proc.returncode}")
+
+    @classmethod
+    def _expire_subprocess(self, proc, info: TaskInfo, limit: float):
+        if proc.returncode is not None:
+            return
+        log.warning(f"{info.name} (pid {proc.pid}) timed out after {limit:.3g}s, killing it")
+        proc.timed_out = True
+        proc.timeout = limit
+        info.timeout_count += 1
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+
     @classmethod
     def start(self):
         self.stop_event = asyncio.Event()
-        self.cancel_event = asyncio.Event()
-        self._pool_lock = asyncio.Lock()
+        self._pool_locks = ResourceLock()
+        self._pool_cond = asyncio.Condition()
+        self._registry = {}
+        self._interactive_count = 0
+        self._deferred = {}
+        self._lane_wait = {}
+        self._subprocess_slots = PrioritySemaphore(self.SUBPROCESS_MAX_CONCURRENCY)
+        self._subprocess_queued = 0
+        self._subprocess_running = 0
+        self._thread_locks = ResourceLock()
         self.stop_event.clear()
 
     @classmethod
     def stop(self):
 
         self.stop_event.set()
+        self._shutdown_pool()
+        self._shutdown_threads()
+        if self.loop_monitor is not None:
+            self.loop_monitor.stop()
+            self.loop_monitor = None
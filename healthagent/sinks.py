@@ -0,0 +1,242 @@
+import asyncio
+import json
+from abc import ABC, abstractmethod
+import logging
+import os
+from datetime import datetime, timezone
+from healthagent.scheduler import Scheduler
+
+log = logging.getLogger('healthagent')
+
+
+class Sink:
+    """
+    Destination of report changes, see reporter.Sinks. publish is called with every report that changed
+    (not with reports updated to the same content), remove when a report is dropped.
+    Both run on the event loop in the middle of Reporter.update_report, so they should only
+    queue the change and write it later, from flush.
+    """
+
+    name = None
+
+    async def publish(self, reporter, name: str, report):
+        pass
+
+    def remove(self, module: str, name: str):
+        pass
+
+    def load(self, module: str, reports: dict):
+        """Reports a module starts with (eg. restored after a restart), published or not before."""
+        pass
+
+    async def flush(self):
+        """Write everything queued."""
+        pass
+
+    async def close(self, timeout: float = None):
+        """Write everything queued, eg. on shutdown. Thread pools may be shut down already."""
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {}
+
+
+@Scheduler.thread(pool="sinks")
+def write_atomic(path: str, data: str):
+    """Replace the file at path with data: readers see either the old or the new file, never a partial one."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+@Scheduler.thread(pool="sinks")
+def append_rotating(path: str, data: str, max_bytes: int):
+    """Append data to the file at path, first renaming it to path.1 if it would grow past max_bytes."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    try:
+        if max_bytes and os.path.getsize(path) + len(data) > max_bytes:
+            os.replace(path, f"{path}.1")
+    except FileNotFoundError:
+        pass
+    with open(path, "a") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class FileSink(Sink, ABC):
+    """
+    Sink writing to a file in batches: changes are queued by report and written together,
+    from a thread of the "sinks" pool, at most once every `interval` seconds. Only the latest
+    state of a report changing several times within that window is kept.
+    """
+
+    def __init__(self, path: str, interval: float):
+        self.path = path
+        self.interval = interval
+        # Latest change by (module, report name), None for a removed report.
+        self._pending = {}
+        self._handle = None
+        self._task = None
+        self._counts = {"queued": 0, "written": 0, "batches": 0, "failed": 0}
+
+    async def publish(self, reporter, name: str, report):
+        self._queue((reporter.module, name), report)
+
+    def remove(self, module: str, name: str):
+        self._queue((module, name), None)
+
+    def _queue(self, key: tuple, report):
+        self._pending[key] = report
+        self._counts["queued"] += 1
+        if self._handle is None and self._task is None:
+            self._handle = asyncio.get_running_loop().call_later(self.interval, self._start_flush)
+
+    def _start_flush(self):
+        self._handle = None
+        self._task = asyncio.create_task(self.flush(), name=f"{type(self).__name__}.flush")
+
+    def _take(self) -> str | None:
+        """Data to write for the queued changes, None if there is nothing to write."""
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return None
+        self._counts["written"] += len(batch)
+        self._counts["batches"] += 1
+        return self.render(batch)
+
+    @abstractmethod
+    def render(self, batch: dict) -> str:
+        """Data written for a batch of changes {(module, name): report or None}."""
+
+    @abstractmethod
+    async def write(self, data: str):
+        """Write data from a thread of the "sinks" pool."""
+
+    @abstractmethod
+    def write_now(self, data: str):
+        """write, on the calling thread."""
+
+    async def flush(self):
+        try:
+            while (data := self._take()) is not None:
+                await self.write(data)
+        except Exception as e:
+            self._counts["failed"] += 1
+            log.exception(f"Unable to write {self.path}: {e}")
+        finally:
+            if asyncio.current_task() is self._task:
+                self._task = None
+
+    async def close(self, timeout: float = None):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._task is not None:
+            await asyncio.wait([self._task], timeout=timeout)
+        try:
+            data = self._take()
+            if data is not None:
+                self.write_now(data)
+        except Exception as e:
+            self._counts["failed"] += 1
+            log.exception(f"Unable to write {self.path}: {e}")
+
+    def stats(self) -> dict:
+        return {"path": self.path, "pending": len(self._pending), **self._counts}
+
+
+class PrometheusSink(FileSink):
+    """
+    Status of every report as metrics in a node-exporter textfile (textfile collector).
+    The whole file is written again on each batch, with tmp file + rename, so a scrape
+    never reads a partial file.
+    """
+
+    name = "prometheus"
+
+    def __init__(self, path: str, interval: float):
+        super().__init__(path, interval)
+        # (module, report name) -> (severity, last change timestamp)
+        self._metrics = {}
+
+    def load(self, module: str, reports: dict):
+        for name, report in reports.items():
+            self._queue((module, name), report)
+
+    def render(self, batch: dict) -> str:
+        for key, report in batch.items():
+            if report is None:
+                self._metrics.pop(key, None)
+            else:
+                self._metrics[key] = (report.status.severity, report.last_update.timestamp())
+        status, updated = [], []
+        for (module, name), (severity, timestamp) in sorted(self._metrics.items()):
+            labels = f'module="{_label(module)}",report="{_label(name)}"'
+            status.append(f"healthagent_report_status{{{labels}}} {severity}")
+            updated.append(f"healthagent_report_last_change_timestamp_seconds{{{labels}}} {timestamp:.3f}")
+        lines = [
+            "# HELP healthagent_report_status Status of the health report: 0 NA, 1 OK, 2 Warning, 3 Error.",
+            "# TYPE healthagent_report_status gauge",
+            *status,
+            "# HELP healthagent_report_last_change_timestamp_seconds Time the health report last changed.",
+            "# TYPE healthagent_report_last_change_timestamp_seconds gauge",
+            *updated,
+        ]
+        return "\n".join(lines) + "\n"
+
+    async def write(self, data: str):
+        await Scheduler.run_in_thread(write_atomic, self.path, data)
+
+    def write_now(self, data: str):
+        write_atomic(self.path, data)
+
+
+def _label(value) -> str:
+    """Prometheus label value escaping."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class NdjsonSink(FileSink):
+    """
+    Audit log of report changes, one JSON object per line: the full report (details included)
+    with its module, name and version, or {"removed": true} for a report that was dropped.
+    Batches are appended with a single write and fsync. Once the file would grow past
+    max_bytes it is renamed to <path>.1, replacing the previous one.
+    """
+
+    name = "ndjson"
+
+    def __init__(self, path: str, interval: float, max_bytes: int):
+        super().__init__(path, interval)
+        self.max_bytes = max_bytes
+        # Changes are queued by report, so keep every one of them, in order, with the time
+        # of removals. They are serialized in render, once per batch.
+        self._lines = []
+
+    def _queue(self, key: tuple, report):
+        removed = datetime.now(tz=timezone.utc) if report is None else None
+        self._lines.append((key, report, removed))
+        super()._queue(key, report)
+
+    def render(self, batch: dict) -> str:
+        lines, self._lines = self._lines, []
+        records = []
+        for (module, name), report, removed in lines:
+            if report is None:
+                record = {"time": removed.isoformat(), "module": module, "report": name, "removed": True}
+            else:
+                record = {"time": report.last_update.isoformat(), "module": module, "report": name,
+                          "version": report.version, **report.view(cli_exclude=False)}
+            records.append(json.dumps(record))
+        return "\n".join(records) + "\n"
+
+    async def write(self, data: str):
+        await Scheduler.run_in_thread(append_rotating, self.path, data, self.max_bytes)
+
+    def write_now(self, data: str):
+        append_rotating(self.path, data, self.max_bytes)
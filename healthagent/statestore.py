@@ -0,0 +1,352 @@
+import asyncio
+import importlib
+import json
+import logging
+import os
+from datetime import datetime
+from enum import Enum
+from healthagent.config import StateConfig
+from healthagent.scheduler import Scheduler
+from healthagent.util import FrozenDict, FrozenList, derived
+
+log = logging.getLogger(__name__)
+
+# Version of the records in the journal and the snapshot. Files with another major
+# version are not loaded, new fields within a version are ignored by older daemons.
+SCHEMA_VERSION = 1
+SNAPSHOT_FILE = "snapshot.json"
+JOURNAL_FILE = "journal.ndjson"
+
+
+def encode(obj):
+    """
+    JSON compatible form of obj that decode turns back into obj: besides JSON types this
+    supports sets, tuples, datetimes, healthagent enums and dicts with keys other than strings.
+    Read-only containers (util.freeze) come back as regular ones, their encoded form is
+    computed once and shared by every report holding them: do not modify it.
+    """
+    if isinstance(obj, (FrozenDict, FrozenList)):
+        return derived(obj, "_encoded", _encode)
+    return _encode(obj)
+
+
+def _encode(obj):
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    elif isinstance(obj, Enum):
+        if not type(obj).__module__.startswith("healthagent."):
+            return obj.value
+        return {"__enum__": f"{type(obj).__module__}:{type(obj).__qualname__}", "value": obj.value}
+    elif isinstance(obj, datetime):
+        return {"__datetime__": obj.isoformat()}
+    elif isinstance(obj, (set, frozenset)):
+        return {"__set__": [encode(v) for v in obj]}
+    elif isinstance(obj, tuple):
+        return {"__tuple__": [encode(v) for v in obj]}
+    elif isinstance(obj, list):
+        return [encode(v) for v in obj]
+    elif isinstance(obj, dict):
+        if all(isinstance(k, str) and not k.startswith("__") for k in obj):
+            return {k: encode(v) for k, v in obj.items()}
+        return {"__dict__": [[encode(k), encode(v)] for k, v in obj.items()]}
+    raise TypeError(f"Object of type {type(obj).__name__} cannot be persisted")
+
+
+def decode(obj):
+    """Inverse of encode."""
+    if isinstance(obj, list):
+        return [decode(v) for v in obj]
+    elif not isinstance(obj, dict):
+        return obj
+    elif "__enum__" in obj:
+        module, _, name = obj["__enum__"].partition(":")
+        if not module.startswith("healthagent."):
+            return obj["value"]
+        return getattr(importlib.import_module(module), name)(obj["value"])
+    elif "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    elif "__set__" in obj:
+        return {decode(v) for v in obj["__set__"]}
+    elif "__tuple__" in obj:
+        return tuple(decode(v) for v in obj["__tuple__"])
+    elif "__dict__" in obj:
+        return {decode(k): decode(v) for k, v in obj["__dict__"]}
+    return {k: decode(v) for k, v in obj.items()}
+
+
+class StateStore:
+    """
+    State of the daemon that survives restarts and crashes: the health reports of every
+    module and the state modules choose to persist (HealthModule.save_state).
+
+    Changes are appended to a journal of JSON records, written from a thread in batches
+    (one fsync per flush_interval), so a crash loses at most the last batch. Once the
+    journal holds compact_after records it is compacted: the whole state is written to
+    a snapshot (tmp file + rename) and the journal starts over. At startup the snapshot
+    and the journal are read once, the first time a module asks for its state.
+
+    Records carry the schema version and a sequence number. A snapshot records the
+    sequence number it includes, so journal records already in it are skipped if the
+    daemon died between writing the snapshot and truncating the journal.
+    """
+
+    FLUSH_INTERVAL = 1.0
+    COMPACT_AFTER = 1000
+    # A failed write is retried after FLUSH_INTERVAL seconds, doubling up to FLUSH_RETRY_MAX.
+    FLUSH_RETRY_MAX = 60
+    directory = None
+    # {"reports": {module: {name: encoded report}}, "modules": {module: encoded state}}, None until loaded.
+    _state = None
+    _seq = 0
+    # Journal records not written yet, and records in the journal file.
+    _pending = []
+    _journal_records = 0
+    _load_task = None
+    _flush_handle = None
+    _flush_task = None
+    _flush_failures = 0
+
+    @classmethod
+    def configure(cls, config: StateConfig, directory: str):
+        cls.FLUSH_INTERVAL = config.flush_interval
+        cls.COMPACT_AFTER = config.compact_after
+        cls.directory = directory
+        cls._state = None
+        cls._seq = 0
+        cls._pending = []
+        cls._journal_records = 0
+        cls._load_task = None
+        if cls._flush_handle is not None:
+            cls._flush_handle.cancel()
+        cls._flush_handle = None
+        cls._flush_task = None
+        cls._flush_failures = 0
+
+    @classmethod
+    def load(cls) -> asyncio.Task:
+        """Read the persisted state, once. Await the returned task for it."""
+        if cls._load_task is None:
+            cls._load_task = asyncio.create_task(cls._load(), name="StateStore.load")
+        return cls._load_task
+
+    @classmethod
+    async def _load(cls) -> dict:
+        try:
+            state, seq, records = await Scheduler.run_in_thread(cls.read, cls.directory)
+        except Exception as e:
+            log.exception(f"Unable to load the state from {cls.directory}: {e}")
+            state, seq, records = cls._empty(), 0, 0
+        cls._loaded(state, seq, records)
+        if cls._pending and cls._flush_handle is None and cls._flush_task is None:
+            cls._start_flush()
+        return state
+
+    @classmethod
+    def _loaded(cls, state: dict, seq: int, records: int):
+        # Changes recorded while loading go on top of the persisted state, with later sequence numbers.
+        pending, cls._pending = cls._pending, []
+        cls._seq = max(cls._seq, seq)
+        cls._state = state
+        cls._journal_records = records
+        for record in pending:
+            record = dict(record)
+            record.pop("v"), record.pop("seq")
+            cls._append(record)
+
+    @staticmethod
+    def _empty() -> dict:
+        return {"reports": {}, "modules": {}}
+
+    @staticmethod
+    def _apply(state: dict, record: dict):
+        kind, module = record.get("type"), record.get("module")
+        if kind == "report":
+            state["reports"].setdefault(module, {})[record["name"]] = record["report"]
+        elif kind == "remove":
+            state["reports"].get(module, {}).pop(record["name"], None)
+        elif kind == "module":
+            state["modules"][module] = record["state"]
+
+    @classmethod
+    def read(cls, directory: str) -> tuple[dict, int, int]:
+        """Read the snapshot and journal of directory. Returns (state, last sequence number, journal records)."""
+        state, seq = cls._empty(), 0
+        try:
+            with open(os.path.join(directory, SNAPSHOT_FILE)) as f:
+                snapshot = json.load(f)
+            if snapshot.get("v") != SCHEMA_VERSION:
+                log.warning(f"Ignoring state snapshot of schema version {snapshot.get('v')}")
+            else:
+                state = {"reports": snapshot.get("reports", {}), "modules": snapshot.get("modules", {})}
+                seq = snapshot.get("seq", 0)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            log.error(f"Ignoring unreadable state snapshot: {e}")
+        records = 0
+        try:
+            with open(os.path.join(directory, JOURNAL_FILE)) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn write of the last batch before a crash.
+                        log.warning("Ignoring a truncated state journal record")
+                        continue
+                    records += 1
+                    if record.get("v") != SCHEMA_VERSION or record.get("seq", 0) <= seq:
+                        continue
+                    cls._apply(state, record)
+                    seq = record["seq"]
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.error(f"Unable to read the state journal: {e}")
+        return state, seq, records
+
+    @classmethod
+    async def reports(cls, module: str) -> dict | None:
+        """Encoded reports persisted for module by name, None if the module has no persisted reports."""
+        state = await cls.load()
+        return state["reports"].get(module)
+
+    @classmethod
+    async def module_state(cls, module: str):
+        """State persisted by module (see HealthModule.save_state), None if there is none."""
+        state = await cls.load()
+        encoded = state["modules"].get(module)
+        return decode(encoded) if encoded is not None else None
+
+    @classmethod
+    def record_report(cls, module: str, name: str, report: dict):
+        """Journal the encoded report name of module (see HealthReport.to_state)."""
+        cls._append({"type": "report", "module": module, "name": name, "report": report})
+
+    @classmethod
+    def record_removal(cls, module: str, name: str):
+        cls._append({"type": "remove", "module": module, "name": name})
+
+    @classmethod
+    def record_module_state(cls, module: str, state):
+        """Journal the state of module, if it changed."""
+        encoded = encode(state)
+        if cls._state is not None and cls._state["modules"].get(module) == encoded:
+            return
+        cls._append({"type": "module", "module": module, "state": encoded})
+
+    @classmethod
+    def recording(cls, module: str) -> bool:
+        """Whether changes of module are journaled, callers can skip encoding them otherwise."""
+        # Not configured (eg. tests), or a reporter not owned by a module.
+        return cls.directory is not None and module is not None
+
+    @classmethod
+    def _append(cls, record: dict):
+        if not cls.recording(record.get("module")):
+            return
+        cls._seq += 1
+        record = {"v": SCHEMA_VERSION, "seq": cls._seq, **record}
+        if cls._state is not None:
+            cls._apply(cls._state, record)
+        # Serialized by write, off the event loop.
+        cls._pending.append(record)
+        cls._schedule_flush(cls.FLUSH_INTERVAL)
+
+    @classmethod
+    def _schedule_flush(cls, delay: float):
+        """Flush in delay seconds, unless a flush is already due or running."""
+        if cls._flush_handle is None and cls._flush_task is None:
+            cls._flush_handle = asyncio.get_running_loop().call_later(delay, cls._start_flush)
+
+    @classmethod
+    def _start_flush(cls):
+        cls._flush_handle = None
+        cls._flush_task = asyncio.create_task(cls.flush(), name="StateStore.flush")
+
+    @classmethod
+    async def flush(cls):
+        """
+        Write the pending records, compacting the journal if it grew past COMPACT_AFTER.
+        Records that could not be written are kept, ahead of newer ones, and written again
+        with exponential backoff.
+        """
+        retry = None
+        try:
+            while cls._pending and cls._state is not None:
+                records, cls._pending = cls._pending, []
+                snapshot = None
+                if cls._journal_records + len(records) >= cls.COMPACT_AFTER:
+                    snapshot = cls._snapshot()
+                try:
+                    await Scheduler.run_in_thread(cls.write, cls.directory, records, snapshot)
+                except Exception as e:
+                    cls._pending = records + cls._pending
+                    cls._flush_failures += 1
+                    retry = min(cls.FLUSH_INTERVAL * 2 ** cls._flush_failures, cls.FLUSH_RETRY_MAX)
+                    log.exception(f"Unable to write the state journal, retrying in {retry:.3g}s: {e}")
+                    break
+                cls._flush_failures = 0
+                cls._journal_records = 0 if snapshot is not None else cls._journal_records + len(records)
+        finally:
+            cls._flush_task = None
+        if retry is not None:
+            cls._schedule_flush(retry)
+
+    @classmethod
+    def _snapshot(cls) -> dict:
+        # Reports and module states are replaced rather than changed, copying two levels is enough.
+        return {
+            "v": SCHEMA_VERSION,
+            "seq": cls._seq,
+            "reports": {module: dict(reports) for module, reports in cls._state["reports"].items()},
+            "modules": dict(cls._state["modules"]),
+        }
+
+    @staticmethod
+    @Scheduler.thread(pool="state")
+    def write(directory: str, records: list, snapshot: dict = None):
+        os.makedirs(directory, exist_ok=True)
+        journal = os.path.join(directory, JOURNAL_FILE)
+        if records:
+            with open(journal, "a") as f:
+                f.write("\n".join(json.dumps(record) for record in records) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        if snapshot is None:
+            return
+        path = os.path.join(directory, SNAPSHOT_FILE)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
+        # Everything in the journal is in the snapshot now.
+        with open(journal, "w") as f:
+            os.fsync(f.fileno())
+
+    @classmethod
+    async def close(cls):
+        """Write everything and compact the journal, eg. on shutdown."""
+        if cls._flush_handle is not None:
+            cls._flush_handle.cancel()
+            cls._flush_handle = None
+        if cls._flush_task is not None:
+            await cls._flush_task
+        if cls.directory is None:
+            return
+        if cls._state is None:
+            cls._loaded(*cls.read(cls.directory))
+        if cls._flush_handle is not None:
+            cls._flush_handle.cancel()
+            cls._flush_handle = None
+        records, cls._pending = cls._pending, []
+        try:
+            # Thread pools are shut down by now.
+            cls.write(cls.directory, records, cls._snapshot())
+            cls._journal_records = 0
+        except Exception as e:
+            log.exception(f"Unable to write the state snapshot: {e}")
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {"pending": len(cls._pending), "journal_records": cls._journal_records, "seq": cls._seq}
@@ -1,4 +1,5 @@
 import bisect
+import math
 import operator
 import os
 import time
@@ -131,6 +132,25 @@ def _read_top_level(root: str) -> dict:
     return result
 
 
+def boot_id() -> str | None:
+    """Random id of the current boot, changes on every reboot."""
+    return _read_file_nonblock("/proc/sys/kernel/random/boot_id")
+
+
+def read_peak_rss(pid: int) -> int | None:
+    """Peak resident set size (VmHWM) of a running process in bytes, None if unavailable."""
+    status = _read_file_nonblock(f"/proc/{pid}/status")
+    if status is None:
+        return None
+    for line in status.splitlines():
+        if line.startswith("VmHWM:"):
+            try:
+                return int(line.split()[1]) * 1024
+            except (IndexError, ValueError):
+                return None
+    return None
+
+
 class TimeSeries:
     """Ring buffer of timestamped samples for windowed evaluation.
 
@@ -181,6 +201,155 @@ class TimeSeries:
     def __len__(self):
         return len(self._samples)
 
+    def dump(self) -> dict:
+        """Samples and size, to persist the series. Timestamps are monotonic, only valid within a boot."""
+        return {"maxlen": self._samples.maxlen, "samples": [list(sample) for sample in self._samples]}
+
+    @classmethod
+    def load(cls, data: dict) -> 'TimeSeries':
+        series = cls(maxlen=data.get("maxlen"))
+        for value, timestamp in data.get("samples", []):
+            series.record(value, timestamp)
+        return series
+
+
+class LatencyStats:
+    """Summary of recent durations (in seconds) for p50/p95/max reporting.
+    Also used for other samples, eg. peak RSS of subprocesses in bytes.
+
+    Keeps the most recent samples in a bounded window for percentiles,
+    plus lifetime count and max.
+
+    Args:
+        maxlen: Number of recent samples used for percentiles.
+    """
+
+    def __init__(self, maxlen=256):
+        self._samples = deque(maxlen=maxlen)
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self._samples.append(seconds)
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct):
+        """Nearest-rank percentile over the sample window, None when empty."""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        rank = max(1, math.ceil(pct / 100 * len(ordered)))
+        return ordered[rank - 1]
+
+    def summary(self, precision=4) -> dict:
+        def rnd(value):
+            return round(value, precision) if value is not None else None
+        return {
+            "count": self.count,
+            "p50": rnd(self.percentile(50)),
+            "p95": rnd(self.percentile(95)),
+            "max": rnd(self.max) if self.count else None,
+        }
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class TokenBucket:
+    """Token bucket rate limiter: refills `rate` tokens per second, holding at most `burst`.
+
+    Times are passed in by the caller (eg. loop.time()), the bucket starts full.
+
+    Args:
+        rate: Tokens added per second.
+        burst: Bucket capacity, the most tokens that can be taken at once.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = None
+
+    def take(self, now) -> float:
+        """Take a token. Returns 0 if one was available, else the seconds until one is (taking nothing)."""
+        if self.updated is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError(f"{type(self).__name__} is read-only")
+
+
+class FrozenDict(dict):
+    """Read-only dict. Still a dict for isinstance, json and equality; every mutator raises TypeError."""
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+
+class FrozenList(list):
+    """Read-only list. Still a list for isinstance, json and equality; every mutator raises TypeError."""
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = clear = sort = reverse = _read_only
+
+    def __reduce__(self):
+        return (type(self), (list(self),))
+
+
+def freeze(obj):
+    """Read-only version of obj: dicts, lists and sets are converted recursively to
+    FrozenDict, FrozenList and frozenset. Values that are already frozen are returned
+    as is, so freezing a structure that shares most of its values with a frozen one
+    only allocates the containers that changed.
+    """
+    if isinstance(obj, (FrozenDict, FrozenList, frozenset)):
+        return obj
+    elif isinstance(obj, dict):
+        return FrozenDict((k, freeze(v)) for k, v in obj.items())
+    elif isinstance(obj, list):
+        return FrozenList(freeze(v) for v in obj)
+    elif isinstance(obj, set):
+        return frozenset(obj)
+    elif isinstance(obj, tuple):
+        frozen = tuple(freeze(v) for v in obj)
+        return obj if all(a is b for a, b in zip(frozen, obj)) else frozen
+    return obj
+
+
+def derived(obj, name: str, compute):
+    """
+    compute(obj), kept on obj under name if it is a FrozenDict or FrozenList: read-only
+    containers never change, so neither does anything computed from them.
+    """
+    if not isinstance(obj, (FrozenDict, FrozenList)):
+        return compute(obj)
+    value = obj.__dict__.get(name)
+    if value is None:
+        value = compute(obj)
+        obj.__dict__[name] = value
+    return value
+
+
+def thaw(obj):
+    """Shallow mutable copy of a FrozenDict or FrozenList, the values stay frozen. Other values are returned as is."""
+    if isinstance(obj, FrozenDict):
+        return dict(obj)
+    elif isinstance(obj, FrozenList):
+        return list(obj)
+    return obj
+
 
 def evaluate(eval_type, value, threshold, *, window=60, samples: TimeSeries = None):
     """Unified threshold evaluation. Returns (triggered: bool, evaluated_value).
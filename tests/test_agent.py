@@ -0,0 +1,46 @@
+import pytest
+from healthagent.agent import AgentHealthChecks
+from healthagent.config import AgentConfig
+from healthagent.reporter import Reporter, HealthStatus
+
+
+def _stall(lag, task="ProcessMonitor.monitor", location="healthagent/process.py:100 in monitor"):
+    """Helper: build a stall record as kept by LoopMonitor."""
+    return {"time": 0, "lag": lag, "task": task, "location": location, "stack": []}
+
+
+@pytest.fixture
+def module():
+    return AgentHealthChecks(reporter=Reporter(), config=AgentConfig(lag_strikes=2))
+
+
+class TestEventLoopLag:
+
+    def test_no_watchdog(self, module):
+        """Without a systemd watchdog stalls are not reported."""
+        assert module.evaluate_stalls([_stall(500)], None).status == HealthStatus.OK
+
+    def test_short_stalls_ok(self, module):
+        """Stalls below the warning budget are OK."""
+        report = module.evaluate_stalls([_stall(5), _stall(30)], 600)
+        assert report.status == HealthStatus.OK
+
+    def test_repeated_stalls_warn(self, module):
+        """lag_strikes stalls above lag_warning_pct of the watchdog timeout escalate to WARNING."""
+        report = module.evaluate_stalls([_stall(61)], 600)
+        assert report.status == HealthStatus.OK
+        report = module.evaluate_stalls([_stall(61), _stall(90, task="client[epilog]")], 600)
+        assert report.status == HealthStatus.WARNING
+        assert "client[epilog]" in report.details
+        assert "healthagent/process.py:100" in report.details
+
+    def test_long_stall_error(self, module):
+        """A stall above lag_error_pct of the watchdog timeout escalates to ERROR."""
+        report = module.evaluate_stalls([_stall(301)], 600)
+        assert report.status == HealthStatus.ERROR
+
+    def test_watchdog_timeout(self, monkeypatch):
+        monkeypatch.setenv("WATCHDOG_USEC", "600000000")
+        assert AgentHealthChecks.watchdog_timeout() == 600
+        monkeypatch.delenv("WATCHDOG_USEC")
+        assert AgentHealthChecks.watchdog_timeout() is None
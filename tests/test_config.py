@@ -5,7 +5,8 @@ from pydantic import ValidationError
 
 from healthagent.config import (
     deep_merge, load_config, HealthagentConfig,
-    ThresholdCheck, EvalType, ModuleName, ModuleConfig,
+    ThresholdCheck, EvalType, ModuleName, ModuleConfig, SchedulerConfig, ReporterConfig,
+    StateConfig, SinksConfig, RequestsConfig, AgentConfig,
 )
 from healthagent.healthmodule import HealthModule
 from healthagent.reporter import Reporter
@@ -256,6 +257,63 @@ class TestSchemaValidation:
         check = ThresholdCheck(eval=EvalType.GT, error=3, strikes=2)
         assert check.strikes == 2
 
+    def test_scheduler_timeouts(self):
+        """Scheduler timeouts and subprocess limits are validated."""
+        config = HealthagentConfig.model_validate({
+            "scheduler": {"timeouts": {"GpuHealthChecks.run_background_healthchecks": 45}},
+        })
+        assert config.scheduler.subprocess_timeout == 300
+        assert config.scheduler.subprocess_concurrency == 4
+        assert config.scheduler.timeouts == {"GpuHealthChecks.run_background_healthchecks": 45}
+        with pytest.raises(ValidationError):
+            SchedulerConfig(timeouts={"ProcessMonitor.monitor": 0})
+        with pytest.raises(ValidationError):
+            SchedulerConfig(subprocess_timeout=-1)
+        with pytest.raises(ValidationError):
+            SchedulerConfig(subprocess_concurrency=0)
+        with pytest.raises(ValidationError):
+            SchedulerConfig(timeout=10)
+
+    def test_agent_config(self):
+        """Agent module defaults, lag and stall threshold validation."""
+        config = HealthagentConfig.model_validate({"agent": {"lag_strikes": 5}})
+        assert config.agent.lag_strikes == 5
+        assert config.agent.lag_warning_pct == 10
+        assert config.agent.lag_error_pct == 50
+        assert config.scheduler.stall_threshold == 1.0
+        with pytest.raises(ValidationError):
+            SchedulerConfig(stall_threshold=0)
+        for field in ("lag_strikes", "lag_window", "lag_warning_pct", "lag_error_pct"):
+            with pytest.raises(ValidationError):
+                AgentConfig(**{field: 0})
+            with pytest.raises(ValidationError):
+                HealthagentConfig.model_validate({"agent": {field: -1}})
+
+    def test_reporter_config(self):
+        """Reporter publish settings are validated."""
+        config = HealthagentConfig.model_validate({"reporter": {"debounce": 0}})
+        assert config.reporter.debounce == 0
+        assert config.reporter.max_retries == 5
+        with pytest.raises(ValidationError):
+            ReporterConfig(debounce=-1)
+        with pytest.raises(ValidationError):
+            ReporterConfig(retry_backoff=0)
+        with pytest.raises(ValidationError):
+            ReporterConfig(retries=3)
+        with pytest.raises(ValidationError):
+            ReporterConfig(rate=0)
+        with pytest.raises(ValidationError):
+            ReporterConfig(burst=0)
+        with pytest.raises(ValidationError):
+            ReporterConfig(jitter=-1)
+
+    def test_scheduler_thread_pools(self):
+        """Thread pool sizes are validated."""
+        config = HealthagentConfig.model_validate({"scheduler": {"thread_pools": {"dcgm": 2}}})
+        assert config.scheduler.thread_pools == {"dcgm": 2}
+        with pytest.raises(ValidationError):
+            SchedulerConfig(thread_pools={"dcgm": 0})
+
     def test_model_dump_roundtrip(self):
         """model_dump produces a dict that can be re-validated."""
         config = HealthagentConfig.model_validate({
@@ -266,3 +324,45 @@ class TestSchemaValidation:
         reloaded = HealthagentConfig.model_validate(dumped)
         assert reloaded.gpu.xid.warning == [43, 63]
         assert reloaded.modules == [ModuleName.GPU, ModuleName.NETWORK]
+
+    def test_state_config(self):
+        """State journal settings are validated."""
+        config = HealthagentConfig.model_validate({"state": {"compact_after": 10}})
+        assert config.state.compact_after == 10
+        assert config.state.flush_interval == 1.0
+        with pytest.raises(ValidationError):
+            StateConfig(flush_interval=0)
+        with pytest.raises(ValidationError):
+            StateConfig(compact_after=0)
+        with pytest.raises(ValidationError):
+            StateConfig(interval=5)
+
+    def test_sinks_config(self):
+        """File sinks are disabled by default, their settings are validated."""
+        config = HealthagentConfig.model_validate({"sinks": {"ndjson": {"enabled": True, "max_bytes": 0}}})
+        assert config.sinks.ndjson.enabled and config.sinks.ndjson.path == "reports.ndjson"
+        assert not config.sinks.prometheus.enabled
+        assert config.sinks.prometheus.interval == 5
+        with pytest.raises(ValidationError):
+            SinksConfig.model_validate({"prometheus": {"interval": 0}})
+        with pytest.raises(ValidationError):
+            SinksConfig.model_validate({"ndjson": {"max_bytes": -1}})
+        with pytest.raises(ValidationError):
+            SinksConfig.model_validate({"syslog": {"enabled": True}})
+
+    def test_requests_config(self):
+        """Prolog/epilog results are reused for 30s by default, 0 only shares running requests."""
+        assert HealthagentConfig().requests.result_ttl == 30
+        assert HealthagentConfig.model_validate({"requests": {"result_ttl": 0}}).requests.result_ttl == 0
+        with pytest.raises(ValidationError):
+            RequestsConfig(result_ttl=-1)
+        with pytest.raises(ValidationError):
+            RequestsConfig(ttl=5)
+
+    def test_module_timeout(self):
+        """Modules accept a positive timeout for their prolog/epilog/status handlers."""
+        config = HealthagentConfig.model_validate({"gpu": {"timeout": 900}})
+        assert config.gpu.timeout == 900
+        assert config.network.timeout is None
+        with pytest.raises(ValidationError):
+            ModuleConfig(timeout=0)
@@ -1,3 +1,8 @@
+import asyncio
+import json
+import pytest
+import threading
+import time
 from healthagent import epilog, status, prolog, healthcheck
 from healthagent.reporter import Reporter
 from healthagent.healthmodule import HealthModule
@@ -463,7 +468,7 @@ def test_list_checks_cached():
 
 # --- Tests for stale report pruning ---
 
-from healthagent.reporter import HealthReport
+from healthagent.reporter import HealthReport, HealthStatus, ReportEvents
 
 def test_status_prunes_stale_reporter_keys():
     """Reporter keys that don't match any registered healthcheck should be removed by status()."""
@@ -500,6 +505,98 @@ def test_status_no_pruning_when_all_keys_valid():
     assert "ActiveGPUHealthChecks" in result
 
 
+async def test_status_generation_and_cached_status_response():
+    """The node status is serialized once and reused until a module reports a change."""
+    from healthagent.healthagent import Healthagent
+
+    reporter = Reporter()
+    systemd = FakeSystemdModule(reporter=reporter)
+    assert systemd.status_generation() == reporter.store.generation
+    # An extra @status handler may return anything, it cannot be cached
+    assert FakeGpuModule(reporter=Reporter()).status_generation() is None
+
+    modules, Healthagent.modules = Healthagent.modules, {"systemd": systemd}
+    Healthagent._status_cache = {}
+    try:
+        first = await Healthagent.status_response()
+        assert first == b'{"systemd": {}}'
+        assert await Healthagent.status_response() is first
+
+        await reporter.update_report("StaleKey", HealthReport(status=HealthStatus.ERROR))
+        # The new key is pruned by status(), the response is rendered again
+        second = await Healthagent.status_response()
+        assert second is not first and second == first
+        assert await Healthagent.status_response() is second
+
+        Healthagent.modules["gpu"] = FakeGpuModule(reporter=Reporter())
+        third = await Healthagent.status_response()
+        assert await Healthagent.status_response() is not third
+    finally:
+        Healthagent.modules = modules
+        Healthagent._status_cache = {}
+
+
+async def test_status_since():
+    """status_since returns the reports changed after a version, by module."""
+    from healthagent.healthagent import Healthagent
+
+    reporter = Reporter()
+    reporter.publish_cc = False
+    gpu = FakeGpuModule(reporter=Reporter())
+    modules, Healthagent.modules = Healthagent.modules, {"proc": FakeProcessModule(reporter=reporter), "gpu": gpu}
+    try:
+        await reporter.update_report("ZombieCheck", HealthReport(status=HealthStatus.ERROR))
+        response = await Healthagent.status_since(0)
+        version = response["version"]
+        assert response["status"]["proc"]["ZombieCheck"]["status"] == "Error"
+        # Modules with their own @status handlers always send their whole status
+        assert response["status"]["gpu"] == {"gpu_custom": "healthy"}
+
+        del Healthagent.modules["gpu"]
+        assert await Healthagent.status_since(version) == {"version": version, "status": {}, "removed": {}}
+
+        await reporter.update_report("Readiness", HealthReport())
+        reporter.store["StaleKey"] = HealthReport()
+        response = await Healthagent.status_since(version)
+        assert list(response["status"]["proc"]) == ["Readiness"]
+        assert response["removed"] == {"proc": ["StaleKey"]}
+        assert response["version"] > version
+    finally:
+        Healthagent.modules = modules
+
+
+async def test_subscribe(tmp_path):
+    """A subscribe connection streams report events as JSON lines until the server stops."""
+    import asyncio
+    import json
+    from healthagent.healthagent import Healthagent
+
+    reporter = Reporter()
+    reporter.publish_cc = False
+    reporter.module = "proc"
+    path = str(tmp_path / "health.sock")
+    server = await asyncio.start_unix_server(Healthagent.handle_client, path=path)
+    try:
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(json.dumps({"command": "subscribe"}).encode())
+        writer.write_eof()
+        subscribed = json.loads(await asyncio.wait_for(reader.readline(), 5))
+        assert subscribed["event"] == "subscribed"
+
+        await reporter.update_report("ZombieCheck", HealthReport(status=HealthStatus.ERROR))
+        event = json.loads(await asyncio.wait_for(reader.readline(), 5))
+        assert event["module"] == "proc" and event["report"] == "ZombieCheck"
+        assert event["new_status"] == "Error" and event["version"] > subscribed["version"]
+
+        ReportEvents.close()
+        assert await asyncio.wait_for(reader.readline(), 5) == b""
+        writer.close()
+    finally:
+        server.close()
+        await server.wait_closed()
+    assert ReportEvents.stats()["subscribers"] == 0
+
+
 # --- Tests for _phase injection ---
 
 class FakePhaseAwareModule(HealthModule):
@@ -641,3 +738,303 @@ async def test_execute_rejects_unknown_args():
     # MemTest allows gpu_id but not 'bad_arg'
     result = await mod.execute("epilog", checks={"MemTest": {"gpu_id": [0], "bad_arg": "x"}})
     assert result["MemTest"]["gpu_id"] == [0]
+
+
+# Module with a blocking epilog check run on a thread pool
+class FakeThreadModule(HealthModule):
+
+    @healthcheck("BlockingCheck")
+    @epilog
+    @Scheduler.thread(pool="test")
+    def blocking_check(self):
+        return {"BlockingCheck": {"thread": threading.current_thread().name}}
+
+
+async def test_execute_thread_handler():
+    """@Scheduler.thread handlers run on their thread pool, not on the event loop."""
+    reporter = Reporter()
+    mod = FakeThreadModule(reporter=reporter)
+    result = await mod.execute("epilog")
+    assert result["BlockingCheck"]["thread"].startswith("healthagent-test")
+
+
+# Modules with slow epilog checks, for the concurrent module fan-out
+class FakeSlowModule(HealthModule):
+
+    delay = 0.2
+
+    @healthcheck("FastCheck")
+    @epilog
+    async def fast_check(self):
+        return {"FastCheck": {"status": "OK"}}
+
+    @healthcheck("SlowCheck")
+    @epilog
+    async def slow_check(self):
+        await asyncio.sleep(self.delay)
+        return {"SlowCheck": {"status": "OK"}}
+
+
+class FakeBrokenModule(HealthModule):
+
+    async def execute(self, attribute_flag, checks=None, response=None, timing=None):
+        raise RuntimeError("broken module")
+
+
+async def test_execute_modules_concurrently():
+    """Modules run at the same time, each module's failure is isolated and timed."""
+    from healthagent.healthagent import Healthagent
+
+    modules, Healthagent.modules = Healthagent.modules, {
+        "gpu": FakeSlowModule(reporter=Reporter()),
+        "proc": FakeSlowModule(reporter=Reporter()),
+        "kmsg": FakeBrokenModule(reporter=Reporter()),
+    }
+    try:
+        start = time.perf_counter()
+        response = await Healthagent._execute_module_functions("epilog", timing=True)
+        assert time.perf_counter() - start < 0.35
+        assert response["gpu"] == response["proc"] == {"FastCheck": {"status": "OK"}, "SlowCheck": {"status": "OK"}}
+        assert response["kmsg"] == {}
+        assert response["timing"]["gpu"]["result"] == "ok"
+        assert response["timing"]["gpu"]["seconds"] >= 0.2
+        assert set(response["timing"]["gpu"]["checks"]) == {"FastCheck", "SlowCheck"}
+        assert response["timing"]["kmsg"]["result"] == "error"
+        # No timing block for status
+        assert "timing" not in await Healthagent._execute_module_functions("status")
+    finally:
+        Healthagent.modules = modules
+
+
+async def test_execute_module_timeout_returns_partial_results():
+    """A module running out of time returns the checks it completed and a timeout report."""
+    from healthagent.healthagent import Healthagent
+    from healthagent.config import HealthagentConfig
+
+    modules, Healthagent.modules = Healthagent.modules, {
+        "gpu": FakeSlowModule(reporter=Reporter()),
+        "proc": FakeSlowModule(reporter=Reporter()),
+    }
+    config, Healthagent.config = Healthagent.config, HealthagentConfig.model_validate({"gpu": {"timeout": 0.05}})
+    try:
+        response = await Healthagent._execute_module_functions("epilog", timing=True)
+        assert response["gpu"]["FastCheck"] == {"status": "OK"}
+        assert "SlowCheck" not in response["gpu"]
+        assert response["gpu"]["FakeSlowModule"]["status"] == "Warning"
+        assert response["timing"]["gpu"]["result"] == "timeout"
+        assert "SlowCheck" in response["proc"]
+
+        # The request deadline also bounds the modules without a timeout
+        Healthagent.config = None
+        with Scheduler.deadline(0.05):
+            response = await Healthagent._execute_module_functions("epilog", timing=True)
+        assert {info["result"] for info in response["timing"].values()} == {"timeout"}
+    finally:
+        Healthagent.modules = modules
+        Healthagent.config = config
+
+
+# Checks declaring the resources they use, for concurrent execution within a module
+class FakeResourceModule(HealthModule):
+
+    delay = 0.1
+
+    def __init__(self, reporter):
+        super().__init__(reporter)
+        self.running = set()
+        self.overlaps = []
+
+    async def _run(self, name):
+        if self.running:
+            self.overlaps.append((name, sorted(self.running)))
+        self.running.add(name)
+        await asyncio.sleep(self.delay)
+        self.running.discard(name)
+        return {name: {"status": "OK"}}
+
+    @healthcheck("GpuA", args=["gpu_id"], exclusive=["gpu:gpu_id"])
+    @epilog
+    async def gpu_a(self, gpu_id: list = None):
+        return await self._run("GpuA")
+
+    @healthcheck("GpuB", args=["gpu_id"], exclusive=["gpu:gpu_id"])
+    @epilog
+    async def gpu_b(self, gpu_id: list = None):
+        return await self._run("GpuB")
+
+    @healthcheck("ProcA", shared=["proc"])
+    @epilog
+    async def proc_a(self):
+        return await self._run("ProcA")
+
+    @healthcheck("ProcB", shared=["proc"])
+    @epilog
+    async def proc_b(self):
+        return await self._run("ProcB")
+
+    @healthcheck("Undeclared")
+    @prolog
+    async def undeclared(self):
+        return await self._run("Undeclared")
+
+    @healthcheck("NicCheck", exclusive=["nic"])
+    @prolog
+    async def nic_check(self):
+        return await self._run("NicCheck")
+
+
+async def test_execute_non_conflicting_checks_concurrently():
+    mod = FakeResourceModule(reporter=Reporter())
+    timing = {}
+    checks = {"GpuA": {"gpu_id": "0"}, "GpuB": {"gpu_id": "1"}, "ProcA": {}, "ProcB": {}}
+    start = time.perf_counter()
+    result = await mod.execute("epilog", checks=checks, timing=timing)
+    assert time.perf_counter() - start < 0.18
+    assert set(result) == {"GpuA", "GpuB", "ProcA", "ProcB"}
+    assert {name: entry["wave"] for name, entry in timing.items()} == {"GpuA": 0, "GpuB": 0, "ProcA": 0, "ProcB": 0}
+    assert all(entry["seconds"] >= 0.1 for entry in timing.values())
+
+
+async def test_execute_conflicting_checks_serially():
+    """Checks on the same GPU run one after the other, in declaration order."""
+    mod = FakeResourceModule(reporter=Reporter())
+    timing = {}
+    checks = {"GpuB": {"gpu_id": "1"}, "GpuA": {"gpu_id": "1,2"}, "ProcA": {}}
+    await mod.execute("epilog", checks=checks, timing=timing)
+    assert timing["GpuA"]["wave"] == 0 and timing["GpuA"]["after"] == []
+    assert timing["GpuB"]["wave"] == 1 and timing["GpuB"]["after"] == ["GpuA"]
+    assert timing["GpuB"]["start"] >= timing["GpuA"]["seconds"]
+    assert timing["ProcA"]["wave"] == 0
+    # GpuB only overlapped ProcA, never GpuA
+    assert all("GpuA" not in running for name, running in mod.overlaps if name == "GpuB")
+
+    # No gpu_id claims every GPU
+    timing = {}
+    await mod.execute("epilog", checks={"GpuA": {"gpu_id": "0"}, "GpuB": {}}, timing=timing)
+    assert timing["GpuB"]["after"] == ["GpuA"]
+
+
+async def test_execute_undeclared_checks_serially():
+    """A check without declared resources conflicts with every other check."""
+    mod = FakeResourceModule(reporter=Reporter())
+    timing = {}
+    await mod.execute("prolog", timing=timing)
+    assert mod.overlaps == []
+    assert timing["NicCheck"]["wave"] == 1 and timing["NicCheck"]["after"] == ["Undeclared"]
+
+
+class FakeCountingModule(HealthModule):
+
+    def __init__(self, reporter):
+        super().__init__(reporter)
+        self.runs = 0
+
+    @healthcheck("GpuDiagnosticCheck", args=["gpu_id", "tests"])
+    @epilog
+    async def diag(self, gpu_id: list = None, tests: str = ""):
+        self.runs += 1
+        await asyncio.sleep(0.05)
+        return {"GpuDiagnosticCheck": {"status": "OK", "run": self.runs}}
+
+
+async def test_identical_requests_share_execution():
+    """Identical epilogs in flight, or within result_ttl, run the checks once."""
+    from healthagent.healthagent import Healthagent
+    from healthagent.config import HealthagentConfig
+    from healthagent.scheduler import SingleFlight
+
+    module = FakeCountingModule(reporter=Reporter())
+    modules, Healthagent.modules = Healthagent.modules, {"gpu": module}
+    flight, Healthagent.single_flight = Healthagent.single_flight, SingleFlight()
+    config, Healthagent.config = Healthagent.config, HealthagentConfig.model_validate({"requests": {"result_ttl": 0.1}})
+    try:
+        same = [{"GpuDiagnosticCheck": {"gpu_id": "0,1", "tests": "medium"}},
+                {"gpudiagnosticcheck": {"tests": "medium", "gpu_id": "1, 0"}},
+                {"GpuDiagnosticCheck": {"gpu_id": ["1", "0"], "tests": "medium"}}]
+        assert len({Healthagent._request_key("epilog", checks) for checks in same}) == 1
+        payloads = await asyncio.gather(*(Healthagent.request_response("epilog", checks) for checks in same))
+        assert payloads[0] is payloads[1] is payloads[2]
+        assert module.runs == 1
+        # Reused for result_ttl, but not by other checks or commands
+        assert await Healthagent.request_response("epilog", same[0]) is payloads[0]
+        other = await Healthagent.request_response("epilog", {"GpuDiagnosticCheck": {"gpu_id": "2"}})
+        assert json.loads(other)["gpu"]["GpuDiagnosticCheck"]["run"] == 2
+        await asyncio.sleep(0.15)
+        again = await Healthagent.request_response("epilog", same[0])
+        assert json.loads(again)["gpu"]["GpuDiagnosticCheck"]["run"] == 3
+        assert "timing" in json.loads(again)
+    finally:
+        Healthagent.modules = modules
+        Healthagent.single_flight = flight
+        Healthagent.config = config
+
+
+async def test_status_filters_and_projection():
+    """Status can be limited to modules and reports, projected to fields, or summarized for bash."""
+    from healthagent.healthagent import Healthagent
+
+    gpu = FakeSystemdModule(reporter=Reporter())
+    systemd = FakeSystemdModule(reporter=Reporter())
+    for module in (gpu, systemd):
+        module._build_checks_registry = lambda: {"XidCheck": {}, "GpuHealthChecks": {}}
+    await gpu.reporter.update_report("XidCheck", HealthReport(status=HealthStatus.ERROR, message="Xid 79",
+                                                              custom_fields={"error_count": 2, "xids": [79, 79]}))
+    await gpu.reporter.update_report("GpuHealthChecks", HealthReport(status=HealthStatus.ERROR, message="ECC"))
+    await systemd.reporter.update_report("XidCheck", HealthReport(message="ok"))
+
+    modules, Healthagent.modules = Healthagent.modules, {"gpu": gpu, "systemd": systemd}
+    Healthagent._status_cache = {}
+    try:
+        query = Healthagent._status_query({"modules": "gpu", "checks": ["xidcheck"], "fields": "status, error_count"})
+        assert query == (("gpu",), ("xidcheck",), ("error_count", "status"), None)
+        response = json.loads(await Healthagent.status_response(*query))
+        assert response == {"gpu": {"XidCheck": {"status": "Error", "error_count": 2}}}
+
+        bash = Healthagent._status_query({"format": "bash"})
+        assert json.loads(await Healthagent.status_response(*bash)) == {"gpu": 3, "systemd": 0}
+        bash = Healthagent._status_query({"format": "bash", "checks": "GpuHealthChecks"})
+        assert json.loads(await Healthagent.status_response(*bash)) == {"gpu": 1, "systemd": 0}
+
+        # Each query is cached until the modules it covers change
+        first = await Healthagent.status_response(*query)
+        assert await Healthagent.status_response(*query) is first
+        await systemd.reporter.update_report("XidCheck", HealthReport(message="still ok"))
+        assert await Healthagent.status_response(*query) is first
+        await gpu.reporter.update_report("XidCheck", HealthReport())
+        assert await Healthagent.status_response(*query) is not first
+
+        assert set(json.loads(await Healthagent.status_response())) == {"gpu", "systemd"}
+        with pytest.raises(ValueError):
+            Healthagent._status_query({"format": "yaml"})
+    finally:
+        Healthagent.modules = modules
+        Healthagent._status_cache = {}
+
+
+class FakeNestedTimeoutModule(HealthModule):
+
+    @healthcheck("BlockingCheck")
+    @epilog
+    async def blocking_check(self):
+        from healthagent.scheduler import TaskTimeout
+        try:
+            await Scheduler.run_in_thread(time.sleep, 0.5)
+        except TaskTimeout:
+            return {"BlockingCheck": {"status": "Warning"}}
+        return {"BlockingCheck": {"status": "OK"}}
+
+
+async def test_module_timeout_reaches_nested_tasks():
+    """Tasks started by a module time out before the module, so its checks report the timeout."""
+    from healthagent.healthagent import Healthagent
+    from healthagent.config import HealthagentConfig
+
+    modules, Healthagent.modules = Healthagent.modules, {"gpu": FakeNestedTimeoutModule(reporter=Reporter())}
+    config, Healthagent.config = Healthagent.config, HealthagentConfig.model_validate({"gpu": {"timeout": 0.3}})
+    try:
+        response = await Healthagent._execute_module_functions("epilog", timing=True)
+        assert response["gpu"] == {"BlockingCheck": {"status": "Warning"}}
+        assert response["timing"]["gpu"]["result"] == "ok"
+    finally:
+        Healthagent.modules = modules
+        Healthagent.config = config
@@ -1,4 +1,5 @@
 import pytest
+import json
 from unittest.mock import patch
 from healthagent.network import (
     NetworkHealthChecks, NetworkInterface, NetDevType,
@@ -6,6 +7,7 @@ from healthagent.network import (
 )
 from healthagent.config import NetworkConfig, ThresholdCheck, EvalType
 from healthagent.reporter import Reporter, HealthStatus
+from healthagent.statestore import encode, decode
 
 
 def _make_ib_interface(name="ib0", state="4: ACTIVE", phys_state="5: LinkUp",
@@ -494,3 +496,53 @@ class TestMultiPort:
         # Only port 2 should have the error
         assert any("port 2" in e for e in errors)
         assert not any("port 1" in e for e in errors)
+
+
+# ── State across restarts ──────────────────────────────────
+
+class TestSaveRestoreState:
+
+    async def _flap(self, checker, samples):
+        for link_downed, t in samples:
+            with patch("healthagent.util.time") as mock_time:
+                mock_time.monotonic.return_value = t
+                checker.get_network_state = lambda ld=link_downed: [_make_ib_interface(link_downed=ld)]
+                await checker.run_network_checks()
+
+    def _restart(self, checker, config):
+        """State round tripped through the StateStore encoding, into a new checker."""
+        state = decode(json.loads(json.dumps(encode(checker.save_state()))))
+        restarted = _make_checker(config)
+        restarted.restore_state(state)
+        return restarted
+
+    @pytest.mark.asyncio
+    async def test_window_and_strikes_survive_restart(self):
+        config = NetworkConfig(infiniband={
+            "link_downed": ThresholdCheck(eval=EvalType.WINDOW_GT, error=3, window=180, strikes=1,
+                                          msg="IB link flapped too many times"),
+        })
+        checker = _make_checker(config)
+        await self._flap(checker, [(0, 0.0), (1, 60.0), (2, 120.0)])
+        restarted = self._restart(checker, config)
+        key = ("ib0", "link_downed", "1")
+        assert len(restarted._time_series[key]) == 3
+
+        # The window spans the restart: one more flap is enough.
+        await self._flap(restarted, [(4, 180.0)])
+        assert restarted.reporter.store["NetworkInterfaceCheck"].status == HealthStatus.ERROR
+        assert restarted._trigger_count[key] == 1
+
+        # Strikes are exhausted, the error stays after another restart.
+        restarted = self._restart(restarted, config)
+        await self._flap(restarted, [(4, 240.0)])
+        assert restarted.reporter.store["NetworkInterfaceCheck"].status == HealthStatus.ERROR
+
+    def test_state_from_previous_boot_ignored(self):
+        checker = _make_checker()
+        checker._trigger_count[("ib0", "link_downed", "1")] = 1
+        state = checker.save_state()
+        state["boot_id"] = "another-boot"
+        restarted = _make_checker()
+        restarted.restore_state(state)
+        assert restarted._trigger_count == {}
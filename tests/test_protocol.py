@@ -0,0 +1,134 @@
+import asyncio
+import json
+import pytest
+from healthagent import epilog, healthcheck
+from healthagent.client import HealthClient, request_once
+from healthagent.healthagent import Healthagent, VERSION
+from healthagent.healthmodule import HealthModule
+from healthagent.protocol import MAGIC, MAX_FRAME, ProtocolError, frame, read_frame
+from healthagent.reporter import Reporter
+from healthagent.scheduler import SingleFlight
+
+
+class FakeEpilogModule(HealthModule):
+
+    @healthcheck("SlowCheck")
+    @epilog
+    async def slow_check(self):
+        await asyncio.sleep(0.2)
+        return {"SlowCheck": {"status": "OK"}}
+
+
+@pytest.fixture
+async def server(tmp_path):
+    """Healthagent socket server in tmp_path, with a module taking 0.2s for its epilog."""
+    path = str(tmp_path / "health.sock")
+    modules, Healthagent.modules = Healthagent.modules, {"gpu": FakeEpilogModule(reporter=Reporter())}
+    flight, Healthagent.single_flight = Healthagent.single_flight, SingleFlight()
+    server = await asyncio.start_unix_server(Healthagent.handle_client, path=path)
+    try:
+        yield path
+    finally:
+        server.close()
+        await server.wait_closed()
+        Healthagent.modules = modules
+        Healthagent.single_flight = flight
+
+
+async def test_frames():
+    reader = asyncio.StreamReader()
+    reader.feed_data(frame(b'{"id": 1}') + frame(b"{}"))
+    reader.feed_eof()
+    assert await read_frame(reader) == b'{"id": 1}'
+    assert await read_frame(reader) == b"{}"
+    assert await read_frame(reader) is None
+    with pytest.raises(ProtocolError):
+        frame(b" " * (MAX_FRAME + 1))
+
+    reader = asyncio.StreamReader()
+    reader.feed_data(frame(b"{}")[:5])
+    reader.feed_eof()
+    with pytest.raises(asyncio.IncompleteReadError):
+        await read_frame(reader)
+
+
+async def test_pipelined_requests(server):
+    """Requests on one connection are answered as they complete, matched by id."""
+    reader, writer = await asyncio.open_unix_connection(server)
+    writer.write(MAGIC)
+    assert await asyncio.wait_for(reader.readexactly(len(MAGIC)), 5) == MAGIC
+    writer.write(frame(json.dumps({"id": "e", "command": "epilog"}).encode()) +
+                 frame(json.dumps({"id": 2, "command": "version"}).encode()) +
+                 frame(json.dumps({"id": 3, "command": "unknown"}).encode()) +
+                 frame(json.dumps({"id": 4, "command": "subscribe"}).encode()))
+    messages = [json.loads(await asyncio.wait_for(read_frame(reader), 5)) for _ in range(4)]
+    # The epilog takes the longest and comes last
+    assert [m["id"] for m in messages][-1] == "e"
+    by_id = {m["id"]: m for m in messages}
+    assert by_id[2] == {"id": 2, "response": VERSION}
+    assert by_id[3]["error"] == "Invalid message received"
+    assert "error" in by_id[4]
+    assert by_id["e"]["response"]["gpu"] == {"SlowCheck": {"status": "OK"}}
+
+    # The connection stays open, requests sent before closing it are still answered
+    writer.write(frame(json.dumps({"id": 5, "command": "list_checks"}).encode()))
+    writer.write_eof()
+    assert json.loads(await asyncio.wait_for(read_frame(reader), 5))["response"]["gpu"]["SlowCheck"]["category"] == ["epilog"]
+    assert await asyncio.wait_for(read_frame(reader), 5) is None
+    writer.close()
+
+
+async def test_health_client(server):
+    def run():
+        with HealthClient(path=server, timeout=5) as client:
+            results = client.pipeline([{"command": "version"}, {"command": "epilog"}, {"command": "list_checks"}])
+            assert client.framed
+            with pytest.raises(ProtocolError):
+                client.request({"command": "unknown"})
+            return results + [client.request({"command": "version"})]
+
+    version, response, checks, again = await asyncio.to_thread(run)
+    assert version == again == VERSION
+    assert response["gpu"] == {"SlowCheck": {"status": "OK"}}
+    assert checks["gpu"]["SlowCheck"]["category"] == ["epilog"]
+
+
+async def test_legacy_client(server):
+    """Clients sending a single request and closing their side keep working."""
+    response = await asyncio.to_thread(request_once, {"command": "version"}, 5, server)
+    assert json.loads(response) == VERSION
+
+
+async def test_health_client_fallback(tmp_path):
+    """A daemon not answering the handshake gets a connection per request."""
+    path = str(tmp_path / "health.sock")
+
+    async def legacy(reader, writer):
+        request = json.loads(await reader.read())
+        writer.write(json.dumps({"echo": request["command"]}).encode())
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_unix_server(legacy, path=path)
+
+    def run():
+        client = HealthClient(path=path, timeout=5, negotiate_timeout=0.1)
+        results = client.pipeline([{"command": "status"}, {"command": "version"}])
+        assert client.framed is False
+        return results
+
+    try:
+        assert await asyncio.to_thread(run) == [{"echo": "status"}, {"echo": "version"}]
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+async def test_invalid_timeout(server):
+    """A timeout that is not a positive number of seconds is answered with an error."""
+    for timeout in ("soon", -5, 0, float("nan"), True):
+        request = {"command": "epilog", "timeout": timeout}
+        response = json.loads(await asyncio.to_thread(request_once, request, 5, server))
+        assert "Invalid timeout" in response["error"]
+    response = await asyncio.to_thread(request_once, {"command": "epilog", "timeout": 30}, 5, server)
+    assert json.loads(response)["gpu"] == {"SlowCheck": {"status": "OK"}}
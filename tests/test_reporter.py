@@ -1,8 +1,13 @@
+import asyncio
 from healthagent.reporter import *
+from healthagent.reporter import _node_rng, _digest
+from healthagent.config import ReporterConfig
 import pickle
 import os
 import json
 from unittest.mock import patch,AsyncMock
+from dataclasses import FrozenInstanceError
+import pytest
 import enum
 
 def test_healthstatus_ordering():
@@ -226,6 +231,343 @@ def test_summarize_excludes_details():
     assert summary["test"]["description"] == "fail"
 
 
+def test_fingerprint():
+    """Reports with the same content share a fingerprint, whatever their last_update and aux_data."""
+    r1 = HealthReport(status=HealthStatus.ERROR, description="fail", custom_fields={"GPU_0": {"xid": [{"xid": 79}]}})
+    r2 = HealthReport(status=HealthStatus.ERROR, description="fail", custom_fields={"GPU_0": {"xid": [{"xid": 79}]}},
+                      aux_data={0: "x"})
+    r2.last_update = r1.last_update + timedelta(minutes=1)
+    assert r1.fingerprint == r2.fingerprint
+    assert r1 == r2
+
+    # Assigning a field invalidates the cached fingerprint
+    r2.description = "other failure"
+    assert r1.fingerprint != r2.fingerprint
+    r2.description = "fail"
+    assert r1 == r2
+
+    # Changes in place are only seen after a refresh
+    r2.custom_fields["GPU_0"]["xid"].append({"xid": 48})
+    assert r1.fingerprint != r2.refresh_fingerprint()
+
+
+async def test_fingerprint_canonical_values():
+    """Timestamps are hashed at full precision, values without a stable form are rejected."""
+    when = datetime(2026, 1, 1, 12, 0, 0, 100000, tzinfo=timezone.utc)
+    r1 = HealthReport(custom_fields={"since": when})
+    r2 = HealthReport(custom_fields={"since": when + timedelta(milliseconds=200)})
+    assert r1.fingerprint != r2.fingerprint
+    assert r1.fingerprint == HealthReport(custom_fields={"since": when}).fingerprint
+
+    reporter = Reporter()
+    reporter.publish_cc = False
+    await reporter.update_report("gpu_test", r1)
+    stored = reporter.get_report("gpu_test")
+    await reporter.update_report("gpu_test", r2)
+    assert reporter.get_report("gpu_test").version > stored.version
+    assert reporter.get_report("gpu_test").custom_fields["since"] == r2.custom_fields["since"]
+    with pytest.raises(TypeError):
+        HealthReport(custom_fields={"lock": object()}).fingerprint
+
+
+def test_fingerprint_mixed_key_types():
+    """custom_fields with keys of different types can still be fingerprinted."""
+    r1 = HealthReport(custom_fields={"count": 1, 0: {"xid": {43, 79}}})
+    r2 = HealthReport(custom_fields={0: {"xid": {79, 43}}, "count": 1})
+    assert r1.fingerprint == r2.fingerprint
+
+
+async def test_update_report_detects_change_in_place():
+    """A report object that is changed in place and updated again is detected as changed."""
+    reporter = Reporter()
+    reporter.publish_cc = False
+    report = HealthReport(status=HealthStatus.ERROR, custom_fields={"errors": ["GPU 0 failed"]})
+    await reporter.update_report("gpu_test", report)
+    stored = reporter.store["gpu_test"]
+    await reporter.update_report("gpu_test", report)
+    assert reporter.store["gpu_test"] is not stored
+    assert reporter.store["gpu_test"].version == stored.version
+    stored = reporter.store["gpu_test"]
+
+    report.custom_fields["errors"].append("GPU 1 failed")
+    await reporter.update_report("gpu_test", report)
+    assert reporter.store["gpu_test"] is not stored
+    assert reporter.store["gpu_test"].custom_fields["errors"] == ["GPU 0 failed", "GPU 1 failed"]
+
+
+async def test_stored_report_is_read_only_snapshot():
+    """Stored reports are read-only snapshots, handed out by get_report without copying."""
+    reporter = Reporter()
+    reporter.publish_cc = False
+    report = HealthReport(status=HealthStatus.ERROR, custom_fields={"GPU_0": {"errors": ["failed"]}, "category": {"XID"}})
+    await reporter.update_report("gpu_test", report)
+    stored = reporter.get_report("gpu_test")
+    assert stored is reporter.store["gpu_test"]
+    assert stored.frozen and not report.frozen
+    with pytest.raises(FrozenInstanceError):
+        stored.status = HealthStatus.OK
+    with pytest.raises(TypeError):
+        stored.custom_fields["GPU_0"]["errors"].append("failed again")
+    # The caller's report is not shared with the store
+    report.custom_fields["GPU_0"]["errors"].append("failed again")
+    assert stored.custom_fields["GPU_0"]["errors"] == ["failed"]
+    assert stored.view()["category"] == ["XID"]
+
+    # Stored snapshots survive a pickle round trip, as read when migrating pickled reporters
+    restored = Reporter.load_reporter_obj(pickle.loads(pickle.dumps(reporter)))
+    assert restored.get_report("gpu_test") == stored
+    assert restored.get_report("gpu_test").frozen
+
+
+async def test_unchanged_update_keeps_held_snapshot():
+    """An update with the same content stores a new snapshot, the one readers hold does not change."""
+    reporter = Reporter()
+    reporter.publish_cc = False
+    await reporter.update_report("gpu_test", HealthReport(status=HealthStatus.ERROR, aux_data={"seen": 1}))
+    held = reporter.get_report("gpu_test")
+    last_update, version = held.last_update, held.version
+    await reporter.update_report("gpu_test", HealthReport(status=HealthStatus.ERROR, aux_data={"seen": 2}))
+    current = reporter.get_report("gpu_test")
+    assert current is not held and current.frozen
+    assert held.last_update == last_update and held.aux_data == {"seen": 1}
+    assert current.last_update > last_update and current.aux_data == {"seen": 2}
+    # Same content, same version
+    assert current.version == version
+
+
+async def test_evolve():
+    """evolve derives a new report, sharing the values that did not change."""
+    reporter = Reporter()
+    reporter.publish_cc = False
+    await reporter.update_report("gpu_test", HealthReport(status=HealthStatus.WARNING, description="warn",
+                                                          custom_fields={"GPU_0": {"errors": []}}))
+    stored = reporter.get_report("gpu_test")
+    report = stored.evolve(status=HealthStatus.ERROR)
+    assert not report.frozen
+    assert report.status == HealthStatus.ERROR and report.description == "warn"
+    assert report.custom_fields["GPU_0"] is stored.custom_fields["GPU_0"]
+    report.custom_fields["GPU_1"] = {"errors": ["failed"]}
+    assert "GPU_1" not in stored.custom_fields
+    assert report.fingerprint != stored.fingerprint
+    with pytest.raises(TypeError):
+        stored.evolve(no_such_field=1)
+
+    await reporter.update_report("gpu_test", report)
+    assert reporter.get_report("gpu_test").custom_fields["GPU_0"] is stored.custom_fields["GPU_0"]
+    assert reporter.get_report("gpu_test").status == HealthStatus.ERROR
+
+    # Frozen reports can be passed back to update_report as they are
+    await reporter.update_report("other_test", stored)
+    assert reporter.get_report("other_test") == stored
+
+
+async def test_evolve_rehashes_replaced_values_only():
+    """Hashes of the values a report shares with the stored one are reused, the fingerprint stays the same."""
+    custom_fields = {"GPU_0": {"xid": [43]}, "GPU_1": {"xid": []}, "count": 1}
+    reporter = Reporter()
+    reporter.publish_cc = False
+    await reporter.update_report("gpu_test", HealthReport(status=HealthStatus.ERROR, custom_fields=custom_fields))
+    stored = reporter.get_report("gpu_test")
+    assert stored.custom_fields["GPU_0"]._digest
+
+    with patch("healthagent.reporter._digest", wraps=_digest) as digest:
+        report = stored.evolve(details="kernel message")
+        report.custom_fields["GPU_1"] = {"xid": [79]}
+        assert report.fingerprint != stored.fingerprint
+    # The report itself and the replaced value.
+    assert digest.call_count == 2
+    rebuilt = HealthReport(status=HealthStatus.ERROR, message=stored.message, details="kernel message",
+                           custom_fields={**custom_fields, "GPU_1": {"xid": [79]}})
+    assert report.fingerprint == rebuilt.fingerprint
+    assert stored.evolve().fingerprint == stored.fingerprint
+
+    await reporter.update_report("gpu_test", report)
+    updated = reporter.get_report("gpu_test")
+    assert updated.custom_fields["GPU_0"] is stored.custom_fields["GPU_0"]
+    assert updated.custom_fields["GPU_1"] == {"xid": [79]}
+
+
+async def test_report_state_roundtrip():
+    """to_state is JSON compatible and from_state restores the same read-only report."""
+    report = HealthReport(status=HealthStatus.ERROR, message="Xid 79", description="d", details="x",
+                          custom_fields={"GPU_0": {"xids": {79}}}, aux_data={"since": datetime(2026, 1, 1)})
+    restored = HealthReport.from_state(json.loads(json.dumps(report.to_state())))
+    assert restored.frozen
+    assert restored == report.snapshot()
+    assert restored.fingerprint == report.fingerprint
+    assert restored.last_update == report.last_update
+    assert restored.aux_data == {"since": datetime(2026, 1, 1)}
+
+    # Fields unknown to this version are ignored
+    assert HealthReport.from_state({**report.to_state(), "new_field": 1}) == restored
+
+
+async def test_cached_views():
+    """Views of stored reports and the reporter summary are rendered again only after a change."""
+    reporter = Reporter()
+    reporter.publish_cc = False
+    await reporter.update_report("gpu_test", HealthReport(status=HealthStatus.ERROR, custom_fields={"count": 1}))
+    stored = reporter.get_report("gpu_test")
+    view = stored.view()
+    assert stored.view() is view
+    assert stored.view(cli_exclude=False) is not view
+    summary = reporter.summarize()
+    assert summary == {"gpu_test": view}
+    assert reporter.summarize() is summary
+
+    # An unchanged update moves last_update forward, which is part of the view
+    await reporter.update_report("gpu_test", HealthReport(status=HealthStatus.ERROR, custom_fields={"count": 1}))
+    assert reporter.get_report("gpu_test") is not stored
+    assert reporter.get_report("gpu_test").version == stored.version
+    assert reporter.summarize() is not summary
+    assert reporter.get_report("gpu_test").view() is not view
+    assert stored.view() is view
+
+    summary = reporter.summarize()
+    await reporter.update_report("gpu_test", HealthReport(status=HealthStatus.ERROR, custom_fields={"count": 2}))
+    assert reporter.summarize()["gpu_test"]["count"] == 2
+    del reporter.store["gpu_test"]
+    assert reporter.summarize() == {}
+    # Views of reports being built are not cached
+    report = stored.evolve()
+    assert report.view() is not report.view()
+
+
+async def test_changed_since():
+    """Stored reports carry increasing versions, callers can ask for the changes after a version."""
+    reporter = Reporter()
+    reporter.publish_cc = False
+    other = Reporter()
+    other.publish_cc = False
+    await reporter.update_report("gpu_test", HealthReport(status=HealthStatus.ERROR))
+    await reporter.update_report("kmsg_test", HealthReport())
+    first = ReportStore.version
+    assert reporter.get_report("kmsg_test").version == first > reporter.get_report("gpu_test").version > 0
+
+    assert reporter.changed_since(first) == ({}, [])
+    assert set(reporter.changed_since(0)[0]) == {"gpu_test", "kmsg_test"}
+
+    # Only content changes get a new version, not last_update
+    await reporter.update_report("gpu_test", HealthReport(status=HealthStatus.ERROR))
+    assert reporter.changed_since(first) == ({}, [])
+    await reporter.update_report("gpu_test", HealthReport(status=HealthStatus.WARNING))
+    await other.update_report("net_test", HealthReport())
+    changed, removed = reporter.changed_since(first)
+    assert list(changed) == ["gpu_test"] and changed["gpu_test"]["status"] == "Warning"
+    assert reporter.get_report("gpu_test").version < other.get_report("net_test").version
+
+    second = ReportStore.version
+    del reporter.store["kmsg_test"]
+    assert reporter.changed_since(second) == ({}, ["kmsg_test"])
+    reporter.store["kmsg_test"] = HealthReport()
+    assert list(reporter.changed_since(second)[0]) == ["kmsg_test"]
+    assert reporter.changed_since(second)[1] == []
+
+    # Versions keep increasing when the store is restored
+    restored = Reporter.load_reporter_obj(pickle.loads(pickle.dumps(reporter)))
+    assert restored.get_report("gpu_test").version > second
+
+
+async def test_report_events():
+    """Stored changes are streamed to subscribers, a slow subscriber loses its oldest events."""
+    reporter = Reporter()
+    reporter.publish_cc = False
+    reporter.module = "gpu"
+    subscriber = ReportEvents.subscribe()
+    try:
+        await reporter.update_report("gpu_test", HealthReport(status=HealthStatus.ERROR))
+        await reporter.update_report("gpu_test", HealthReport(status=HealthStatus.ERROR))
+        await reporter.update_report("gpu_test", HealthReport())
+        first = await subscriber.get(timeout=1)
+        assert first == {"event": "report", "module": "gpu", "report": "gpu_test", "old_status": None,
+                         "new_status": "Error", "version": first["version"]}
+        second = await subscriber.get(timeout=1)
+        assert (second["old_status"], second["new_status"]) == ("Error", "OK")
+        assert second["version"] == reporter.get_report("gpu_test").version > first["version"]
+        assert await subscriber.get(timeout=0.01) is None
+
+        reporter.remove_report("gpu_test")
+        reporter.remove_report("gpu_test")
+        removed = await subscriber.get(timeout=1)
+        assert removed == {"event": "removed", "module": "gpu", "report": "gpu_test", "old_status": "OK",
+                           "version": reporter.store.removed["gpu_test"]}
+        assert removed["version"] > second["version"]
+        assert await subscriber.get(timeout=0.01) is None
+
+        for i in range(ReportEvents.QUEUE_SIZE + 3):
+            await reporter.update_report("gpu_test", HealthReport(description=str(i)))
+        dropped = await subscriber.get()
+        assert dropped["event"] == "dropped" and dropped["count"] == 3
+        assert (await subscriber.get())["event"] == "report"
+        assert ReportEvents.stats() == {"subscribers": 1, "queued": ReportEvents.QUEUE_SIZE - 1}
+    finally:
+        ReportEvents.unsubscribe(subscriber)
+    # Events queued before unsubscribing are still handed out
+    remaining = 0
+    while await subscriber.get() is not None:
+        remaining += 1
+    assert remaining == ReportEvents.QUEUE_SIZE - 1
+    assert ReportEvents.stats()["subscribers"] == 0
+
+
+def fake_jetpack(path, version):
+    """jetpack stand-in printing `version`, counting its calls in path.calls."""
+    path.write_text(f"#!/bin/sh\necho x >> {path}.calls\necho {version}\n")
+    path.chmod(0o755)
+    return str(path)
+
+
+def jetpack_calls(path) -> int:
+    calls = path.parent / f"{path.name}.calls"
+    return len(calls.read_text().splitlines()) if calls.exists() else 0
+
+
+async def test_probe_jetpack_cached(tmp_path):
+    """The jetpack version is probed once, then cached on disk until the binary changes."""
+    jetpack = tmp_path / "jetpack"
+    cache = str(tmp_path / "jetpack.json")
+    fake_jetpack(jetpack, "8.10.0-3822")
+    Reporter._jetpack_probes = {}
+    try:
+        assert await Reporter.probe_jetpack(str(jetpack), cache_file=cache) == (8, 10, 0)
+        assert await Reporter.probe_jetpack(str(jetpack), cache_file=cache) == (8, 10, 0)
+        assert jetpack_calls(jetpack) == 1
+
+        # eg. a restart of the daemon
+        Reporter._jetpack_probes = {}
+        assert await Reporter.probe_jetpack(str(jetpack), cache_file=cache) == (8, 10, 0)
+        assert jetpack_calls(jetpack) == 1
+
+        # jetpack was upgraded
+        Reporter._jetpack_probes = {}
+        fake_jetpack(jetpack, "8.11.1")
+        os.utime(jetpack, ns=(0, os.stat(jetpack).st_mtime_ns + 10**9))
+        assert await Reporter.probe_jetpack(str(jetpack), cache_file=cache) == (8, 11, 1)
+        assert jetpack_calls(jetpack) == 2
+    finally:
+        Reporter._jetpack_probes = {}
+
+
+async def test_check_jetpack_version(tmp_path):
+    """Reporters share the probe and disable publishing and GHR by the jetpack version."""
+    old = fake_jetpack(tmp_path / "old", "8.7.0")
+    no_ghr = fake_jetpack(tmp_path / "no_ghr", "8.9.0")
+    Reporter._jetpack_probes = {}
+    try:
+        reporters = []
+        for jetpack in (old, no_ghr, no_ghr):
+            reporter = Reporter()
+            reporter.jetpack = jetpack
+            reporter.publish_cc = reporter.enable_ghr = True
+            reporter._jetpack_checked = False
+            reporters.append(reporter)
+        await asyncio.gather(*(reporter.check_jetpack_version() for reporter in reporters))
+        assert [(r.publish_cc, r.enable_ghr) for r in reporters] == [(False, False), (True, False), (True, False)]
+        assert jetpack_calls(tmp_path / "no_ghr") == 1
+    finally:
+        Reporter._jetpack_probes = {}
+
+
 async def test_aux_data_persisted_on_dedup():
     """aux_data should be updated even when visible report fields are unchanged."""
     reporter = Reporter()
@@ -251,6 +593,7 @@ async def test_aux_data_persisted_on_dedup():
 
 async def test_reporter():
 
+    Publisher.reset()
     my_reporter = Reporter()
     my_reporter.publish_cc = True
     # fetch epilog_test report.
@@ -262,10 +605,11 @@ async def test_reporter():
     with patch("healthagent.scheduler.Scheduler.subprocess") as mock_subprocess, \
          patch("healthagent.scheduler.Scheduler.add_task", new_callable=AsyncMock) as mock_add_task:
         mock_subprocess.return_value = "mocked_task"
-        mock_add_task.return_value = None  # or an awaitable if needed
+        mock_add_task.return_value = (0, b"", b"")
 
         report = HealthReport(status=HealthStatus.ERROR, description="epilog failures", details="GPU not available")
         await my_reporter.update_report(name=name,report=report)
+        await Publisher.flush()
         mock_subprocess.assert_called_once()
         mock_add_task.assert_awaited_once()
 
@@ -274,6 +618,7 @@ async def test_reporter():
         mock_add_task.reset_mock()
         # send the same report again, and it should not actually send it since nothing changed.
         await my_reporter.update_report(name=name, report=report)
+        await Publisher.flush()
         mock_subprocess.assert_not_called()
         mock_add_task.assert_not_called()
 
@@ -281,6 +626,7 @@ async def test_reporter():
         mock_subprocess.reset_mock()
         mock_add_task.reset_mock()
         await my_reporter.clear_all_errors(timedelta(hours=1))
+        await Publisher.flush()
         mock_subprocess.assert_not_called()
         mock_add_task.assert_not_called()
 
@@ -290,10 +636,13 @@ async def test_reporter():
         # send an updated report
         ok_report = HealthReport() # defaults to OK
         await my_reporter.update_report(name, report=ok_report)
+        await Publisher.flush()
         mock_subprocess.assert_called_once()
         mock_add_task.assert_awaited_once()
 
+
         await my_reporter.clear_all_errors()
+        await Publisher.flush()
         mock_subprocess.assert_called_once()
         mock_add_task.assert_called_once()
 
@@ -301,10 +650,11 @@ async def test_reporter():
     with patch("healthagent.scheduler.Scheduler.subprocess") as mock_subprocess, \
          patch("healthagent.scheduler.Scheduler.add_task", new_callable=AsyncMock) as mock_add_task:
         mock_subprocess.return_value = "mocked_task"
-        mock_add_task.return_value = None  # or an awaitable if needed
+        mock_add_task.return_value = (0, b"", b"")
 
         report = HealthReport(status=HealthStatus.ERROR, description="prolog failures")
         await my_reporter.update_report("prolog_test",report=report)
+        await Publisher.flush()
         mock_subprocess.assert_called_once()
         mock_add_task.assert_awaited_once()
 
@@ -314,6 +664,7 @@ async def test_reporter():
 
         report = HealthReport(status=HealthStatus.ERROR, description="hardware failures")
         await my_reporter.update_report("hardware_test",report=report)
+        await Publisher.flush()
         mock_subprocess.assert_called_once()
         mock_add_task.assert_awaited_once()
 
@@ -322,6 +673,7 @@ async def test_reporter():
         mock_add_task.reset_mock()
         # clear all the errors
         await my_reporter.clear_all_errors()
+        await Publisher.flush()
         assert mock_subprocess.call_count == 2
         assert mock_add_task.call_count == 2
 
@@ -329,3 +681,132 @@ async def test_reporter():
         assert summary != None
         for test,result in summary.items():
             assert result['status'] == 'OK'
+
+
+async def test_publisher_coalesces_burst():
+    """A burst of changes to one report is published once, with its latest state."""
+    Publisher.reset()
+    Publisher.configure(ReporterConfig(debounce=0.1, jitter=0))
+    reporter = Reporter()
+    reporter.publish_cc = True
+    try:
+        with patch("healthagent.scheduler.Scheduler.subprocess") as mock_subprocess, \
+             patch("healthagent.scheduler.Scheduler.add_task", new_callable=AsyncMock) as mock_add_task:
+            mock_add_task.return_value = (0, b"", b"")
+            for status in (HealthStatus.ERROR, HealthStatus.OK, HealthStatus.WARNING):
+                await reporter.update_report("xid_test", HealthReport(status=status))
+            await reporter.update_report("other_test", HealthReport(status=HealthStatus.ERROR))
+            assert Publisher.stats()["queued"] == 2
+            mock_subprocess.assert_not_called()
+
+            await asyncio.sleep(0.2)
+            assert mock_subprocess.call_count == 2
+            published = {call.args[4]: call.args[6] for call in mock_subprocess.call_args_list}
+            assert published == {"xid_test": "Warning", "other_test": "Error"}
+            stats = Publisher.stats()
+            assert stats["published"] == 2
+            assert stats["coalesced"] == 2
+            assert stats["queued"] == 0
+            assert stats["latency"]["p50"] >= 0.1
+    finally:
+        Publisher.configure(ReporterConfig())
+
+
+async def test_publisher_retries_with_backoff():
+    """A failed publish is retried with backoff, and gives up after max_retries."""
+    Publisher.reset()
+    Publisher.configure(ReporterConfig(debounce=0, jitter=0, retry_backoff=0.05, max_retries=2))
+    reporter = Reporter()
+    reporter.publish_cc = True
+    try:
+        with patch("healthagent.scheduler.Scheduler.subprocess"), \
+             patch("healthagent.scheduler.Scheduler.add_task", new_callable=AsyncMock) as mock_add_task:
+            mock_add_task.side_effect = [(1, b"", b"connection refused"), (0, b"", b"")]
+            await reporter.update_report("retry_test", HealthReport(status=HealthStatus.ERROR))
+            await asyncio.sleep(0.01)
+            assert mock_add_task.await_count == 1
+            assert Publisher.stats()["retries"] == 1
+            await asyncio.sleep(0.1)
+            assert mock_add_task.await_count == 2
+            assert Publisher.stats()["published"] == 1
+
+            mock_add_task.reset_mock()
+            mock_add_task.side_effect = None
+            mock_add_task.return_value = (1, b"", b"")
+            await reporter.update_report("retry_test", HealthReport(status=HealthStatus.OK))
+            # Retried after up to 0.05s and 0.1s, then dropped.
+            await asyncio.sleep(0.3)
+            assert mock_add_task.await_count == 3
+            stats = Publisher.stats()
+            assert stats["failed"] == 1
+            assert stats["queued"] == 0
+    finally:
+        Publisher.configure(ReporterConfig())
+
+
+async def test_publisher_retries_newer_state_with_backoff():
+    """A newer state queued while a publish fails is retried with the backoff, and given up the same way."""
+    Publisher.reset()
+    Publisher.configure(ReporterConfig(debounce=0, jitter=0, retry_backoff=0.1, max_retries=2))
+    reporter = Reporter()
+    reporter.publish_cc = True
+    statuses = iter([HealthStatus.OK, HealthStatus.ERROR, HealthStatus.OK])
+
+    async def failing(*args, **kwargs):
+        # The report flaps while every publish is in flight.
+        status = next(statuses, None)
+        if status is not None:
+            await reporter.update_report("flap_test", HealthReport(status=status))
+        return 1, b"", b"connection refused"
+
+    try:
+        with patch("healthagent.scheduler.Scheduler.subprocess"), \
+             patch("healthagent.scheduler.Scheduler.add_task", side_effect=failing) as mock_add_task:
+            await reporter.update_report("flap_test", HealthReport(status=HealthStatus.ERROR))
+            await asyncio.sleep(0.03)
+            assert mock_add_task.call_count == 1
+            # Not before half the backoff, rather than right after the debounce.
+            await asyncio.sleep(0.01)
+            assert mock_add_task.call_count == 1
+            await asyncio.sleep(0.3)
+            assert mock_add_task.call_count == 3
+            stats = Publisher.stats()
+            assert stats["retries"] == 2
+            assert stats["failed"] == 1
+            assert stats["queued"] == 0
+    finally:
+        Publisher.configure(ReporterConfig())
+
+
+async def test_publisher_rate_limit_errors_first():
+    """Publishes beyond the burst wait for tokens, ERROR states ahead of OK recoveries."""
+    Publisher.reset()
+    Publisher.configure(ReporterConfig(debounce=0, jitter=0, rate=20, burst=1))
+    reporter = Reporter()
+    reporter.publish_cc = True
+    try:
+        with patch("healthagent.scheduler.Scheduler.subprocess") as mock_subprocess, \
+             patch("healthagent.scheduler.Scheduler.add_task", new_callable=AsyncMock) as mock_add_task:
+            mock_add_task.return_value = (0, b"", b"")
+            await reporter.update_report("first", HealthReport(status=HealthStatus.OK))
+            await reporter.update_report("recovered", HealthReport(status=HealthStatus.OK))
+            await reporter.update_report("warned", HealthReport(status=HealthStatus.WARNING))
+            await reporter.update_report("failed", HealthReport(status=HealthStatus.ERROR))
+            await asyncio.sleep(0.01)
+            assert [call.args[4] for call in mock_subprocess.call_args_list] == ["first"]
+            assert Publisher.stats()["waiting_for_token"] == 3
+            await asyncio.sleep(0.2)
+            order = [call.args[4] for call in mock_subprocess.call_args_list]
+            assert order == ["first", "failed", "warned", "recovered"]
+            assert Publisher.stats()["throttled"] >= 3
+    finally:
+        Publisher.configure(ReporterConfig())
+
+
+def test_publisher_jitter_seeded_by_hostname():
+    """The jitter sequence is the same on every restart of a node, and differs between nodes."""
+    def draws(hostname):
+        rng = _node_rng(hostname)
+        return [rng.uniform(0, 5) for _ in range(3)]
+    assert draws("ccw-gpu-1") == draws("ccw-gpu-1")
+    assert draws("ccw-gpu-1") != draws("ccw-gpu-2")
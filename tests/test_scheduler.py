@@ -1,12 +1,14 @@
 import asyncio
 from time import time, sleep, perf_counter
-from healthagent.scheduler import Scheduler
+from healthagent.scheduler import Scheduler, ResourceLock, SingleFlight, TaskTimeout
+from healthagent.config import SchedulerConfig
+from healthagent import healthcheck
 import signal
 import os
 import sys
+import threading
 import functools
 import pytest
-import functools
 
 
 @Scheduler.periodic(5)
@@ -65,7 +67,15 @@ def on_demand_task(sleep_t: int = 1):
 def on_demand_timed_task(sleep_t: float = 1):
 
     # Record wall-clock start/end so the parent can verify pool tasks
-    # do not overlap (i.e. they are serialized by _pool_lock).
+    # do not overlap (i.e. they are serialized by _pool_locks).
+    start = time()
+    sleep(sleep_t)
+    end = time()
+    return (start, end)
+
+@Scheduler.pool(resource="gpu", key="gpu_id")
+def gpu_timed_task(gpu_id: list = None, sleep_t: float = 1):
+
     start = time()
     sleep(sleep_t)
     end = time()
@@ -152,8 +162,9 @@ async def test_pool_kwargs():
 
 async def test_pool_serialized():
     """
-    Tests that concurrently scheduled @Scheduler.pool tasks are serialized by
-    _pool_lock and do not overlap, even though each runs in its own process.
+    Tests that concurrently scheduled @Scheduler.pool tasks without a declared
+    resource are serialized by _pool_locks and do not overlap, even though
+    several worker processes are available.
     """
 
     Scheduler.start()
@@ -170,6 +181,160 @@ async def test_pool_serialized():
     assert second[0] >= first[1]
 
 
+def overlaps(run1, run2):
+    first, second = sorted([run1, run2])
+    return second[0] < first[1]
+
+async def test_pool_disjoint_resources_parallel():
+    """
+    Tests that pool tasks declaring disjoint gpu sets run concurrently.
+    """
+
+    Scheduler.start()
+    Scheduler.warm_pool(__name__)
+    t1 = Scheduler.add_task(gpu_timed_task, gpu_id=[0, 1], sleep_t=2)
+    t2 = Scheduler.add_task(gpu_timed_task, gpu_id=["2", "3"], sleep_t=2)
+    run1, run2 = await asyncio.gather(t1, t2)
+    Scheduler.stop()
+    assert overlaps(run1, run2)
+
+async def test_pool_overlapping_resources_serialized():
+    """
+    Tests that pool tasks sharing a gpu, or claiming all gpus, are serialized.
+    """
+
+    Scheduler.start()
+    t1 = Scheduler.add_task(gpu_timed_task, gpu_id=[0, 1], sleep_t=1)
+    t2 = Scheduler.add_task(gpu_timed_task, gpu_id=["1"], sleep_t=1)
+    t3 = Scheduler.add_task(gpu_timed_task, sleep_t=1)
+    run1, run2, run3 = await asyncio.gather(t1, t2, t3)
+    Scheduler.stop()
+    assert not overlaps(run1, run2)
+    assert not overlaps(run1, run3)
+    assert not overlaps(run2, run3)
+
+def test_pool_resources():
+
+    keys = Scheduler._pool_resources(gpu_timed_task, ([0, "1"],), {})
+    assert keys == frozenset({("gpu", "0"), ("gpu", "1")})
+    keys = Scheduler._pool_resources(gpu_timed_task, (), {"gpu_id": None})
+    assert keys == frozenset({("gpu", None)})
+    keys = Scheduler._pool_resources(on_demand_task, (1,), {})
+    assert keys == frozenset({ResourceLock.EVERYTHING})
+
+async def test_resource_lock_fifo():
+    """
+    Tests that a blocked claim is not starved by later claims that
+    conflict with it.
+    """
+
+    lock = ResourceLock()
+    order = []
+    gpu0 = await lock.acquire({("gpu", "0")})
+
+    async def claim(name, keys):
+        async with lock.hold(keys):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    everything = asyncio.create_task(claim("all", {("gpu", None)}))
+    await asyncio.sleep(0)
+    later = asyncio.create_task(claim("gpu1", {("gpu", "1")}))
+    other = asyncio.create_task(claim("nic", {("nic", "0")}))
+    await asyncio.sleep(0.01)
+    # nic does not conflict with anything and goes straight through,
+    # gpu1 must wait behind the earlier claim on all gpus.
+    assert order == ["nic"]
+    lock.release(gpu0)
+    await asyncio.gather(everything, later, other)
+    assert order == ["nic", "all", "gpu1"]
+    assert lock.held() == []
+
+async def test_resource_lock_shared():
+    """
+    Tests that shared claims of a key are granted together and exclude exclusive claims of it.
+    """
+
+    lock = ResourceLock()
+    assert ResourceLock.keys("gpu", "0, 1".split(",")) == frozenset({("gpu", "0"), ("gpu", "1")})
+    assert ResourceLock.keys("proc", shared=True) == frozenset({("proc", None, ResourceLock.SHARED)})
+    reader = ResourceLock.keys("proc", shared=True)
+    first = await lock.acquire(reader)
+    second = await asyncio.wait_for(lock.acquire(reader), timeout=1)
+    writer = asyncio.create_task(lock.acquire(ResourceLock.keys("proc", "1")))
+    await asyncio.sleep(0.01)
+    assert not writer.done()
+    lock.release(first)
+    lock.release(second)
+    lock.release(await asyncio.wait_for(writer, timeout=1))
+    assert ResourceLock.conflicts(reader, frozenset([ResourceLock.EVERYTHING]))
+    assert lock.held() == []
+
+async def test_single_flight():
+    """
+    Tests that identical calls share one run while it is in flight, and its result for ttl seconds.
+    """
+
+    flight = SingleFlight()
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return len(runs)
+
+    results = await asyncio.gather(*(flight.run(("epilog", None), work, ttl=0.1) for _ in range(3)))
+    assert results == [1, 1, 1] and len(runs) == 1
+    assert await flight.run(("epilog", None), work, ttl=0.1) == 1
+    assert await flight.run(("prolog", None), work) == 2
+    await asyncio.sleep(0.15)
+    assert await flight.run(("epilog", None), work, ttl=0.1) == 3
+    assert flight.stats() == {"in_flight": 0, "cached": 1, "executed": 3, "joined": 2, "reused": 1}
+
+    # Exceptions are shared, not kept
+    async def fail():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("failed")
+
+    results = await asyncio.gather(flight.run("fail", fail, ttl=10), flight.run("fail", fail, ttl=10),
+                                   return_exceptions=True)
+    assert [type(r) for r in results] == [RuntimeError, RuntimeError]
+    with pytest.raises(RuntimeError):
+        await flight.run("fail", fail, ttl=10)
+    assert flight.stats()["cached"] == 1
+
+async def test_single_flight_deadline():
+    """
+    Tests that a call is not joined by callers needing the result before its deadline,
+    and that a caller going away does not cancel it for the others.
+    """
+
+    flight = SingleFlight()
+    runs = []
+
+    async def work():
+        runs.append(Scheduler.time_remaining())
+        run = len(runs)
+        await asyncio.sleep(0.05)
+        return run
+
+    async def call(deadline):
+        with Scheduler.deadline(deadline):
+            return await flight.run("epilog", work)
+
+    assert await asyncio.gather(call(10), call(1)) == [1, 2]
+    assert await asyncio.gather(call(1), call(10), call(None)) == [3, 3, 3]
+    # The run has the deadline of the first caller
+    assert runs[2] is not None and runs[2] <= 1
+
+    first = asyncio.create_task(call(None))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(call(None))
+    await asyncio.sleep(0.01)
+    first.cancel()
+    assert await second == 4
+
 async def test_on_demand():
 
     # This should not submit anything because scheduler is not initialized
@@ -250,4 +415,712 @@ async def test_signal_handling():
     # validate no more tasks can be submitted
     # This should not submit anything because scheduler is not initialized
     rc = Scheduler.add_task(on_demand_task)
-    assert rc == None
\ No newline at end of file
+    assert rc == None
+
+@Scheduler.pool
+def pool_worker_pid():
+
+    return os.getpid()
+
+@Scheduler.pool
+def pool_worker_crash():
+
+    os._exit(1)
+
+async def test_pool_worker_reused():
+    """
+    Tests that pool tasks run on a long-lived worker process instead of
+    spawning a fresh process per task.
+    """
+
+    Scheduler.start()
+    Scheduler.warm_pool(__name__)
+    pid1 = await Scheduler.add_task(pool_worker_pid)
+    pid2 = await Scheduler.add_task(pool_worker_pid)
+    assert pid1 == pid2
+    assert pid1 != os.getpid()
+    Scheduler.stop()
+    assert not Scheduler._pool_workers
+
+async def test_pool_worker_recycled(monkeypatch):
+    """
+    Tests that a worker is replaced after POOL_MAX_TASKS_PER_WORKER tasks
+    and after it crashes.
+    """
+
+    monkeypatch.setattr(Scheduler, "POOL_MAX_TASKS_PER_WORKER", 2)
+    Scheduler.start()
+    pid1 = await Scheduler.add_task(pool_worker_pid)
+    pid2 = await Scheduler.add_task(pool_worker_pid)
+    pid3 = await Scheduler.add_task(pool_worker_pid)
+    assert pid1 == pid2
+    assert pid3 != pid2
+
+    with pytest.raises(Exception):
+        await Scheduler.add_task(pool_worker_crash)
+    # Next task gets a fresh worker
+    pid4 = await Scheduler.add_task(pool_worker_pid)
+    assert pid4 != pid3
+    assert len(Scheduler._pool_workers) == 1
+    Scheduler.stop()
+
+@Scheduler.periodic(0.2, fixed_rate=True)
+async def fixed_rate_task(starts: list, run_time: float = 0.05):
+
+    starts.append(asyncio.get_running_loop().time())
+    await asyncio.sleep(run_time)
+
+@Scheduler.periodic(0.2)
+async def fixed_delay_task(starts: list, run_time: float = 0.05):
+
+    starts.append(asyncio.get_running_loop().time())
+    await asyncio.sleep(run_time)
+
+@Scheduler.periodic(0.1, fixed_rate=True)
+async def overrun_skip_task(starts: list):
+
+    starts.append(asyncio.get_running_loop().time())
+    if len(starts) == 1:
+        await asyncio.sleep(0.25)
+
+@Scheduler.periodic(0.1, fixed_rate=True, catchup=Scheduler.COALESCE)
+async def overrun_coalesce_task(starts: list):
+
+    starts.append(asyncio.get_running_loop().time())
+    if len(starts) == 1:
+        await asyncio.sleep(0.25)
+
+@Scheduler.periodic(0.2, fixed_rate=True, jitter=0.1)
+async def jittered_task(starts: list):
+
+    starts.append(asyncio.get_running_loop().time())
+
+async def test_fixed_rate_no_drift():
+    """
+    Tests fixed-rate tasks run on absolute deadlines while fixed-delay
+    tasks drift by their own runtime.
+    """
+
+    Scheduler.start()
+    fixed, delayed = [], []
+    Scheduler.add_task(fixed_rate_task, fixed)
+    Scheduler.add_task(fixed_delay_task, delayed)
+    await asyncio.sleep(0.9)
+    Scheduler.stop()
+    assert len(fixed) == 5
+    for i, start in enumerate(fixed):
+        assert abs(start - fixed[0] - i * 0.2) < 0.04
+    assert len(delayed) == 4
+    for prev, nxt in zip(delayed, delayed[1:]):
+        assert nxt - prev >= 0.25
+
+async def test_fixed_rate_overrun_skip():
+
+    Scheduler.start()
+    starts = []
+    Scheduler.add_task(overrun_skip_task, starts)
+    await asyncio.sleep(0.35)
+    Scheduler.stop()
+    # Deadlines at 0.1 and 0.2 passed while the first run slept, the next
+    # run waits for the 0.3 deadline.
+    assert len(starts) == 2
+    assert abs(starts[1] - starts[0] - 0.3) < 0.02
+    assert Scheduler.missed_ticks()["overrun_skip_task"] == 2
+
+async def test_fixed_rate_overrun_coalesce():
+
+    Scheduler.start()
+    starts = []
+    Scheduler.add_task(overrun_coalesce_task, starts)
+    await asyncio.sleep(0.33)
+    Scheduler.stop()
+    # Missed deadlines are coalesced into one run right after the overrun,
+    # then the task is back on its 0.1s grid.
+    assert len(starts) == 3
+    assert abs(starts[1] - starts[0] - 0.25) < 0.02
+    assert abs(starts[2] - starts[0] - 0.3) < 0.02
+    assert Scheduler.missed_ticks()["overrun_coalesce_task"] == 1
+
+async def test_periodic_jitter():
+
+    Scheduler.start()
+    starts = []
+    Scheduler.add_task(jittered_task, starts)
+    await asyncio.sleep(0.75)
+    Scheduler.stop()
+    phase = starts[1] - starts[0] - 0.2
+    assert 0 <= phase <= 0.1 + 0.01
+    # Phase is applied once, later runs stay on the shifted grid.
+    for prev, nxt in zip(starts[1:], starts[2:]):
+        assert abs(nxt - prev - 0.2) < 0.02
+
+def test_periodic_invalid_catchup():
+
+    with pytest.raises(ValueError):
+        Scheduler.periodic(1, fixed_rate=True, catchup="bogus")
+
+async def failing_task():
+
+    raise RuntimeError("boom")
+
+async def test_scheduler_stats():
+    """
+    Tests that the task registry records runs, exceptions and latency
+    for periodic, on-demand and pool tasks.
+    """
+
+    Scheduler.start()
+    starts = []
+    Scheduler.add_task(fixed_rate_task, starts, 0.01)
+    await Scheduler.add_task(async_task_kwargs, value=2)
+    await Scheduler.add_task(async_task_kwargs, value=3)
+    await Scheduler.add_task(failing_task)
+    await Scheduler.add_task(on_demand_task_kwargs, value=2)
+    await asyncio.sleep(0.3)
+    stats = Scheduler.stats()["tasks"]
+    Scheduler.stop()
+
+    periodic = stats["fixed_rate_task"]
+    assert periodic["kind"] == "periodic"
+    assert periodic["interval"] == 0.2
+    assert periodic["run_count"] == len(starts) >= 2
+    assert periodic["next_due"] is not None
+    assert periodic["latency"]["count"] == len(starts)
+    assert periodic["latency"]["p50"] >= 0.01
+
+    on_demand = stats["async_task_kwargs"]
+    assert on_demand["kind"] == "on-demand"
+    assert on_demand["run_count"] == 2
+    assert on_demand["exception_count"] == 0
+    assert on_demand["last_start"] is not None
+
+    assert stats["failing_task"]["exception_count"] == 1
+    assert stats["on_demand_task_kwargs"]["kind"] == "pool"
+    assert stats["on_demand_task_kwargs"]["run_count"] == 1
+
+@Scheduler.periodic(0.1)
+async def counted_task(runs: list, run_time: float = 0):
+
+    runs.append(asyncio.get_running_loop().time())
+    await asyncio.sleep(run_time)
+
+@Scheduler.periodic(0.05)
+async def self_cancel_task(runs: list, limit: int):
+
+    runs.append(asyncio.get_running_loop().time())
+    if len(runs) >= limit:
+        Scheduler.cancel_task()
+
+async def test_cancel_task_targets_caller():
+    """
+    Tests that a periodic task cancelling itself does not cancel the
+    rescheduling of other periodic tasks.
+    """
+
+    Scheduler.start()
+    cancelled, other = [], []
+    Scheduler.add_task(self_cancel_task, cancelled, 2)
+    Scheduler.add_task(counted_task, other)
+    await asyncio.sleep(0.45)
+    stats = Scheduler.stats()["tasks"]
+    Scheduler.stop()
+    assert len(cancelled) == 2
+    assert len(other) >= 4
+    assert stats["self_cancel_task"]["state"] == "cancelled"
+    assert stats["counted_task"]["state"] in ("scheduled", "running")
+
+async def test_pause_resume_task():
+
+    Scheduler.start()
+    runs = []
+    Scheduler.add_task(counted_task, runs)
+    await asyncio.sleep(0.15)
+    Scheduler.pause_task("counted_task")
+    paused_at = len(runs)
+    assert Scheduler.stats()["tasks"]["counted_task"]["state"] == "paused"
+    await asyncio.sleep(0.3)
+    assert len(runs) == paused_at
+    Scheduler.resume_task("counted_task")
+    # A resumed task runs right away
+    await asyncio.sleep(0.01)
+    assert len(runs) == paused_at + 1
+    await asyncio.sleep(0.15)
+    assert len(runs) == paused_at + 2
+    Scheduler.stop()
+
+async def test_reschedule_task():
+
+    Scheduler.start()
+    runs = []
+    Scheduler.add_task(counted_task, runs)
+    await asyncio.sleep(0.05)
+    Scheduler.reschedule_task("counted_task", 0.3)
+    await asyncio.sleep(0.7)
+    Scheduler.stop()
+    # first run, then every 0.3s from the reschedule
+    assert len(runs) == 3
+    assert 0.3 <= runs[2] - runs[1] <= 0.35
+    with pytest.raises(KeyError):
+        Scheduler.reschedule_task("no_such_task", 1)
+
+async def test_cancel_task_by_name():
+    """
+    Tests that cancelling a task by name cancels its run in progress
+    and that a cancelled task can be resumed.
+    """
+
+    Scheduler.start()
+    runs = []
+    task = Scheduler.add_task(counted_task, runs, run_time=1)
+    await asyncio.sleep(0.05)
+    response = Scheduler.control_task("counted_task", "cancel")
+    assert response["tasks"]["counted_task"]["state"] == "cancelled"
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await asyncio.sleep(0.2)
+    assert len(runs) == 1
+    Scheduler.control_task("counted_task", "resume")
+    await asyncio.sleep(0.01)
+    assert len(runs) == 2
+    with pytest.raises(ValueError):
+        Scheduler.control_task("counted_task", "restart")
+    with pytest.raises(RuntimeError):
+        Scheduler.cancel_task()
+    Scheduler.cancel_task("counted_task")
+    Scheduler.stop()
+
+@Scheduler.periodic(0.1, lane=Scheduler.INTERACTIVE)
+async def interactive_lane_task(runs: list):
+
+    runs.append(asyncio.get_running_loop().time())
+
+async def test_background_deferred_while_interactive():
+    """
+    Tests that background periodic runs are deferred while an interactive
+    request is in flight and run once, right after it finishes.
+    """
+
+    Scheduler.start()
+    background, interactive = [], []
+    Scheduler.add_task(counted_task, background)
+    Scheduler.add_task(interactive_lane_task, interactive)
+    await asyncio.sleep(0.05)
+    with Scheduler.interactive():
+        with Scheduler.interactive():
+            await asyncio.sleep(0.2)
+        # still in flight
+        await asyncio.sleep(0.2)
+        assert len(background) == 1
+        assert Scheduler.stats()["lanes"]["background"]["deferred"] == ["counted_task"]
+        assert Scheduler.stats()["tasks"]["counted_task"]["state"] == "deferred"
+    await asyncio.sleep(0.01)
+    stats = Scheduler.stats()
+    Scheduler.stop()
+    # one coalesced run after the interactive requests, instead of three
+    assert len(background) == 2
+    assert background[1] - background[0] >= 0.4
+    # the interactive lane was never deferred
+    assert len(interactive) >= 4
+    assert stats["tasks"]["counted_task"]["deferred"] == 1
+    wait = stats["lanes"]["background"]["wait"]
+    assert wait["count"] == 1
+    assert 0.3 <= wait["max"] <= 0.4
+    assert stats["lanes"]["interactive"]["in_flight"] == 0
+
+async def test_resource_lock_priority():
+    """
+    Tests that priority claims are granted ahead of earlier non-priority claims.
+    """
+
+    lock = ResourceLock()
+    order = []
+    gpu0 = await lock.acquire({("gpu", "0")})
+
+    async def claim(name, keys, priority=False):
+        async with lock.hold(keys, priority=priority):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    background = asyncio.create_task(claim("background", {("gpu", "0")}))
+    await asyncio.sleep(0)
+    epilog = asyncio.create_task(claim("epilog", {("gpu", None)}, priority=True))
+    await asyncio.sleep(0)
+    # does not conflict with the held gpu but is queued behind the priority claim on all gpus
+    later = asyncio.create_task(claim("gpu1", {("gpu", "1")}))
+    await asyncio.sleep(0.01)
+    assert order == []
+    lock.release(gpu0)
+    await asyncio.gather(background, epilog, later)
+    assert order == ["epilog", "background", "gpu1"]
+
+@Scheduler.timeout(0.1)
+async def slow_task(sleep_t: float = 1):
+
+    await asyncio.sleep(sleep_t)
+    return sleep_t
+
+async def remaining_task():
+
+    return Scheduler.time_remaining()
+
+@Scheduler.timeout(0.5)
+@Scheduler.pool
+def slow_pool_task(sleep_t: float = 5):
+
+    sleep(sleep_t)
+    return os.getpid()
+
+class TimeoutModule:
+
+    def __init__(self):
+        self.timeouts = []
+
+    async def report_timeout(self, report_name, timeout):
+        self.timeouts.append((report_name, timeout))
+
+    @healthcheck("SlowCheck")
+    @Scheduler.timeout(0.05)
+    @Scheduler.periodic(0.1)
+    async def slow_check(self):
+        await asyncio.sleep(1)
+
+async def test_task_timeout():
+
+    Scheduler.start()
+    # Times out, is logged and counted rather than hanging
+    assert await Scheduler.add_task(slow_task) is None
+    assert await Scheduler.add_task(slow_task, 0.01) == 0.01
+    info = Scheduler.stats()["tasks"]["slow_task"]
+    assert info["timeout_count"] == 1
+    assert info["exception_count"] == 0
+    assert info["run_count"] == 2
+    Scheduler.stop()
+
+async def test_periodic_timeout_reported():
+    """
+    Tests that a periodic check that times out is rescheduled and its
+    module is asked to record the timeout in the check's report.
+    """
+
+    Scheduler.start()
+    module = TimeoutModule()
+    Scheduler.add_task(module.slow_check)
+    await asyncio.sleep(0.3)
+    Scheduler.cancel_task("TimeoutModule.slow_check")
+    Scheduler.stop()
+    assert len(module.timeouts) == 2
+    assert module.timeouts[0] == ("SlowCheck", 0.05)
+
+async def test_config_timeout(monkeypatch):
+
+    # restored after the test
+    monkeypatch.setattr(Scheduler, "_timeouts", {})
+    monkeypatch.setattr(Scheduler, "SUBPROCESS_TIMEOUT", Scheduler.SUBPROCESS_TIMEOUT)
+    Scheduler.start()
+    Scheduler.configure(SchedulerConfig(subprocess_timeout=0.2, timeouts={"slow_task": 2}))
+    # Config takes precedence over the decorator
+    assert await Scheduler.add_task(slow_task, 0.3) == 0.3
+    proc = await Scheduler.add_task(Scheduler.subprocess("/bin/sleep", "5"))
+    await proc.communicate()
+    assert proc.timed_out
+    Scheduler.stop()
+
+async def test_deadline():
+    """
+    Tests that tasks started within a deadline are bounded by the time left.
+    """
+
+    Scheduler.start()
+    assert await Scheduler.add_task(remaining_task) is None
+    with Scheduler.deadline(0.5):
+        remaining = await Scheduler.add_task(remaining_task)
+        assert 0.4 < remaining <= 0.5
+        with Scheduler.deadline(10):
+            # cannot extend the outer deadline
+            assert Scheduler.time_remaining() <= 0.5
+        # The task's own timeout is shorter than the deadline
+        assert await Scheduler.add_task(slow_task, 0.3) is None
+    with Scheduler.deadline(0.05):
+        assert await Scheduler.add_task(async_task_kwargs, 2, 3) == 6
+        assert await Scheduler.add_task(slow_task, 0.08) is None
+    assert Scheduler.time_remaining() is None
+    Scheduler.stop()
+
+async def test_pool_task_timeout():
+    """
+    Tests that a pool task that times out raises TaskTimeout and its
+    worker process is killed.
+    """
+
+    Scheduler.start()
+    Scheduler.warm_pool(__name__)
+    pid = await Scheduler.add_task(pool_worker_pid)
+    with pytest.raises(TaskTimeout):
+        await Scheduler.add_task(slow_pool_task)
+    await asyncio.sleep(0.5)
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
+    assert await Scheduler.add_task(pool_worker_pid) != pid
+    assert Scheduler.stats()["tasks"]["slow_pool_task"]["timeout_count"] == 1
+    Scheduler.stop()
+
+async def test_pool_task_cancelled_from_outside():
+    """
+    Tests that a pool task cancelled by its caller (eg. a module timeout) has its worker
+    killed before its resources are released, so the next task on them runs right away.
+    """
+
+    Scheduler.start()
+    Scheduler.warm_pool(__name__)
+    pid = await Scheduler.add_task(pool_worker_pid)
+    with pytest.raises(TimeoutError):
+        async with asyncio.timeout(0.5):
+            await Scheduler.add_task(gpu_timed_task, gpu_id=[0], sleep_t=3)
+    await asyncio.sleep(0.5)
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
+    start = time()
+    run = await Scheduler.add_task(gpu_timed_task, gpu_id=[0], sleep_t=0.1)
+    assert run[1] - start < 2
+    Scheduler.stop()
+
+async def test_subprocess_timeout():
+
+    Scheduler.start()
+    proc = await Scheduler.add_task(Scheduler.subprocess("/bin/sleep", "5", timeout=0.2))
+    start = perf_counter()
+    await proc.communicate()
+    assert perf_counter() - start < 1
+    assert proc.timed_out
+    assert proc.returncode == -signal.SIGKILL
+    assert Scheduler.stats()["tasks"]["subprocess[sleep]"]["timeout_count"] == 1
+    proc = await Scheduler.add_task(Scheduler.subprocess("/bin/true"))
+    await proc.communicate()
+    assert not proc.timed_out
+    Scheduler.stop()
+
+async def test_subprocess_concurrency_limit(monkeypatch):
+    """
+    Tests that at most SUBPROCESS_MAX_CONCURRENCY subprocesses run at once,
+    the rest are queued, and finished children are reaped and accounted.
+    """
+
+    monkeypatch.setattr(Scheduler, "SUBPROCESS_MAX_CONCURRENCY", 2)
+    monkeypatch.setattr(Scheduler, "SUBPROCESS_SAMPLE_INTERVAL", 0.05)
+    Scheduler.start()
+    start = perf_counter()
+    tasks = [Scheduler.add_task(Scheduler.subprocess("/bin/sleep", "0.3")) for _ in range(4)]
+    await asyncio.sleep(0.1)
+    subprocesses = Scheduler.stats()["subprocesses"]
+    assert subprocesses == {"running": 2, "queued": 2, "limit": 2}
+    procs = await asyncio.gather(*tasks)
+    # the last two only start once the first two exit
+    assert perf_counter() - start >= 0.3
+    assert [await proc.wait() for proc in procs] == [0, 0, 0, 0]
+    assert perf_counter() - start >= 0.6
+    await asyncio.sleep(0.05)
+    stats = Scheduler.stats()
+    assert stats["subprocesses"] == {"running": 0, "queued": 0, "limit": 2}
+    info = stats["tasks"]["subprocess[sleep]"]
+    assert info["run_count"] == 4
+    assert info["last_returncode"] == 0
+    assert info["latency"]["p50"] >= 0.3
+    assert info["peak_rss"]["count"] == 4
+    assert info["peak_rss"]["max"] > 0
+    Scheduler.stop()
+
+async def test_subprocess_interactive_priority(monkeypatch):
+    """
+    Tests that subprocesses of interactive requests get the next free slot ahead
+    of queued background ones, and that reaping does not pile up waiter tasks.
+    """
+
+    monkeypatch.setattr(Scheduler, "SUBPROCESS_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(Scheduler, "SUBPROCESS_SAMPLE_INTERVAL", 0.02)
+    Scheduler.start()
+    started = []
+
+    async def run(name):
+        proc = await Scheduler.add_task(Scheduler.subprocess("/bin/sleep", "0.2"))
+        started.append(name)
+        return proc
+
+    first = asyncio.create_task(run("first"))
+    await asyncio.sleep(0.05)
+    tasks = len(asyncio.all_tasks())
+    background = asyncio.create_task(run("background"))
+    await asyncio.sleep(0.05)
+    with Scheduler.interactive():
+        interactive = asyncio.create_task(run("interactive"))
+    # The reaper of the first subprocess polls it every 20ms
+    await asyncio.sleep(0.1)
+    assert len(asyncio.all_tasks()) <= tasks + 4
+    procs = await asyncio.gather(first, background, interactive)
+    for proc in procs:
+        await proc.wait()
+    Scheduler.stop()
+    assert started == ["first", "interactive", "background"]
+
+async def test_subprocess_wait():
+
+    Scheduler.start()
+    rc, stdout, _ = await Scheduler.add_task(Scheduler.subprocess("/bin/echo", "hello", wait=True))
+    assert rc == 0
+    assert stdout.decode().strip() == "hello"
+    rc, _, _ = await Scheduler.add_task(Scheduler.subprocess("/bin/false", wait=True))
+    assert rc == 1
+    with pytest.raises(TaskTimeout):
+        await Scheduler.add_task(Scheduler.subprocess("/bin/sleep", "5", timeout=0.1, wait=True))
+    await asyncio.sleep(0.05)
+    tasks = Scheduler.stats()["tasks"]
+    assert tasks["subprocess[false]"]["exception_count"] == 1
+    assert tasks["subprocess[sleep]"]["timeout_count"] == 1
+    assert tasks["subprocess[sleep]"]["exception_count"] == 0
+    Scheduler.stop()
+
+async def blocking_task(sleep_t: float):
+
+    # Blocks the event loop.
+    sleep(sleep_t)
+
+async def test_loop_monitor_stall_attribution():
+    """
+    Tests that an event loop stall is measured and attributed to the
+    task that blocked the loop.
+    """
+
+    Scheduler.start()
+    monitor = Scheduler.start_loop_monitor(stall_threshold=0.3)
+    await asyncio.sleep(0.3)
+    await Scheduler.add_task(blocking_task, 0.8)
+    await asyncio.sleep(0.5)
+    stats = Scheduler.stats()["loop"]
+    Scheduler.stop()
+
+    assert Scheduler.loop_monitor is None
+    assert monitor._task is None
+    assert stats["stall_count"] == 1
+    assert stats["stalls_by_task"] == {"blocking_task": 1}
+    stall = stats["recent_stalls"][0]
+    assert stall["lag"] >= 0.3
+    assert any("blocking_task" in frame for frame in stall["stack"])
+    assert stats["lag"]["count"] >= 2
+    assert sum(stats["histogram"].values()) == stats["lag"]["count"]
+
+class ThreadModule:
+
+    def __init__(self):
+        self.active = 0
+        self.overlap = False
+
+    @Scheduler.thread(pool="test")
+    def blocking_read(self, sleep_t: float = 0.2):
+        # Not thread-safe, concurrent calls on the same object must not overlap.
+        self.active += 1
+        self.overlap = self.overlap or self.active > 1
+        sleep(sleep_t)
+        self.active -= 1
+        return threading.current_thread().name
+
+@Scheduler.thread(pool="test", serialize=False)
+def unserialized_read(sleep_t: float = 0.2):
+    sleep(sleep_t)
+
+async def test_thread_task():
+    """
+    Tests that thread tasks run on their named pool without blocking the
+    event loop, and that calls on the same object are serialized.
+    """
+
+    Scheduler.start()
+    first, second = ThreadModule(), ThreadModule()
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(perf_counter())
+            await asyncio.sleep(0.02)
+
+    ticking = asyncio.create_task(ticker())
+    start = perf_counter()
+    names = await asyncio.gather(Scheduler.add_task(first.blocking_read),
+                                 Scheduler.run_in_thread(first.blocking_read),
+                                 Scheduler.run_in_thread(second.blocking_read))
+    elapsed = perf_counter() - start
+    ticking.cancel()
+    stats = Scheduler.stats()
+    Scheduler.stop()
+
+    assert all(name.startswith("healthagent-test") for name in names)
+    assert not first.overlap
+    # Two serialized calls on `first`, `second` runs alongside them.
+    assert 0.4 <= elapsed < 0.6
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.1
+    pool = stats["threads"]["test"]
+    assert pool["workers"] == Scheduler.THREAD_POOL_MAX_WORKERS
+    assert pool["completed"] == 3
+    assert pool["running"] == 0 and pool["queued"] == 0
+    assert stats["tasks"]["ThreadModule.blocking_read"]["kind"] == "thread"
+    assert stats["tasks"]["ThreadModule.blocking_read"]["run_count"] == 3
+
+async def test_thread_task_pool_size():
+    """
+    Tests that a thread pool runs at most its configured number of tasks at once.
+    """
+
+    Scheduler.start()
+    Scheduler.configure(SchedulerConfig(thread_pools={"test": 1}))
+    try:
+        start = perf_counter()
+        await asyncio.gather(Scheduler.run_in_thread(unserialized_read),
+                             Scheduler.run_in_thread(unserialized_read))
+        elapsed = perf_counter() - start
+        pool = Scheduler.stats()["threads"]["test"]
+    finally:
+        Scheduler.configure(SchedulerConfig())
+        Scheduler.stop()
+    assert elapsed >= 0.4
+    assert pool["workers"] == 1
+    assert pool["wait"]["max"] >= 0.15
+
+async def test_thread_task_timeout():
+    """
+    Tests that a timed out thread task raises TaskTimeout while its thread
+    keeps the object locked until it completes.
+    """
+
+    Scheduler.start()
+    module = ThreadModule()
+    with pytest.raises(TaskTimeout):
+        with Scheduler.deadline(0.1):
+            await Scheduler.run_in_thread(module.blocking_read, 0.3)
+    start = perf_counter()
+    await Scheduler.run_in_thread(module.blocking_read, 0)
+    waited = perf_counter() - start
+    stats = Scheduler.stats()["tasks"]["ThreadModule.blocking_read"]
+    Scheduler.stop()
+    assert not module.overlap
+    assert waited >= 0.1
+    assert stats["timeout_count"] == 1
+
+async def test_thread_task_lock_wait_timeout():
+    """
+    Tests that waiting for the serialization lock counts towards the timeout
+    of a thread task.
+    """
+
+    Scheduler.start()
+    module = ThreadModule()
+    running = asyncio.create_task(Scheduler.run_in_thread(module.blocking_read, 0.5))
+    await asyncio.sleep(0.05)
+    start = perf_counter()
+    with pytest.raises(TaskTimeout):
+        with Scheduler.deadline(0.1):
+            await Scheduler.run_in_thread(module.blocking_read, 0)
+    elapsed = perf_counter() - start
+    await running
+    stats = Scheduler.stats()["tasks"]["ThreadModule.blocking_read"]
+    Scheduler.stop()
+    assert elapsed < 0.3
+    assert stats["timeout_count"] == 1
+    assert stats["run_count"] == 2
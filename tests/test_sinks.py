@@ -0,0 +1,155 @@
+import asyncio
+import json
+import os
+import pytest
+from unittest.mock import patch
+from healthagent.config import SinksConfig
+from healthagent.reporter import Reporter, HealthReport, HealthStatus, Sinks, JetpackSink
+from healthagent.sinks import Sink, FileSink, PrometheusSink, NdjsonSink, write_atomic
+
+
+@pytest.fixture(autouse=True)
+def reset_sinks():
+    yield
+    Sinks.configure(SinksConfig())
+
+
+def make_reporter(module="gpu") -> Reporter:
+    reporter = Reporter()
+    reporter.publish_cc = False
+    reporter.module = module
+    return reporter
+
+
+def read_ndjson(path) -> list:
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+class TestConfigure:
+
+    def test_defaults(self):
+        Sinks.configure(SinksConfig())
+        assert [type(sink) for sink in Sinks._sinks] == [JetpackSink]
+        assert Sinks.stats() == {}
+
+    def test_enabled_sinks(self, tmp_path):
+        config = SinksConfig.model_validate({
+            "prometheus": {"enabled": True, "path": "/tmp/metrics/healthagent.prom"},
+            "ndjson": {"enabled": True},
+        })
+        Sinks.configure(config, rundir=str(tmp_path))
+        assert Sinks.get("prometheus").path == "/tmp/metrics/healthagent.prom"
+        assert Sinks.get("ndjson").path == str(tmp_path / "reports.ndjson")
+        assert set(Sinks.stats()) == {"prometheus", "ndjson"}
+
+
+class TestPrometheusSink:
+
+    async def test_batched_atomic_write(self, tmp_path):
+        path = str(tmp_path / "healthagent.prom")
+        sink = PrometheusSink(path, interval=0.05)
+        Sinks.add(sink)
+        reporter = make_reporter()
+        with patch("healthagent.sinks.write_atomic", wraps=write_atomic) as write:
+            for status in (HealthStatus.ERROR, HealthStatus.OK, HealthStatus.WARNING):
+                await reporter.update_report("GpuHealthChecks", HealthReport(status=status))
+            await reporter.update_report("XidCheck", HealthReport(status=HealthStatus.ERROR))
+            assert not os.path.exists(path)
+            await asyncio.sleep(0.2)
+        write.assert_called_once()
+        assert not os.path.exists(f"{path}.tmp")
+        with open(path) as f:
+            text = f.read()
+        assert 'healthagent_report_status{module="gpu",report="GpuHealthChecks"} 2\n' in text
+        assert 'healthagent_report_status{module="gpu",report="XidCheck"} 3\n' in text
+        assert "# TYPE healthagent_report_status gauge" in text
+        stats = sink.stats()
+        assert stats["queued"] == 4 and stats["written"] == 2 and stats["batches"] == 1
+
+        reporter.remove_report("XidCheck")
+        await sink.flush()
+        with open(path) as f:
+            assert "XidCheck" not in f.read()
+
+    async def test_load_and_escaping(self, tmp_path):
+        path = str(tmp_path / "healthagent.prom")
+        sink = PrometheusSink(path, interval=60)
+        sink.load('mod"1', {"a\\b": HealthReport(status=HealthStatus.OK).snapshot()})
+        await sink.close()
+        with open(path) as f:
+            assert 'healthagent_report_status{module="mod\\"1",report="a\\\\b"} 1\n' in f.read()
+
+
+class TestNdjsonSink:
+
+    async def test_audit_log(self, tmp_path):
+        path = str(tmp_path / "reports.ndjson")
+        sink = NdjsonSink(path, interval=60, max_bytes=0)
+        Sinks.add(sink)
+        reporter = make_reporter()
+        await reporter.update_report("XidCheck", HealthReport(status=HealthStatus.ERROR, details="Xid 79"))
+        await reporter.update_report("XidCheck", HealthReport(status=HealthStatus.ERROR, details="Xid 79"))
+        await reporter.update_report("XidCheck", HealthReport())
+        reporter.remove_report("XidCheck")
+        await sink.flush()
+
+        records = read_ndjson(path)
+        assert [(r["report"], r.get("status"), r.get("removed")) for r in records] == [
+            ("XidCheck", "Error", None), ("XidCheck", "OK", None), ("XidCheck", None, True)]
+        # Details are excluded from the CLI but not from the audit log.
+        assert records[0]["details"] == "Xid 79" and records[0]["module"] == "gpu"
+        assert records[0]["version"] < records[1]["version"]
+
+    async def test_serialized_on_flush(self, tmp_path):
+        """Publishing only queues the report, it is serialized with its batch."""
+        path = str(tmp_path / "reports.ndjson")
+        sink = NdjsonSink(path, interval=60, max_bytes=0)
+        with patch("healthagent.sinks.json.dumps") as dumps:
+            await sink.publish(make_reporter(), "XidCheck", HealthReport().snapshot())
+            sink.remove("gpu", "XidCheck")
+        dumps.assert_not_called()
+        await sink.flush()
+        assert [r.get("removed") for r in read_ndjson(path)] == [None, True]
+        with pytest.raises(TypeError):
+            FileSink(path, interval=60)
+
+    async def test_rotation(self, tmp_path):
+        path = str(tmp_path / "reports.ndjson")
+        sink = NdjsonSink(path, interval=60, max_bytes=0)
+        reporter = make_reporter()
+        await sink.publish(reporter, "check0", HealthReport(message="x" * 100).snapshot())
+        await sink.flush()
+        # Room for two records.
+        sink.max_bytes = os.path.getsize(path) * 5 // 2
+        for i in range(1, 5):
+            await sink.publish(reporter, f"check{i}", HealthReport(message="x" * 100).snapshot())
+            await sink.flush()
+        assert os.path.getsize(path) <= sink.max_bytes
+        assert [r["report"] for r in read_ndjson(f"{path}.1")] == ["check2", "check3"]
+        assert [r["report"] for r in read_ndjson(path)] == ["check4"]
+
+    async def test_close_writes_pending(self, tmp_path):
+        path = str(tmp_path / "reports.ndjson")
+        sink = NdjsonSink(path, interval=60, max_bytes=0)
+        await sink.publish(make_reporter(), "XidCheck", HealthReport().snapshot())
+        await sink.close()
+        assert len(read_ndjson(path)) == 1
+        assert sink.stats()["pending"] == 0
+
+
+async def test_failing_sink_does_not_stop_others(tmp_path):
+    class BrokenSink(Sink):
+        name = "broken"
+
+        async def publish(self, reporter, name, report):
+            raise OSError("disk full")
+
+    path = str(tmp_path / "reports.ndjson")
+    Sinks.add(BrokenSink())
+    Sinks.add(NdjsonSink(path, interval=60, max_bytes=0))
+    reporter = make_reporter()
+    await reporter.update_report("XidCheck", HealthReport(status=HealthStatus.ERROR))
+    assert reporter.get_report("XidCheck").status == HealthStatus.ERROR
+    await Sinks.close()
+    assert len(read_ndjson(path)) == 1
@@ -0,0 +1,225 @@
+import asyncio
+import errno
+import json
+import os
+import pickle
+import pytest
+from datetime import datetime
+from unittest.mock import patch
+from healthagent.config import StateConfig
+from healthagent.healthagent import Healthagent
+from healthagent.reporter import Reporter, HealthReport, HealthStatus, ReportEvents
+from healthagent.statestore import StateStore, encode, decode, SCHEMA_VERSION, SNAPSHOT_FILE, JOURNAL_FILE
+from healthagent.util import freeze
+
+
+@pytest.fixture
+def store(tmp_path):
+    """StateStore writing to tmp_path, flushing right away."""
+    StateStore.configure(StateConfig(flush_interval=0.01, compact_after=1000), directory=str(tmp_path))
+    yield tmp_path
+    StateStore.configure(StateConfig(), directory=None)
+
+
+async def restart(tmp_path) -> None:
+    """Drop the in-memory state, as a new daemon would start with."""
+    await StateStore.close()
+    StateStore.configure(StateConfig(flush_interval=0.01, compact_after=StateStore.COMPACT_AFTER), directory=str(tmp_path))
+
+
+def journal_lines(tmp_path) -> list:
+    with open(tmp_path / JOURNAL_FILE) as f:
+        return [json.loads(line) for line in f]
+
+
+class TestEncode:
+
+    def test_roundtrip(self):
+        value = {
+            "status": HealthStatus.ERROR,
+            "when": datetime(2026, 1, 2, 3, 4, 5),
+            "xids": {43, 79},
+            "key": ("ib0", "link_downed", "1"),
+            ("ib0", 1): [1, 2.5, None, True],
+            "nested": {"__reserved": "x"},
+        }
+        encoded = json.loads(json.dumps(encode(value)))
+        assert decode(encoded) == value
+
+    def test_frozen_values_come_back_mutable(self):
+        decoded = decode(json.loads(json.dumps(encode(freeze({"a": [1, 2]})))))
+        assert type(decoded) is dict and type(decoded["a"]) is list
+
+    def test_frozen_values_encoded_once(self):
+        value = freeze({"a": [1, 2]})
+        assert encode(value) is encode(value)
+        assert encode(value)["a"] is encode(value["a"])
+
+    def test_unsupported_type(self):
+        with pytest.raises(TypeError):
+            encode(object())
+
+
+class TestStateStore:
+
+    async def test_journal_survives_restart(self, store):
+        await StateStore.load()
+        report = HealthReport(status=HealthStatus.WARNING, message="m", custom_fields={"xid": [43]})
+        StateStore.record_report("gpu", "XidCheck", report.to_state())
+        StateStore.record_report("gpu", "Other", HealthReport().to_state())
+        StateStore.record_removal("gpu", "Other")
+        StateStore.record_module_state("network", {"trigger_count": [[("ib0", "state", "1"), 2]]})
+        await StateStore.flush()
+        assert len(journal_lines(store)) == 4
+
+        StateStore.configure(StateConfig(), directory=str(store))
+        reports = await StateStore.reports("gpu")
+        assert list(reports) == ["XidCheck"]
+        restored = HealthReport.from_state(reports["XidCheck"])
+        assert restored == report.snapshot()
+        assert restored.frozen
+        assert await StateStore.module_state("network") == {"trigger_count": [[("ib0", "state", "1"), 2]]}
+        assert await StateStore.reports("kmsg") is None
+
+    async def test_flush_is_batched(self, store):
+        await StateStore.load()
+        with patch.object(StateStore, "write", wraps=StateStore.write) as write:
+            for i in range(5):
+                StateStore.record_module_state("kmsg", {"seq": i})
+            await StateStore.flush()
+        write.assert_called_once()
+        assert [record["seq"] for record in journal_lines(store)] == [1, 2, 3, 4, 5]
+
+    async def test_failed_write_retried(self, store):
+        await StateStore.load()
+        write = StateStore.write
+        calls = []
+
+        def failing_once(directory, records, snapshot=None):
+            calls.append([record["seq"] for record in records])
+            if len(calls) == 1:
+                raise OSError(errno.ENOSPC, "No space left on device")
+            return write(directory, records, snapshot)
+
+        with patch.object(StateStore, "write", staticmethod(failing_once)):
+            StateStore.record_module_state("kmsg", {"seq": 1})
+            StateStore.record_module_state("kmsg", {"seq": 2})
+            await StateStore.flush()
+            assert calls == [[1, 2]]
+            assert StateStore.stats()["pending"] == 2
+            StateStore.record_module_state("kmsg", {"seq": 3})
+            # Retried after 2 * flush_interval, with the record made meanwhile.
+            await asyncio.sleep(0.1)
+        assert calls == [[1, 2], [1, 2, 3]]
+        assert [record["state"] for record in journal_lines(store)] == [{"seq": 1}, {"seq": 2}, {"seq": 3}]
+        assert StateStore.stats()["pending"] == 0
+
+    async def test_unchanged_module_state_not_journaled(self, store):
+        await StateStore.load()
+        StateStore.record_module_state("kmsg", {"seq": 1})
+        StateStore.record_module_state("kmsg", {"seq": 1})
+        assert StateStore.stats()["pending"] == 1
+
+    async def test_records_while_loading_are_kept(self, store):
+        StateStore.record_module_state("kmsg", {"seq": 7})
+        assert await StateStore.module_state("kmsg") == {"seq": 7}
+
+    async def test_compaction(self, store):
+        StateStore.COMPACT_AFTER = 3
+        await StateStore.load()
+        for i in range(3):
+            StateStore.record_module_state("kmsg", {"seq": i})
+        await StateStore.flush()
+        assert journal_lines(store) == []
+        with open(store / SNAPSHOT_FILE) as f:
+            snapshot = json.load(f)
+        assert snapshot["seq"] == 3 and snapshot["modules"]["kmsg"] == {"seq": 2}
+
+        StateStore.record_module_state("kmsg", {"seq": 3})
+        await restart(store)
+        assert await StateStore.module_state("kmsg") == {"seq": 3}
+        assert StateStore.stats()["seq"] == 4
+
+    async def test_close_compacts(self, store):
+        await StateStore.load()
+        StateStore.record_module_state("kmsg", {"seq": 1})
+        await StateStore.close()
+        assert journal_lines(store) == []
+        assert os.path.exists(store / SNAPSHOT_FILE)
+
+    async def test_torn_record_ignored(self, store):
+        await StateStore.load()
+        StateStore.record_module_state("kmsg", {"seq": 1})
+        await StateStore.flush()
+        with open(store / JOURNAL_FILE, "a") as f:
+            f.write('{"v": 1, "seq": 2, "type": "mod')
+        StateStore.configure(StateConfig(), directory=str(store))
+        assert await StateStore.module_state("kmsg") == {"seq": 1}
+
+    async def test_other_schema_version_ignored(self, store):
+        with open(store / SNAPSHOT_FILE, "w") as f:
+            json.dump({"v": SCHEMA_VERSION + 1, "seq": 1, "modules": {"kmsg": {"seq": 9}}, "reports": {}}, f)
+        with open(store / JOURNAL_FILE, "w") as f:
+            f.write(json.dumps({"v": SCHEMA_VERSION + 1, "seq": 2, "type": "module", "module": "gpu", "state": 1}) + "\n")
+        assert await StateStore.module_state("kmsg") is None
+        assert await StateStore.module_state("gpu") is None
+
+    async def test_records_in_snapshot_skipped(self, store):
+        """Records written before a crash between the snapshot and the journal truncation."""
+        with open(store / SNAPSHOT_FILE, "w") as f:
+            json.dump({"v": SCHEMA_VERSION, "seq": 2, "modules": {"kmsg": {"seq": 20}}, "reports": {}}, f)
+        with open(store / JOURNAL_FILE, "w") as f:
+            for seq in (1, 2, 3):
+                f.write(json.dumps({"v": SCHEMA_VERSION, "seq": seq, "type": "module",
+                                    "module": "gpu" if seq == 3 else "kmsg", "state": {"seq": seq}}) + "\n")
+        assert await StateStore.module_state("kmsg") == {"seq": 20}
+        assert await StateStore.module_state("gpu") == {"seq": 3}
+        StateStore.record_module_state("kmsg", {"seq": 21})
+        assert StateStore.stats()["seq"] == 4
+
+    async def test_not_configured(self):
+        StateStore.record_module_state("kmsg", {"seq": 1})
+        assert StateStore.stats()["pending"] == 0
+
+
+class TestReporterState:
+
+    async def test_reports_survive_restart(self, store):
+        await StateStore.load()
+        reporter = Reporter.from_state({})
+        reporter.module = "gpu"
+        await reporter.update_report("XidCheck", HealthReport(status=HealthStatus.ERROR, message="Xid 79"))
+        await reporter.update_report("Gone", HealthReport())
+        del reporter.store["Gone"]
+        StateStore.record_removal("gpu", "Gone")
+        await restart(store)
+
+        with patch.object(Healthagent, "rundir", str(store)):
+            restored = await Healthagent.get_reporter("gpu")
+        assert restored.module == "gpu"
+        assert list(restored.store) == ["XidCheck"]
+        assert restored.get_report("XidCheck") == reporter.get_report("XidCheck")
+
+    async def test_legacy_pickle_migrated(self, store):
+        legacy = Reporter()
+        legacy.store["KernelLogCheck"] = HealthReport(status=HealthStatus.WARNING, message="alert")
+        with patch.object(Healthagent, "rundir", str(store)):
+            with open(Healthagent.get_module_file("kmsg"), "wb") as f:
+                pickle.dump(legacy, f)
+            reporter = await Healthagent.get_reporter("kmsg")
+            assert not os.path.exists(Healthagent.get_module_file("kmsg"))
+        assert reporter.get_report("KernelLogCheck").message == "alert"
+
+        await restart(store)
+        reports = await StateStore.reports("kmsg")
+        assert HealthReport.from_state(reports["KernelLogCheck"]).status == HealthStatus.WARNING
+
+    async def test_unencodable_report_still_published(self, store):
+        await StateStore.load()
+        reporter = Reporter.from_state({})
+        reporter.module = "gpu"
+        with patch.object(ReportEvents, "emit") as emit:
+            await reporter.update_report("XidCheck", HealthReport(status=HealthStatus.ERROR, aux_data={"lock": object()}))
+        emit.assert_called_once()
+        assert reporter.get_report("XidCheck").status == HealthStatus.ERROR
+        assert StateStore.stats()["pending"] == 0
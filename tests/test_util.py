@@ -1,5 +1,9 @@
-from healthagent.util import evaluate, read_kernel_attrs, TimeSeries
+from healthagent.util import evaluate, read_kernel_attrs, read_peak_rss, TimeSeries, LatencyStats, TokenBucket
+from healthagent.util import FrozenDict, FrozenList, freeze, thaw
 from pathlib import Path
+import os
+import pickle
+import json
 import pytest
 
 
@@ -265,6 +269,114 @@ class TestTimeSeries:
         assert sufficient is True
         assert delta == 0
 
+    def test_dump_load_roundtrip(self):
+        ts = TimeSeries(maxlen=3)
+        for value, timestamp in [(1, 0.0), (2, 60.0), (5, 120.0), (9, 180.0)]:
+            ts.record(value, timestamp=timestamp)
+        data = json.loads(json.dumps(ts.dump()))
+        restored = TimeSeries.load(data)
+        assert list(restored._samples) == list(ts._samples)
+        assert restored._samples.maxlen == 3
+        assert restored.delta_in_window(120) == ts.delta_in_window(120) == (7, True)
+
+
+class TestLatencyStats:
+
+    def test_empty(self):
+        stats = LatencyStats()
+        assert stats.summary() == {"count": 0, "p50": None, "p95": None, "max": None}
+
+    def test_percentiles(self):
+        stats = LatencyStats()
+        for i in range(1, 101):
+            stats.record(i / 100)
+        summary = stats.summary()
+        assert summary["count"] == 100
+        assert summary["p50"] == 0.5
+        assert summary["p95"] == 0.95
+        assert summary["max"] == 1.0
+
+    def test_window_keeps_lifetime_max(self):
+        stats = LatencyStats(maxlen=2)
+        stats.record(5.0)
+        stats.record(1.0)
+        stats.record(2.0)
+        assert len(stats) == 2
+        assert stats.count == 3
+        assert stats.percentile(95) == 2.0
+        assert stats.max == 5.0
+
+
+class TestTokenBucket:
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=2, burst=3)
+        assert [bucket.take(100.0) for _ in range(3)] == [0, 0, 0]
+        assert bucket.take(100.0) == pytest.approx(0.5)
+        assert bucket.take(100.5) == 0
+        assert bucket.take(100.5) == pytest.approx(0.5)
+
+    def test_refill_capped_at_burst(self):
+        bucket = TokenBucket(rate=1, burst=2)
+        bucket.take(0.0)
+        bucket.take(0.0)
+        assert bucket.take(1000.0) == 0
+        assert bucket.take(1000.0) == 0
+        assert bucket.take(1000.0) == pytest.approx(1.0)
+
+
+class TestFreeze:
+    def test_freeze_nested(self):
+        frozen = freeze({"a": [1, {"b": 2}], "c": {3}, "d": (4, [5])})
+        assert isinstance(frozen, FrozenDict)
+        assert isinstance(frozen["a"], FrozenList)
+        assert isinstance(frozen["a"][1], FrozenDict)
+        assert frozen["c"] == frozenset({3})
+        assert isinstance(frozen["d"][1], FrozenList)
+        assert frozen == {"a": [1, {"b": 2}], "c": {3}, "d": (4, [5])}
+        assert json.dumps(frozen["a"]) == '[1, {"b": 2}]'
+
+    def test_mutators_raise(self):
+        frozen = freeze({"a": [1]})
+        for mutate in (lambda: frozen.__setitem__("b", 1), lambda: frozen.pop("a"),
+                       lambda: frozen.update(b=1), lambda: frozen.setdefault("b"),
+                       lambda: frozen["a"].append(2), lambda: frozen["a"].sort()):
+            with pytest.raises(TypeError):
+                mutate()
+        with pytest.raises(TypeError):
+            frozen["a"] += [2]
+        assert frozen == {"a": [1]}
+
+    def test_frozen_values_are_shared(self):
+        inner = freeze({"b": [1]})
+        assert freeze(inner) is inner
+        assert freeze({"a": inner})["a"] is inner
+        plain = (1, "x")
+        assert freeze(plain) is plain
+
+    def test_thaw(self):
+        frozen = freeze({"a": [1]})
+        thawed = thaw(frozen)
+        thawed["b"] = 2
+        assert type(thawed) is dict and "b" not in frozen
+        assert thawed["a"] is frozen["a"]
+        assert thaw(5) == 5
+
+    def test_pickle(self):
+        frozen = freeze({"a": [1, {"b": 2}]})
+        restored = pickle.loads(pickle.dumps(frozen))
+        assert restored == frozen
+        assert isinstance(restored["a"], FrozenList)
+
+
+class TestReadPeakRss:
+
+    def test_own_process(self):
+        assert read_peak_rss(os.getpid()) > 0
+
+    def test_missing_process(self):
+        assert read_peak_rss(2**22 + 1) is None
+
 
 class TestEvaluateWindowGt:
 